@@ -1,18 +1,31 @@
 # Audio extraction
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import ffmpeg
 import logging
+import os
 import re
 import sys
 
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.probe_cache import ProbeCache
+from useful_functions.profiling import profile_stage, profiling_mode
 from useful_functions.useful_functions import set_up_logging
 
+# ffmpeg codecs for the PCM sample formats that the `.wav` readers support
+PCM_CODECS = {"u8": "pcm_u8", "s16": "pcm_s16le", "s32": "pcm_s32le"}
 
 def extract_audio_from_video(
     date_folder_path,
     video_extensions=[".mp4", ".mov"],
     log_level=logging.WARNING,
+    output_format="mp3",
+    sample_rate=None,
+    channels=None,
+    sample_format="s16",
+    cache_path=None,
+    threads=None,
 ):
     """
     Function that goes into the directory and extracts audio from all `.mp4` 
@@ -31,16 +44,62 @@ def extract_audio_from_video(
     A integer representing the logging level. See
     https://docs.python.org/3/howto/logging.html#when-to-use-logging for 
     descriptions of the various levels
+
+    output_format | str
+    "mp3" writes a best quality `_raw.mp3` file. "wav" has ffmpeg write a PCM
+    `_raw.wav` file directly, which silence removal can read without
+    converting it first.
+
+    sample_rate | int
+    Sample rate of the `.wav` output in Hz. The default keeps the sample rate
+    of the video.
+
+    channels | int
+    Number of channels of the `.wav` output. The default keeps the channels
+    of the video.
+
+    sample_format | str
+    Sample format of the `.wav` output, one of the keys of `PCM_CODECS`.
+
+    cache_path | str or pathlib.PosixPath
+    Path to the `ProbeCache` file. Files that haven't changed since they were
+    last probed aren't probed again, and their audio isn't extracted again if
+    the output is still there. The default is `.probe_cache.sqlite` in the
+    parent folder of `date_folder_path`.
+
+    threads | int
+    Passed to ffmpeg as `-threads` for both the decoder and the encoder. The
+    default lets ffmpeg decide, which can use every core.
     
     Returns:
     It returns a string that tells you how many audio files were extracted.
     """
 
+    if output_format not in ["mp3", "wav"]:
+        raise Exception(f"Error, {output_format} is not a supported format!")
+    if sample_format not in PCM_CODECS:
+        raise Exception(f"Error, {sample_format} is not a supported format!")
+
     # Make the date folder if it doesn't already exist
     Path(date_folder_path).mkdir(exist_ok=True)
 
     set_up_logging(log_path="logging/", log_level=log_level)
 
+    if cache_path is None:
+        cache_path = Path(date_folder_path).resolve().parent / ".probe_cache.sqlite"
+    probe_cache = ProbeCache(cache_path)
+
+    # ffmpeg output options, which are also stored in the cache so that a
+    # change of format extracts the audio again
+    if output_format == "wav":
+        output_options = {"acodec": PCM_CODECS[sample_format], "map": "a"}
+        if sample_rate is not None:
+            output_options["ar"] = sample_rate
+        if channels is not None:
+            output_options["ac"] = channels
+    else:
+        output_options = {"qscale:a": 0, "map": "a"}
+
     # Create a counter for the number of audio files processed
     audio_file_counter = 0
 
@@ -50,65 +109,84 @@ def extract_audio_from_video(
         logging.debug(f"Detected file: {child.name}")
         # Store the extension of the file name
         file_extension = Path(child.name).suffix
-        # If the file's extension is in `video_extensions`
-        if file_extension in video_extensions:
-            # Do an ffmpeg probe on the currently selected file
-            current_probe = ffmpeg.probe(child)
-            # If the number of streams is more than 1
-            # (as a proxy for if the file could have audio)
-            if len(current_probe["streams"]) > 1:
-                # Check if `codec_type` is audio
-                for stream in current_probe["streams"]:
-                    # Debugging: print the codec type
-                    logging.debug(f'Codec type: {stream["codec_type"]}')
-                    # If the codec type is audio
-                    if stream["codec_type"] == "audio":
-                        # Debugging: print the video file's path
-                        logging.debug(f"Audio codec detected: {child}")
-                        # Store the video file path
-                        new_child = str(child)
-                        # Replace the extension with .mp3
-                        new_child = re.sub(
-                            pattern=f"{file_extension}$",
-                            repl="_raw.mp3",
-                            string=new_child,
-                        )
-
-                        # Information about the ffmpeg command:
-                        ## ffmpeg -i input.mp4 -vn -q:a 0 -map a audio.mp3
-                        ## '-i' is the input, '-vn' excludes video,
-                        ## '-q:a' is the mp3 encoding,
-                        ## '0' is the best quality mp3 encoding,
-                        ## '-map a' only grabs audio
-
-                        # Using ffmpeg to transform the video file into a .mp3
-                        # file
-                        try:
-                            # Create a variable to store the audio file's path
-                            audio_file_path = Path(date_folder_path).joinpath(
-                                Path(new_child).name
-                            )
-                            # Debugging: print the audio file's path
-                            logging.debug(
-                                "Audio file extracted to: "
-                                + f"{audio_file_path}"
-                            )
-
-                            error_message = (
-                                ffmpeg.input(str(child))
-                                .output(
-                                    filename=str(audio_file_path),
-                                    **{"qscale:a": 0, "map": "a"},
-                                )
-                                .overwrite_output()
-                                .run()
-                            )
-                        # Print the error message if the try doesn't work
-                        except ffmpeg.Error as error_message:
-                            print("ffmpeg stderr:", error_message.stderr())
-                            raise error_message
-
-                        audio_file_counter += 1
+        # If the file's extension is not in `video_extensions`, skip it
+        if file_extension not in video_extensions:
+            continue
+        # Get the streams of the currently selected file, only running an
+        # ffmpeg probe if the file is new or has changed
+        current_probe = probe_cache.probe(child)
+        # Check if `codec_type` is audio
+        for stream in current_probe["streams"]:
+            # Debugging: print the codec type
+            logging.debug(f'Codec type: {stream["codec_type"]}')
+        audio_streams = [
+            stream
+            for stream in current_probe["streams"]
+            if stream["codec_type"] == "audio"
+        ]
+        # If the number of streams is more than 1
+        # (as a proxy for if the file could have audio)
+        # and one of them is audio
+        if len(current_probe["streams"]) <= 1 or not audio_streams:
+            continue
+        # Debugging: print the video file's path
+        logging.debug(f"Audio codec detected: {child}")
+        # Replace the extension with .mp3 or .wav
+        new_child = re.sub(
+            pattern=f"{file_extension}$",
+            repl=f"_raw.{output_format}",
+            string=str(child),
+        )
+        # Create a variable to store the audio file's path
+        audio_file_path = Path(date_folder_path).joinpath(Path(new_child).name)
+
+        # '-map a' extracts every audio stream in one run, so each file is
+        # extracted once, and not again while it stays the same
+        if probe_cache.is_extracted(child, audio_file_path, output_options):
+            logging.debug(f"Audio already extracted to: {audio_file_path}")
+            continue
+
+        # Information about the ffmpeg command:
+        ## ffmpeg -i input.mp4 -vn -q:a 0 -map a audio.mp3
+        ## '-i' is the input, '-vn' excludes video,
+        ## '-q:a' is the mp3 encoding,
+        ## '0' is the best quality mp3 encoding,
+        ## '-map a' only grabs audio
+        ## For .wav output, '-acodec pcm_s16le' writes 16 bit
+        ## PCM and '-ar'/'-ac' set the sample rate and the
+        ## number of channels
+
+        # Using ffmpeg to transform the video file into a .mp3 or .wav file
+        try:
+            # Debugging: print the audio file's path
+            logging.debug(f"Audio file extracted to: {audio_file_path}")
+
+            # The number of threads doesn't change the output, so it isn't
+            # part of the cached options
+            thread_options = {} if threads is None else {"threads": threads}
+            with StageTimer("extract", folder=child.parent) as timer:
+                timer.count(
+                    bytes=child.stat().st_size,
+                    audio_seconds=current_probe["duration"] or 0.0,
+                )
+                error_message = (
+                    ffmpeg.input(str(child), **thread_options)
+                    .output(
+                        filename=str(audio_file_path),
+                        **output_options,
+                        **thread_options,
+                    )
+                    .overwrite_output()
+                    .run()
+                )
+        # Print the error message if the try doesn't work
+        except ffmpeg.Error as error_message:
+            print("ffmpeg stderr:", error_message.stderr())
+            raise error_message
+
+        probe_cache.record_extraction(child, audio_file_path, output_options)
+        audio_file_counter += 1
+    probe_cache.close()
     # Return a print message that states how many audio files were extracted
     if audio_file_counter == 1:
         file_word = "file"
@@ -118,37 +196,108 @@ def extract_audio_from_video(
     return str(audio_file_counter) + " audio " + file_word + " extracted!"
 
 
-def test_audio_extraction(date_folder):
+def extraction_jobs(date_folder):
+    """
+    Function that collects the filename folders of a date across all sources
+    in `../data`.
+
+    Arguments:
+    date_folder | str
+    The date folder, e.g. "2021-07-14".
+
+    Returns:
+    list
+    Paths to the filename folders.
+    """
+    jobs = []
     for source in Path(Path.cwd().parent, "data").glob("[!.]*"):
         date_folder_path = Path(source, date_folder)
         # If the date folder exists for the source, extract audio
         if date_folder_path.exists():
-            # Testing function
             for file_folder in date_folder_path.iterdir():
                 # Ignore hidden files that start with "."
-                if not (file_folder.stem.startswith(".")):
-                    logging.info("Video path: ", file_folder)
-                    # Test the function
-                    extract_audio_from_video(
-                        date_folder_path=Path(date_folder_path).joinpath(
-                            file_folder
-                        ),
-                        log_level=logging.DEBUG,
-                    )
+                if not (file_folder.stem.startswith(".")) and file_folder.is_dir():
+                    job = Path(date_folder_path).joinpath(file_folder).resolve()
+                    # An absolute date folder path is the same for every
+                    # source, so only add each folder once
+                    if job not in jobs:
+                        logging.info(f"Video path: {file_folder}")
+                        jobs.append(job)
         # It's okay if the source folder doesn't have the date folder
         else:
             logging.info(
                 f"Source {source} does not have the date folder {date_folder}."
             )
+    return jobs
 
 
-# The first argument after the script name should be the date folder
-try:
-    test_audio_extraction(date_folder=sys.argv[1])
-    print("Audio extraction complete")
-# Raise error if date argument is missing
-except (IndexError):
-    raise Exception(
-        f"Error, you must supply a date like the example below:\n"
-        + "python audio_extraction.py 2021-07-14"
+def test_audio_extraction(date_folder, workers=None, cpu_budget=None):
+    """
+    Function that extracts the audio of every filename folder of a date, for
+    all sources, running several ffmpeg processes at a time.
+
+    Arguments:
+    date_folder | str
+    The date folder, e.g. "2021-07-14".
+
+    workers | int
+    The number of ffmpeg processes running at the same time, at most
+    `cpu_budget`. The default is `cpu_budget`.
+
+    cpu_budget | int
+    The total number of threads the ffmpeg processes may use together; each
+    process gets `cpu_budget // workers` threads. The default is the number
+    of CPUs.
+    """
+    if cpu_budget is None:
+        cpu_budget = os.cpu_count()
+    # Every process needs at least one thread, so more workers than the budget
+    # would use more threads than the budget
+    workers = cpu_budget if workers is None else min(workers, cpu_budget)
+    threads = cpu_budget // workers
+    jobs = extraction_jobs(date_folder)
+    logging.info(
+        f"Extracting {len(jobs)} folders with {workers} workers and "
+        + f"{threads} ffmpeg threads each"
     )
+
+    # ffmpeg does the work in its own process, so threads are enough here
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                extract_audio_from_video,
+                date_folder_path=job,
+                log_level=logging.DEBUG,
+                output_format="wav",
+                threads=threads,
+            )
+            for job in jobs
+        ]
+        for future in futures:
+            # Raise the first error, like extracting one folder at a time
+            future.result()
+
+
+# The first argument after the script name should be the date folder
+if __name__ == "__main__":
+    # Flags like --profile aren't positional arguments
+    arguments = [argument for argument in sys.argv if not argument.startswith("--")]
+    try:
+        # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+        with profile_stage(
+            f"extraction_{arguments[1]}", "logging/profiles/", profiling_mode()
+        ):
+            test_audio_extraction(
+                date_folder=arguments[1],
+                workers=int(arguments[2]) if len(arguments) > 2 else None,
+                cpu_budget=int(arguments[3]) if len(arguments) > 3 else None,
+            )
+        print("Audio extraction complete")
+        # Latency and throughput of the probes and extractions of this run
+        write_report("logging/")
+    # Raise error if date argument is missing
+    except (IndexError):
+        raise Exception(
+            f"Error, you must supply a date like the example below:\n"
+            + "python audio_extraction.py 2021-07-14 [workers] [cpu_budget]"
+        )
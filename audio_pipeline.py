@@ -0,0 +1,287 @@
+# audio_pipeline.py
+# Runs audio extraction, silence removal and segmentation for every filename
+# folder in a date folder, using a pool of worker processes
+
+# To run the pipeline, do
+# `python audio_pipeline.py /path/to/source/date --workers 4`
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+import argparse
+import logging
+import os
+import sys
+
+# The stage scripts are in sibling folders, so add those folders to the path
+PROCESSING_PATH = Path(__file__).resolve().parent
+for stage_folder in ["audio_extraction", "silence-removal", "segmentation"]:
+    sys.path.insert(0, str(Path(PROCESSING_PATH, stage_folder)))
+
+from audio_extraction import extract_audio_from_video
+from segmentation import segment
+from vad import remove_silences, remove_silences_and_segment
+
+from useful_functions.instrumentation import add_records, pop_records, write_report
+from useful_functions.profiling import (
+    PROFILE_MODES,
+    hot_functions,
+    profile_stage,
+    profiling_mode,
+    write_hot_functions,
+)
+from useful_functions.useful_functions import set_up_logging
+
+
+def process_folder(
+    folder_path,
+    ffmpeg_threads=None,
+    fused=False,
+    keep_processed=False,
+    profile=None,
+    profile_folder=None,
+    analysis_rate=None,
+):
+    """
+    Function that runs every stage of the audio pipeline on one filename
+    folder. Errors (including the `exit(1)` calls of the stages) are caught
+    and returned so that the other folders keep going.
+
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    Path to the filename folder that contains the downloaded media.
+
+    ffmpeg_threads | int
+    The number of threads ffmpeg may use for the audio extraction.
+
+    fused | bool
+    If True, silence removal writes the segments directly instead of a
+    `_processed.wav` file that segmentation reads again.
+
+    keep_processed | bool
+    If `fused`, also write the `_processed.wav` file.
+
+    profile | str
+    "cprofile" or "sample" profiles each stage, see
+    `profiling.profile_stage`. None doesn't profile.
+
+    profile_folder | str or pathlib.PosixPath
+    Folder to write the profiles to.
+
+    analysis_rate | int
+    If given, silence removal finds the silences in a mono copy of the audio
+    at this sample rate, see `vad.remove_silences`.
+
+    Returns:
+    tuple
+    The folder path, the name of the stage that failed (None if every stage
+    finished), the error message and the stage timings of the folder (from
+    `instrumentation.pop_records`).
+    """
+    stages = [
+        (
+            "audio extraction",
+            extract_audio_from_video,
+            {
+                "date_folder_path": Path(folder_path),
+                "output_format": "wav",
+                "threads": ffmpeg_threads,
+            },
+        ),
+    ]
+    if fused:
+        stages.append(
+            (
+                "silence removal and segmentation",
+                remove_silences_and_segment,
+                {
+                    "date_folder": Path(folder_path),
+                    "keep_processed": keep_processed,
+                    "analysis_rate": analysis_rate,
+                },
+            )
+        )
+    else:
+        stages += [
+            (
+                "silence removal",
+                remove_silences,
+                {"date_folder": Path(folder_path), "analysis_rate": analysis_rate},
+            ),
+            ("segmentation", segment, {"folder_path": Path(folder_path)}),
+        ]
+    for stage_name, stage, arguments in stages:
+        try:
+            with profile_stage(
+                f"{stage_name}_{Path(folder_path).name}", profile_folder, profile
+            ):
+                stage(**arguments)
+        except SystemExit as exit_error:
+            return (
+                folder_path,
+                stage_name,
+                f"exited with code {exit_error.code}",
+                pop_records(),
+            )
+        except Exception as error:
+            logging.exception(f"{stage_name} failed for {folder_path}")
+            return folder_path, stage_name, repr(error), pop_records()
+    # The timings are sent back to the main process for the run's report
+    return folder_path, None, "", pop_records()
+
+
+def run_pipeline(
+    date_folder,
+    workers=None,
+    fused=False,
+    keep_processed=False,
+    report_folder="logging/audio_pipeline/",
+    profile=None,
+    analysis_rate=None,
+):
+    """
+    Function that processes all filename folders of a date folder in parallel.
+
+    Arguments:
+    date_folder | str or pathlib.PosixPath
+    Path to the date folder, e.g. `data/reddit/2021-07-08`.
+
+    workers | int
+    The number of worker processes, at most the number of CPUs. The default
+    is the number of CPUs.
+
+    fused | bool
+    Run silence removal and segmentation in a single pass.
+
+    keep_processed | bool
+    Keep the `_processed.wav` files when `fused`.
+
+    report_folder | str or pathlib.PosixPath
+    Folder to write the latency and throughput of every stage to, see
+    `instrumentation.write_report`. None doesn't write a report.
+
+    profile | str
+    "cprofile" or "sample" profiles every stage of every folder. The
+    profiles are written to a `profiles_<time>` folder in
+    `logging/audio_pipeline/`, with a `hot_functions.csv` table that merges
+    them.
+
+    analysis_rate | int
+    If given, silence removal finds the silences in a mono copy of the audio
+    at this sample rate.
+
+    Returns:
+    dict
+    The failed folders, mapped to the stage that failed and the error.
+    """
+    # Filename folders, excluding hidden files. The stages expect absolute
+    # paths, like the ones `audio_pipeline.command` passes to them
+    folders = sorted(
+        folder
+        for folder in Path(date_folder).resolve().glob("[!.]*")
+        if folder.is_dir()
+    )
+    cpu_count = os.cpu_count()
+    # Every ffmpeg process needs at least one thread, so more workers than
+    # CPUs would use more threads than there are CPUs
+    workers = cpu_count if workers is None else min(workers, cpu_count)
+    print(f"Processing {len(folders)} folders with {workers} workers")
+    # Share the CPUs between the ffmpeg processes of the workers
+    ffmpeg_threads = cpu_count // workers
+    profile_folder = None
+    if profile is not None:
+        current_time = datetime.now().strftime("%Y-%m-%d_%HH%MM%SS")
+        profile_folder = Path("logging/audio_pipeline/", f"profiles_{current_time}")
+
+    failures = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=set_up_logging,
+        initargs=("logging/audio_pipeline/", logging.INFO),
+    ) as executor:
+        futures = [
+            executor.submit(
+                process_folder,
+                folder,
+                ffmpeg_threads,
+                fused,
+                keep_processed,
+                profile,
+                profile_folder,
+                analysis_rate,
+            )
+            for folder in folders
+        ]
+        for future in as_completed(futures):
+            folder_path, failed_stage, error, records = future.result()
+            add_records(records)
+            if failed_stage is None:
+                print(f"Processed {folder_path}")
+            else:
+                print(f"Failed {folder_path} during {failed_stage}: {error}")
+                failures[str(folder_path)] = (failed_stage, error)
+
+    print(f"{len(folders) - len(failures)} of {len(folders)} folders processed")
+    for folder_path, (failed_stage, error) in sorted(failures.items()):
+        print(f"  {folder_path}: {failed_stage} ({error})")
+    if report_folder is not None:
+        report_paths = write_report(report_folder, records=pop_records())
+        if report_paths is not None:
+            print(f"Stage report written to {report_paths[0]}")
+    if profile_folder is not None and profile_folder.is_dir():
+        # One table of the slowest functions across every folder
+        hot_functions_path = Path(profile_folder, "hot_functions.csv")
+        write_hot_functions(hot_functions([profile_folder]), hot_functions_path)
+        print(f"Hot functions written to {hot_functions_path}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the audio pipeline for every folder in a date folder"
+    )
+    parser.add_argument("date_folder", help="path to the source/date folder")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help=(
+            "number of worker processes, at most the number of CPUs "
+            + "(default: number of CPUs)"
+        ),
+    )
+    parser.add_argument(
+        "--fused",
+        action="store_true",
+        help="write the segments during silence removal, in one pass",
+    )
+    parser.add_argument(
+        "--keep-processed",
+        action="store_true",
+        help="with --fused, also write the _processed.wav files",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        default=None,
+        help="profile every stage (default: the PIPELINE_PROFILE variable)",
+    )
+    parser.add_argument(
+        "--analysis-16k",
+        action="store_true",
+        help="find the silences in a 16 kHz mono copy of the audio",
+    )
+    arguments = parser.parse_args()
+
+    set_up_logging(log_path="logging/audio_pipeline/", log_level=logging.INFO)
+    logging.info(f"System arguments: {sys.argv}")
+
+    failures = run_pipeline(
+        arguments.date_folder,
+        workers=arguments.workers,
+        fused=arguments.fused,
+        keep_processed=arguments.keep_processed,
+        profile=arguments.profile or profiling_mode([]),
+        analysis_rate=16000 if arguments.analysis_16k else None,
+    )
+    sys.exit(1 if failures else 0)
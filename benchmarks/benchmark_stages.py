@@ -0,0 +1,460 @@
+# benchmark_stages.py
+# Times each stage of the audio pipeline on synthetic audio and video files and
+# reports the throughput (seconds of audio per second of wall time) and the
+# peak memory use, one JSON record per line
+
+# To run the benchmarks, do
+# `python benchmarks/benchmark_stages.py --lengths 10 60 --output results.jsonl`
+# and to compare two runs, do
+# `python benchmarks/benchmark_stages.py --compare old.jsonl new.jsonl`
+
+from contextlib import redirect_stdout
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy.io.wavfile as wf
+
+# The stage scripts are in sibling folders, so add those folders to the path
+PROCESSING_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROCESSING_PATH))
+for stage_folder in ["audio_extraction", "silence-removal", "segmentation"]:
+    sys.path.insert(0, str(Path(PROCESSING_PATH, stage_folder)))
+
+SAMPLE_RATE = 16000
+
+
+def make_wav(wav_path, seconds, channels, sample_rate=SAMPLE_RATE, seed=0):
+    """
+    Function that writes a 16 bit `.wav` file that looks like speech to the
+    silence removal: bursts of noise of 0.2 to 2 seconds separated by pauses
+    of 0.1 to 1.5 seconds of quiet noise.
+
+    Arguments:
+    wav_path | str or pathlib.PosixPath
+    Where to write the file.
+
+    seconds | float
+    The length of the recording.
+
+    channels | int
+    1 for mono, 2 for stereo.
+
+    sample_rate | int
+    Number of samples per second.
+
+    seed | int
+    Seed of the random numbers, so every run uses the same audio.
+    """
+    generator = np.random.default_rng(seed)
+    number_of_samples = int(seconds * sample_rate)
+    amplitude = np.empty(number_of_samples)
+    position = 0
+    loud = True
+    while position < number_of_samples:
+        length = int(
+            generator.uniform(*((0.2, 2.0) if loud else (0.1, 1.5))) * sample_rate
+        )
+        amplitude[position : position + length] = 4000 if loud else 40
+        position += length
+        loud = not loud
+    noise = generator.standard_normal((number_of_samples, channels))
+    audio_data = (noise * amplitude[:, np.newaxis]).astype(np.int16)
+    if channels == 1:
+        audio_data = audio_data.reshape(number_of_samples)
+    wf.write(wav_path, sample_rate, audio_data)
+
+
+def run_ffmpeg(*arguments):
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", *arguments],
+        check=True,
+    )
+
+
+def make_mp3(mp3_path, wav_path):
+    run_ffmpeg("-i", str(wav_path), "-q:a", "0", str(mp3_path))
+
+
+def make_mp4(mp4_path, wav_path, seconds):
+    # A small, low frame rate video so that the audio dominates the file
+    run_ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        f"color=c=black:s=160x120:r=5:d={seconds}",
+        "-i",
+        str(wav_path),
+        "-c:v",
+        "libx264",
+        "-c:a",
+        "aac",
+        "-shortest",
+        str(mp4_path),
+    )
+
+
+# Input file each stage needs, the name it must have in the filename folder,
+# and whether it needs ffmpeg
+STAGE_INPUTS = {
+    "vad.process": ("wav", "bench_raw.wav", False),
+    "vad.process_batch": ("wav", "bench_raw.wav", False),
+    "vad.remove_silences": ("wav", "bench_raw.wav", False),
+    "vad.remove_silences_streaming": ("wav", "bench_raw.wav", False),
+    "vad.remove_silences_and_segment": ("wav", "bench_raw.wav", False),
+    "segmentation.segment": ("wav", "bench_processed.wav", False),
+    "segmentation.segment_silence": ("wav", "bench_processed.wav", False),
+    "resegment.resegment": ("chunks", "bench_processed_temp", False),
+    "convert_to_wav": ("mp3", "bench_raw.mp3", True),
+    "vad.remove_silences_mp3": ("mp3", "bench_raw.mp3", True),
+    "extract_audio_from_video.wav": ("mp4", "bench.mp4", True),
+    "extract_audio_from_video.mp3": ("mp4", "bench.mp4", True),
+}
+
+
+def stage_callable(stage, folder_path):
+    """
+    Function that imports the code of a stage and returns a function that
+    runs the stage on a filename folder that contains its input file, so
+    that importing scipy and the stage scripts isn't part of the timing.
+
+    Returns:
+    function
+    A function without arguments that runs the stage once.
+    """
+    folder_path = Path(folder_path)
+    if stage in ["vad.process", "vad.process_batch"]:
+        from useful_functions.voice_activity_detection import (
+            VoiceActivityDetection,
+        )
+
+        # Reading the `.wav` file into memory is not part of the timing of
+        # the `VoiceActivityDetection` methods
+        sample_rate, audio_data = wf.read(Path(folder_path, "bench_raw.wav"))
+        vad = VoiceActivityDetection(sample_rate=sample_rate)
+
+        def run():
+            if stage == "vad.process":
+                vad.process(audio_data)
+            else:
+                vad.process_batch(audio_data)
+            vad.get_voice_samples()
+
+        return run
+    if stage in [
+        "vad.remove_silences",
+        "vad.remove_silences_streaming",
+        "vad.remove_silences_mp3",
+    ]:
+        from vad import remove_silences
+
+        return partial(
+            remove_silences,
+            date_folder=folder_path,
+            streaming=stage == "vad.remove_silences_streaming",
+        )
+    if stage == "vad.remove_silences_and_segment":
+        from vad import remove_silences_and_segment
+
+        return partial(remove_silences_and_segment, date_folder=folder_path)
+    if stage in ["segmentation.segment", "segmentation.segment_silence"]:
+        from segmentation import segment
+
+        return partial(
+            segment,
+            folder_path=folder_path,
+            boundaries=(
+                "silence" if stage == "segmentation.segment_silence" else "fixed"
+            ),
+        )
+    if stage == "resegment.resegment":
+        from resegment import resegment
+
+        return partial(resegment, folder_path=folder_path)
+    if stage == "convert_to_wav":
+        from useful_functions.convert_to_wav import convert_to_wav
+
+        return partial(convert_to_wav, Path(folder_path, "bench_raw.mp3"))
+    if stage.startswith("extract_audio_from_video"):
+        from audio_extraction import extract_audio_from_video
+
+        return partial(
+            extract_audio_from_video,
+            date_folder_path=folder_path,
+            output_format=stage.split(".")[-1],
+            cache_path=Path(folder_path.parent, f"{folder_path.name}.sqlite"),
+        )
+    raise Exception(f"Error, {stage} is not a stage!")
+
+
+def run_stage(stage, folder_path):
+    """
+    Function that runs one stage on a filename folder that contains its input
+    file. Only the call of the stage is timed, not the imports and the setup
+    of `stage_callable`.
+
+    Returns:
+    float
+    The wall time of the stage in seconds.
+    """
+    run = stage_callable(stage, folder_path)
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+
+def peak_rss_kb(who=resource.RUSAGE_SELF):
+    """
+    Function that returns the peak memory use (resident set size) in
+    kilobytes. For this process, Linux's `VmHWM` is used, because `ru_maxrss`
+    also counts the memory of the process that started this one. For child
+    processes, `ru_maxrss` is the largest of the children, and on Linux it is
+    at least the size of this process when the child was started.
+    """
+    if who == resource.RUSAGE_SELF:
+        try:
+            with open("/proc/self/status") as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+    # `ru_maxrss` is in kilobytes on Linux but in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def benchmark_case(stage, folder_path, results):
+    # Runs in a new process so that the peak memory use is that of the stage
+    baseline_rss_kb = peak_rss_kb()
+    # The stages print progress, keep it out of the results
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        wall_seconds = run_stage(stage, folder_path)
+    results.put(
+        {
+            "wall_seconds": wall_seconds,
+            "baseline_rss_kb": baseline_rss_kb,
+            "peak_rss_kb": peak_rss_kb(),
+            # ffmpeg processes that the stage started
+            "peak_child_rss_kb": peak_rss_kb(resource.RUSAGE_CHILDREN),
+        }
+    )
+
+
+def prepare_inputs(work_path, seconds, channels, have_ffmpeg):
+    # Write the synthetic files for one length and number of channels once
+    inputs = {"wav": Path(work_path, f"input_{seconds}s_{channels}ch.wav")}
+    make_wav(inputs["wav"], seconds, channels)
+    # The `_processed_temp_N.wav` chunks that `resegment` joins, 4 seconds each
+    sample_rate, audio_data = wf.read(inputs["wav"])
+    chunk_folder = Path(work_path, f"chunks_{seconds}s_{channels}ch")
+    chunk_folder.mkdir()
+    chunk_length = 4 * sample_rate
+    for i, start in enumerate(range(0, len(audio_data), chunk_length)):
+        wf.write(
+            Path(chunk_folder, f"bench_processed_temp_{i}.wav"),
+            sample_rate,
+            audio_data[start : start + chunk_length],
+        )
+    inputs["chunks"] = chunk_folder
+    if have_ffmpeg:
+        inputs["mp3"] = Path(work_path, f"input_{seconds}s_{channels}ch.mp3")
+        make_mp3(inputs["mp3"], inputs["wav"])
+        inputs["mp4"] = Path(work_path, f"input_{seconds}s_{channels}ch.mp4")
+        make_mp4(inputs["mp4"], inputs["wav"], seconds)
+    return inputs
+
+
+def run_benchmarks(stages, lengths, channels_list, repeat, work_dir=None):
+    """
+    Function that runs every stage on every length and number of channels.
+
+    Arguments:
+    stages | list
+    Names of the stages, keys of `STAGE_INPUTS`.
+
+    lengths | list
+    Lengths of the synthetic recordings in seconds.
+
+    channels_list | list
+    Numbers of channels, 1 and/or 2.
+
+    repeat | int
+    How many times each case is run; the fastest and the median run are
+    reported.
+
+    work_dir | str or pathlib.PosixPath
+    Folder for the synthetic files, a temporary folder by default.
+
+    Yields:
+    dict
+    One result per case.
+    """
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+    # A new interpreter for every run, so the peak memory use isn't that of
+    # an earlier case
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(dir=work_dir) as work_path:
+        for seconds in lengths:
+            for channels in channels_list:
+                inputs = prepare_inputs(work_path, seconds, channels, have_ffmpeg)
+                for stage in stages:
+                    input_kind, input_name, needs_ffmpeg = STAGE_INPUTS[stage]
+                    result = {
+                        "stage": stage,
+                        "audio_seconds": seconds,
+                        "channels": channels,
+                        "sample_rate": SAMPLE_RATE,
+                    }
+                    if needs_ffmpeg and not have_ffmpeg:
+                        yield {**result, "skipped": "ffmpeg is not installed"}
+                        continue
+                    runs = []
+                    error = None
+                    for run in range(repeat):
+                        folder_path = Path(work_path, f"{stage}_{run}")
+                        if input_kind == "chunks":
+                            shutil.copytree(inputs["chunks"], folder_path)
+                        else:
+                            folder_path.mkdir()
+                            shutil.copy(
+                                inputs[input_kind], Path(folder_path, input_name)
+                            )
+                        results = context.Queue()
+                        process = context.Process(
+                            target=benchmark_case,
+                            args=(stage, folder_path, results),
+                        )
+                        process.start()
+                        process.join()
+                        shutil.rmtree(folder_path)
+                        if process.exitcode != 0:
+                            error = f"exited with code {process.exitcode}"
+                            break
+                        runs.append(results.get())
+                    if error is not None:
+                        yield {**result, "error": error}
+                        continue
+                    wall_seconds = sorted(run["wall_seconds"] for run in runs)
+                    median_seconds = wall_seconds[len(wall_seconds) // 2]
+                    yield {
+                        **result,
+                        "repeat": repeat,
+                        "min_wall_seconds": wall_seconds[0],
+                        "median_wall_seconds": median_seconds,
+                        "throughput": seconds / median_seconds,
+                        "baseline_rss_kb": max(
+                            run["baseline_rss_kb"] for run in runs
+                        ),
+                        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+                        "peak_child_rss_kb": max(
+                            run["peak_child_rss_kb"] for run in runs
+                        ),
+                    }
+
+
+def environment():
+    # Describes the machine and the version of the code, for comparing runs
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=PROCESSING_PATH,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "stage": "environment",
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare_results(old_path, new_path):
+    """
+    Function that prints the change in throughput and peak memory use of each
+    case between two result files.
+    """
+
+    def load(path):
+        with open(path) as results_file:
+            records = [json.loads(line) for line in results_file if line.strip()]
+        return {
+            (record["stage"], record["audio_seconds"], record["channels"]): record
+            for record in records
+            if "throughput" in record
+        }
+
+    old, new = load(old_path), load(new_path)
+    print(f"{'stage':36} {'seconds':>8} {'ch':>3} {'speedup':>8} {'rss':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        stage, seconds, channels = key
+        speedup = new[key]["throughput"] / old[key]["throughput"]
+        rss = new[key]["peak_rss_kb"] / old[key]["peak_rss_kb"]
+        print(f"{stage:36} {seconds:>8} {channels:>3} {speedup:>7.2f}x {rss:>7.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the audio pipeline stages on synthetic audio"
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=sorted(STAGE_INPUTS),
+        default=sorted(STAGE_INPUTS),
+        help="stages to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--lengths",
+        nargs="+",
+        type=float,
+        default=[10, 60, 300],
+        help="lengths of the synthetic recordings in seconds",
+    )
+    parser.add_argument(
+        "--channels", nargs="+", type=int, choices=[1, 2], default=[1, 2]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--output", help="file to write the JSON lines to (default: stdout)"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="compare two result files instead of running the benchmarks",
+    )
+    arguments = parser.parse_args()
+
+    if arguments.compare:
+        compare_results(*arguments.compare)
+        sys.exit(0)
+
+    output_file = open(arguments.output, "w") if arguments.output else sys.stdout
+    try:
+        print(json.dumps(environment(), sort_keys=True), file=output_file)
+        for record in run_benchmarks(
+            arguments.stages, arguments.lengths, arguments.channels, arguments.repeat
+        ):
+            print(json.dumps(record, sort_keys=True), file=output_file, flush=True)
+    finally:
+        if arguments.output:
+            output_file.close()
@@ -1,12 +1,21 @@
 # reddit_scraper.py
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import glob
+import hashlib
 import praw
 import requests
 import re
 from pathlib import Path  # For writing videos into the data folder
 import logging
+import os
+import threading
+import time
 
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.media_index import MediaIndex
+from useful_functions.profiling import profile_stage, profiling_mode
 from useful_functions.useful_functions import set_up_logging
 
 # Requirements
@@ -28,13 +37,32 @@ from useful_functions.useful_functions import set_up_logging
 # Set up the logging
 set_up_logging(log_path="logging/reddit_scraper/", log_level=logging.INFO)
 
+# Number of bytes read from the connection at a time when downloading
+CHUNK_SIZE = 1024 * 1024
 
-def convert_streamable(url):
+# Seconds to wait for a server before giving up on a request
+TIMEOUT = 60
+
+# Maximum number of simultaneous downloads per host (hosts are matched by
+# suffix, so "streamable.com" also covers its CDN hosts)
+HOST_LIMITS = {"v.redd.it": 4, "streamable.com": 2}
+
+# HTTP status codes that are worth retrying
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class IncompleteDownloadError(requests.RequestException):
+    """The connection ended before the whole file was received"""
+
+
+def convert_streamable(url, session=requests, timeout=TIMEOUT):
     """
     Convert streamable url from reddit to actual video url
     
     Arguments:
     url | string | the streamable link that reddit gives you
+    session | requests.Session | session to reuse connections from
+    timeout | float | seconds to wait for the api before giving up
     
     Returns:
     video_url | string | the link to the actual video
@@ -47,7 +75,7 @@ def convert_streamable(url):
         repl="api.streamable.com/videos/",
     )
     # The api link gets us a json file, we use json() to decode it
-    json1 = requests.get(api_url).json()
+    json1 = session.get(api_url, timeout=timeout).json()
     # Access the video url in the json file
     video_url = json1["files"]["mp4"]["url"]
 
@@ -161,18 +189,16 @@ def audio_url_from_submission(submission):
     return url_array
 
 
-# Function for downloading video or audio files from subreddit urls
-def download_media(url):
+def media_path(url):
     """
-    Download a file from a url
+    Work out where the file for a url is written to, creating its folder
     
     Arguments:
     url | string | the link that you want to download from
-    audio | boolean | True will set the extension to .aac, False will set the 
-    extension to .mp4
 
     Returns:
-    local_filename | string | name of the downloaded file
+    tuple | the folder the file is written to, the path of the file and the 
+    name of the file
     """
 
     # Check the root website
@@ -217,48 +243,439 @@ def download_media(url):
 
     # Create a path for the data folder
     data_path = Path("../data").resolve()
-    # If the data folder doesn't exist
-    if not data_path.is_dir():
-        # Create the data folder
-        data_path.mkdir()
+    # Create the data folder if it doesn't exist (other downloads may be
+    # creating it at the same time)
+    data_path.mkdir(exist_ok=True)
 
     # Check that the script is a file
     if path1.is_file():
-        # This is the absolute path we want our file to be written in
-        path2 = Path(
-            path1.resolve().parent.parent,
-            "data",
-            source,
-            current_date,
-            base_filename,
+        source_path = Path(path1.resolve().parent.parent, "data", source)
+        # A download that an earlier scrape left unfinished is resumed in the
+        # date folder of that scrape instead of starting again under today.
+        # The names come from the url, so characters like "[" are escaped
+        part_paths = sorted(
+            source_path.glob(
+                f"*/{glob.escape(base_filename)}/{glob.escape(local_filename)}.part"
+            )
         )
-        if not path2.is_dir():
-            path2.mkdir(parents=True)
+        if part_paths:
+            current_date = part_paths[-1].parent.parent.name
+        # This is the absolute path we want our file to be written in
+        path2 = Path(source_path, current_date, base_filename)
+        path2.mkdir(parents=True, exist_ok=True)
         # This is the file with the path that open will write to
         path3 = Path(path2, local_filename)
 
-    # Using with to automatically close the connection when we are done with it
-    with requests.get(url, stream=True) as req:
-        # Raise an http error if there is one
-        if not req.ok:
-            logging.info(req)
+    return path2, path3, local_filename
+
+
+def audio_urls_from_submissions(submissions, workers=8, cache=None):
+    """
+    Get the audio file urls of many submissions at once
+    
+    Arguments:
+    submissions | iterable | submissions from a listing generator, Ex. 
+    `reddit.subreddit("PublicFreakout").top(limit = 3)`
+    workers | int | the number of streamable api lookups running at the same 
+    time
+    cache | dict | maps streamable links to their video url (None if the 
+    lookup failed); pass the same dictionary to later calls to reuse lookups
+
+    Returns:
+    url_arrays | array of string arrays | the `audio_url_from_submission` 
+    result for each submission, in the same order as `submissions`, without 
+    the urls that aren't media urls; an empty array if the urls couldn't be 
+    found
+    """
+    submissions = list(submissions)
+    if cache is None:
+        cache = {}
+
+    # Look up every streamable link that isn't cached yet, at the same time
+    streamable_urls = {
+        submission.url
+        for submission in submissions
+        if submission.domain == "streamable.com"
+    } - cache.keys()
+
+    with make_session(pool_size=workers) as session:
+
+        def lookup(url):
+            try:
+                return url, convert_streamable(url, session=session)
+            except Exception as exception:
+                logging.info(f"Streamable lookup failed for {url}: {exception}")
+                return url, None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for url, video_url in executor.map(lookup, streamable_urls):
+                cache[url] = video_url
+
+    url_arrays = []
+    for submission in submissions:
+        if submission.domain == "streamable.com":
+            video_url = cache[submission.url]
+            url_arrays.append([] if video_url is None else [video_url])
+            continue
+        # The other domains don't need any requests
+        try:
+            url_array = audio_url_from_submission(submission)
+        except Exception as exception:
+            logging.info(f"Exception for {submission.url}: {exception}")
+            url_array = []
+        # `convert_reddit` gives an empty url if it finds no audio url
+        url_arrays.append([url for url in url_array if is_media_url(url)])
+    return url_arrays
+
+
+def is_media_url(url):
+    """
+    Check that a url can be downloaded from, e.g. not the empty string that
+    `convert_reddit` returns when it finds no audio url
+    
+    Arguments:
+    url | string | the link that the media would be downloaded from
+
+    Returns:
+    bool | True for an http or https url with a host
+    """
+    return isinstance(url, str) and bool(re.match(r"^https?://[^/\s]+", url))
+
+
+def media_id(url):
+    """
+    Get an identifier for the media behind a url that stays the same between
+    scrapes (streamable video urls have changing tokens after the file name)
+    
+    Arguments:
+    url | string | the link that the media is downloaded from
+
+    Returns:
+    media_id | string | Ex. "v.redd.it/9v2san14was51" or 
+    "streamable/u2jzoo.mp4"; None if the url isn't a media url
+    """
+    if not is_media_url(url):
+        return None
+    root_url = url.split("/")[2]
+    if re.search(string=root_url, pattern="^v\.redd\.it"):
+        return f"v.redd.it/{url.split('/')[-2]}"
+    elif re.match(string=root_url, pattern="^.*streamable.com"):
+        filename_part = re.sub(
+            string=url.split("/")[-1], pattern="(?<=\.mp4).*", repl=""
+        )
+        return f"streamable/{filename_part}"
+    return url
+
+
+def is_submission_done(index, submission_id):
+    """
+    Check the media index for a submission whose media are all downloaded
+    
+    Arguments:
+    index | MediaIndex | the index of earlier scrapes
+    submission_id | string | the reddit id of the submission
+
+    Returns:
+    bool | True if the submission can be skipped; False if it has urls that 
+    aren't downloaded yet or aren't media urls (these are resolved again)
+    """
+    urls = index.submission_urls(submission_id)
+    if urls is None:
+        return False
+    return all(
+        is_media_url(url) and index.is_downloaded(media_id(url)) for url in urls
+    )
+
+
+# Function for downloading video or audio files from subreddit urls
+def download_media(url, session=requests, chunk_size=CHUNK_SIZE):
+    """
+    Download a file from a url
+    
+    Arguments:
+    url | string | the link that you want to download from
+    session | requests.Session | session to reuse connections from, the 
+    default opens a new connection for every download
+    chunk_size | int | number of bytes written at a time
+
+    Returns:
+    local_filename | string | name of the downloaded file
+    """
+    path2, path3, local_filename = media_path(url)
+
+    with StageTimer("download", folder=path2) as timer:
+        req, size, sha256 = resumable_download(
+            url, path3, session=session, chunk_size=chunk_size
+        )
+        timer.count(bytes=size)
+    # Raise an http error if there is one
+    if sha256 is None:
+        logging.info(req)
+        # Remove empty directory because we don't expect to have a file (a
+        # partial file from an earlier attempt is kept to resume from)
+        if not any(path2.iterdir()):
             logging.info(
                 f"No file will be downloaded, removing empty directory: {path2}"
             )
-            # Remove empty directory because we don't expect to have a file
             path2.rmdir()
-        else:
-            # Write the file in binary
-            with open(path3, "wb") as video_file:
-                for chunk in req.iter_content(chunk_size=4000):
-                    # If you have chunk encoded response uncomment if
-                    # and set chunk_size parameter to None.
-                    # if chunk:
-                    video_file.write(chunk)
 
     return local_filename
 
 
+def resumable_download(
+    url, file_path, session=requests, chunk_size=CHUNK_SIZE, timeout=TIMEOUT
+):
+    """
+    Download a file through a `.part` file that is renamed to `file_path` 
+    once the whole file has arrived, so an interrupted download never leaves 
+    a half written file under the real name. If a `.part` file is left over 
+    from an earlier attempt, only the rest of the file is requested with an 
+    HTTP Range header (servers that ignore the header send the whole file 
+    again).
+    
+    Arguments:
+    url | string | the link that you want to download from
+    file_path | pathlib.Path | where the finished file is written
+    session | requests.Session | session to reuse connections from
+    chunk_size | int | number of bytes written at a time
+    timeout | float | seconds to wait for the server before giving up
+
+    Returns:
+    tuple | the (closed) response, the size of the file in bytes and the 
+    SHA-256 hex digest of the file; the size is 0 and the digest None if the 
+    file wasn't downloaded (a 416 response for a `.part` file that is already 
+    complete counts as downloaded)
+
+    Raises:
+    IncompleteDownloadError | if fewer bytes than the Content-Length arrived; 
+    the `.part` file is kept so the next attempt resumes
+    """
+    part_path = Path(file_path).with_name(f"{Path(file_path).name}.part")
+    resume_from = part_path.stat().st_size if part_path.is_file() else 0
+    headers = {"Range": f"bytes={resume_from}-"} if resume_from else {}
+
+    # Using with to automatically close the connection when we are done with it
+    with session.get(url, stream=True, headers=headers, timeout=timeout) as req:
+        sha256 = hashlib.sha256()
+        if resume_from and req.status_code in [206, 416]:
+            # The hash has to cover the part that is already on disk
+            with open(part_path, "rb") as part_file:
+                for chunk in iter(lambda: part_file.read(chunk_size), b""):
+                    sha256.update(chunk)
+        if req.status_code == 416:
+            # The range starts at the end of the file: the whole file arrived
+            # but the last attempt stopped before renaming it
+            if req.headers.get("Content-Range") == f"bytes */{resume_from}":
+                os.replace(part_path, file_path)
+                return req, resume_from, sha256.hexdigest()
+            # The partial file is longer than the file on the server
+            part_path.unlink()
+            raise IncompleteDownloadError(f"Stale partial file for {url}")
+        if not req.ok:
+            return req, 0, None
+
+        if req.status_code == 206:
+            if not req.headers.get("Content-Range", "").startswith(
+                f"bytes {resume_from}-"
+            ):
+                part_path.unlink()
+                raise IncompleteDownloadError(f"Unexpected range for {url}")
+            mode = "ab"
+        else:
+            resume_from = 0
+            mode = "wb"
+
+        written, digest = write_response(
+            req, part_path, chunk_size=chunk_size, mode=mode, sha256=sha256
+        )
+        # Content-Length is the compressed size if the body is encoded
+        content_length = req.headers.get("Content-Length")
+        if (
+            content_length is not None
+            and "Content-Encoding" not in req.headers
+            and written != int(content_length)
+        ):
+            raise IncompleteDownloadError(
+                f"Received {written} of {content_length} bytes from {url}"
+            )
+
+    os.replace(part_path, file_path)
+    return req, resume_from + written, digest
+
+
+def write_response(req, file_path, chunk_size=CHUNK_SIZE, mode="wb", sha256=None):
+    """
+    Write the body of a streamed response to a file
+    
+    Arguments:
+    req | requests.Response | response from a request made with `stream=True`
+    file_path | pathlib.Path | the file to write to
+    chunk_size | int | number of bytes written at a time
+    mode | string | "wb" to overwrite the file, "ab" to append to it
+    sha256 | hashlib.sha256 | hash to continue, e.g. of the start of the file 
+    when appending
+
+    Returns:
+    tuple | number of bytes written and the SHA-256 hex digest of the file
+    """
+    size = 0
+    if sha256 is None:
+        sha256 = hashlib.sha256()
+    # Write the file in binary
+    with open(file_path, mode) as video_file:
+        for chunk in req.iter_content(chunk_size=chunk_size):
+            # If you have chunk encoded response uncomment if
+            # and set chunk_size parameter to None.
+            # if chunk:
+            video_file.write(chunk)
+            size += len(chunk)
+            sha256.update(chunk)
+    return size, sha256.hexdigest()
+
+
+def make_session(pool_size=8):
+    """
+    Create a requests session whose connection pool fits `pool_size` threads
+    
+    Arguments:
+    pool_size | int | the number of connections kept open per host
+
+    Returns:
+    session | requests.Session | the session to share between threads
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def host_of(url, host_limits=HOST_LIMITS):
+    """
+    Get the host a url counts towards for the per host download limits
+    
+    Arguments:
+    url | string | the link that you want to download from
+    host_limits | dict | maximum simultaneous downloads per host
+
+    Returns:
+    host | string | the matching key of `host_limits`, or the url's host
+    """
+    root_url = url.split("/")[2]
+    for host in host_limits:
+        if root_url == host or root_url.endswith(f".{host}"):
+            return host
+    return root_url
+
+
+def download_media_bulk(
+    urls,
+    workers=8,
+    host_limits=HOST_LIMITS,
+    retries=3,
+    backoff=1.0,
+    chunk_size=CHUNK_SIZE,
+):
+    """
+    Download many files at once, sharing one pool of connections
+    
+    Arguments:
+    urls | string array | the links that you want to download from
+    workers | int | the number of downloads running at the same time
+    host_limits | dict | maximum simultaneous downloads per host; hosts that 
+    aren't listed are only limited by `workers`
+    retries | int | how many more times a download is tried after a 
+    connection error or a status code in `RETRY_STATUS_CODES`
+    backoff | float | seconds to wait before the first retry, doubled for 
+    every retry after that
+    chunk_size | int | number of bytes written at a time
+
+    Returns:
+    results | dict array | one dictionary per url, in the same order as 
+    `urls`, with the keys "url", "local_filename", "status" ("downloaded", 
+    "http error" or "failed"), "status_code", "attempts", "path", "bytes", 
+    "sha256" and "error"
+    """
+    session = make_session(pool_size=workers)
+    host_semaphores = {
+        host: threading.BoundedSemaphore(limit)
+        for host, limit in host_limits.items()
+    }
+
+    def download(url):
+        result = {
+            "url": url,
+            "local_filename": None,
+            "status": "failed",
+            "status_code": None,
+            "attempts": 0,
+            "path": None,
+            "bytes": 0,
+            "sha256": None,
+            "error": None,
+        }
+        try:
+            path2, path3, result["local_filename"] = media_path(url)
+        except Exception as exception:
+            result["error"] = repr(exception)
+            return result
+        semaphore = host_semaphores.get(host_of(url, host_limits))
+
+        for attempt in range(retries + 1):
+            result["attempts"] = attempt + 1
+            try:
+                if semaphore is not None:
+                    semaphore.acquire()
+                try:
+                    # An interrupted attempt resumes from its `.part` file
+                    with StageTimer("download", folder=path2) as timer:
+                        req, size, sha256 = resumable_download(
+                            url, path3, session=session, chunk_size=chunk_size
+                        )
+                        timer.count(bytes=size)
+                    result["status_code"] = req.status_code
+                    if sha256 is not None:
+                        result["path"] = path3
+                        result["bytes"] = size
+                        result["sha256"] = sha256
+                        result["status"] = "downloaded"
+                        result["error"] = None
+                        return result
+                    result["error"] = req.reason
+                finally:
+                    if semaphore is not None:
+                        semaphore.release()
+                if req.status_code not in RETRY_STATUS_CODES:
+                    break
+            except requests.RequestException as exception:
+                result["error"] = repr(exception)
+            except Exception as exception:
+                # E.g. a full disk or a bad Content-Length header: trying
+                # again won't help, but the other downloads carry on
+                result["error"] = repr(exception)
+                break
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+
+        if result["status_code"] is not None:
+            result["status"] = "http error"
+        logging.info(f"Unable to download {url}: {result['error']}")
+        # Remove empty directory because we don't expect to have a file (a
+        # partial file is kept so that the next scrape can resume it). Another
+        # download of the same folder may be using or removing it
+        try:
+            if path2.is_dir() and not any(path2.iterdir()):
+                path2.rmdir()
+        except OSError:
+            pass
+        return result
+
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(download, urls))
+
+
 def test_functions(download_quantity=2):
     # Connect to Reddit's API
     reddit = praw.Reddit("bot1", user_agent="bot1")
@@ -271,33 +688,71 @@ def test_functions(download_quantity=2):
     sr1 = reddit.subreddit("PublicFreakout")
     # Select the top 10 (it is selecting top 10 of the year by default)
     top1 = sr1.top(time_filter="year", limit=download_quantity)
-    # Initialize arrays
-    urls = []
-    # Place the relevant info into the array from the selected top 3
-    for i in top1:
-        logging.info(len(urls))
-        try:
-            urls.append(audio_url_from_submission(i))
-        except:
+    # Index of the submissions and media from earlier scrapes
+    index = MediaIndex(Path("../data/media_index.sqlite").resolve())
+    results = scrape_submissions(top1, index)
+    index.close()
+    downloaded = sum(result["status"] == "downloaded" for result in results)
+    print(f"{downloaded} of {len(results)} files downloaded")
+    print("reddit_scraper.py finished")
+
+
+def scrape_submissions(submissions, index):
+    """
+    Download the media of the submissions that aren't in the index yet and 
+    record them in the index
+    
+    Arguments:
+    submissions | iterable | submissions from a listing generator
+    index | MediaIndex | the index of earlier scrapes
+
+    Returns:
+    results | dict array | the results of `download_media_bulk`
+    """
+    # Skip submissions that were already downloaded, before any requests
+    submissions = [
+        i for i in submissions if not is_submission_done(index, i.id)
+    ]
+    print(f"{len(submissions)} new submissions")
+    # Get the urls of all the submissions, looking up the streamable links
+    # at the same time
+    urls = audio_urls_from_submissions(submissions)
+    submission_ids = {}
+    for submission, url_array in zip(submissions, urls):
+        # Submissions whose urls couldn't be found are tried again next time,
+        # unless the domain isn't supported at all
+        if url_array or submission.domain not in ["streamable.com", "v.redd.it"]:
+            index.record_submission(submission.id, url_array)
+        for url in url_array:
+            submission_ids[url] = submission.id
+    print("urls appended, starting downloads")
+    # Media can be shared between submissions, e.g. crossposts
+    to_download = [
+        url
+        for url in submission_ids
+        if is_media_url(url) and not index.is_downloaded(media_id(url))
+    ]
+    # Download the videos, several at a time
+    # Some of the posts are not videos, and some of the urls give HTTP errors
+    # such as 403 Client Error: Forbidden for url:
+    # https://v.redd.it/716d4vdxcqu41/audio?source=fallback
+    results = download_media_bulk(to_download)
+    for result in results:
+        if result["status"] == "downloaded":
+            index.record_download(
+                media_id=media_id(result["url"]),
+                submission_id=submission_ids[result["url"]],
+                url=result["url"],
+                path=result["path"],
+                size=result["bytes"],
+                sha256=result["sha256"],
+            )
+        else:
             logging.info(
-                f"Exception: {urls.append(audio_url_from_submission(i))}"
+                f"Error with {result['url']} after {result['attempts']} "
+                + f"attempts: {result['error']}"
             )
-    print("urls appended, starting downloads")
-    # Download the videos
-    for i in range(len(urls)):
-        for j in range(len(urls[i])):
-            try:
-                download_media(urls[i][j])
-            except Exception as exception:
-                # Getting this HTTP error
-                # 403 Client Error: Forbidden for url:
-                # https://v.redd.it/716d4vdxcqu41/audio?source=fallback
-                # Also, some of the posts are not videos. When printing the #
-                # length of the url, sometimes it says "errorgfycat.com" or
-                # "errori.redd.it" for example.
-                logging.info(f"Error with post number {str(i)}")
-                logging.info(f"Exception: {exception}")
-    print("reddit_scraper.py finished")
+    return results
 
 
 # Take daily top 50 links from the public freakout subreddit and attempt to
@@ -305,4 +760,10 @@ def test_functions(download_quantity=2):
 
 # Only execute this if run as a script
 if __name__ == "__main__":
-    test_functions(download_quantity=1000)
+    # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+    with profile_stage(
+        "reddit_scraper", "logging/reddit_scraper/profiles/", profiling_mode()
+    ):
+        test_functions(download_quantity=1000)
+    # Latency and throughput of the downloads of this run
+    write_report("logging/reddit_scraper/")
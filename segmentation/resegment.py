@@ -4,32 +4,115 @@
 
 
 from pathlib import Path  # For writing videos into the data folder
-from pydub import AudioSegment  # This also requires ffmpeg on the device
 import sys
 from os import listdir
 from os.path import isfile, join
 import re
-import math
 
-folder_path = sys.argv[1]
-input_filename = folder_path.split('/')[-2]
-print(input_filename)
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.profiling import profile_stage, profiling_mode
+from useful_functions.wav_io import chunk_order, stream_wav_segments
+from useful_functions.segment_boundaries import find_silence_cut_points
+from useful_functions.build_manifest import (
+    is_up_to_date,
+    record_stage,
+    recorded_outputs,
+)
 
-files = [f for f in listdir(folder_path) if isfile(join(folder_path, f))]
-to_join = [AudioSegment.from_file(Path(folder_path,Path(file))) for file in files if re.search("_processed_.*.wav$", file) ]
 
-joined_file = sum(to_join)
+def resegment(
+    folder_path, segment_seconds=10, boundaries="fixed", tolerance_seconds=1
+):
+    """
+    Function that joins the `_processed_temp_*.wav` chunks that
+    `split_silence-removal.py` writes to a folder and splits
+    the joined audio into segments of at most `segment_seconds` seconds.
 
-# Pydub uses milleseconds as the units; 10 000 is 10 seconds
-ten_seconds = 10 * 1000
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    Path to the filename folder.
 
-number_of_segments = math.floor(joined_file.duration_seconds / 10)
-# For each segment of at most 10 seconds, export the segment
-for i in range(number_of_segments+1):
-    current_segment = joined_file[i * ten_seconds : (i + 1) * ten_seconds]
-    current_segment.export(
-        Path(folder_path, f"{input_filename}_processed_{i}.wav"), format="wav"
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    boundaries | str
+    "fixed" cuts every `segment_seconds`. "silence" moves each cut to the
+    quietest moment within `tolerance_seconds` of it, so words aren't cut in
+    half.
+
+    tolerance_seconds | float
+    How far a cut may move in "silence" mode.
+
+    Returns:
+    int
+    The number of segments written.
+    """
+    input_filename = Path(folder_path).name
+    print(input_filename)
+
+    files = [f for f in listdir(folder_path) if isfile(join(folder_path, f))]
+    # Join the chunks in numeric order, `listdir` order is arbitrary. Only the
+    # temporary chunks, not the `_processed_<i>.wav` segments written here
+    to_join = sorted(
+        (
+            Path(folder_path, Path(file))
+            for file in files
+            if re.search(r"_processed_temp_\d+\.wav$", file)
+        ),
+        key=chunk_order,
     )
-    print(f"Segmented {input_filename}_processed_{i}.wav")
+    parameters = {
+        "segment_seconds": segment_seconds,
+        "boundaries": boundaries,
+        "tolerance_seconds": tolerance_seconds,
+    }
+    # Skip the folder if it was resegmented before and nothing changed since
+    if is_up_to_date(folder_path, "resegment", to_join, parameters):
+        print(f"Segments of {input_filename} are up to date, skipping")
+        return len(recorded_outputs(folder_path, "resegment"))
+    # Remove the segments of the last run, a new run may write fewer
+    for old_segment in recorded_outputs(folder_path, "resegment"):
+        old_segment.unlink(missing_ok=True)
+
+    with StageTimer("segmentation", folder=folder_path) as timer:
+        for chunk_path in to_join:
+            timer.count_file(chunk_path)
+        if boundaries == "silence":
+            cut_points = find_silence_cut_points(
+                to_join,
+                segment_seconds=segment_seconds,
+                tolerance_seconds=tolerance_seconds,
+            )
+        elif boundaries == "fixed":
+            cut_points = None
+        else:
+            raise Exception(f"Error, {boundaries} is not a boundary mode!")
+        # Copy the samples of the chunks into the segments as they are read,
+        # holding at most one segment in memory
+        segment_paths = stream_wav_segments(
+            to_join,
+            output_folder=folder_path,
+            output_stem=f"{input_filename}_processed",
+            segment_seconds=segment_seconds,
+            cut_points=cut_points,
+        )
+    for segment_path in segment_paths:
+        print(f"Segmented {segment_path.name}")
+    record_stage(folder_path, "resegment", to_join, segment_paths, parameters)
+
+    print("Segmentation finished")
+    return len(segment_paths)
 
-print("Segmentation finished")
+if __name__ == "__main__":
+    # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+    with profile_stage(
+        f"resegment_{Path(sys.argv[1]).name}",
+        "logging/segmentation/profiles/",
+        profiling_mode(),
+    ):
+        resegment(
+            folder_path=sys.argv[1],
+            boundaries="silence" if "--silence-boundaries" in sys.argv[2:] else "fixed",
+        )
+    # Latency and throughput of the segmentation of this run
+    write_report("logging/segmentation/")
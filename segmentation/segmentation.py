@@ -6,38 +6,111 @@
 # Uncomment the noted lines to run the script on all folders in a single scrape
 
 from pathlib import Path  # For writing videos into the data folder
-from pydub import AudioSegment  # This also requires ffmpeg on the device
 import sys
-import math
+
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.profiling import profile_stage, profiling_mode
+from useful_functions.wav_io import write_wav_segments
+from useful_functions.segment_boundaries import find_silence_cut_points
+from useful_functions.build_manifest import (
+    is_up_to_date,
+    record_stage,
+    recorded_outputs,
+)
 
 # Uncomment to loop
 #date_path = Path(Path.cwd().parent, "data", "reddit", sys.argv[1])
 #date_path.glob("[!.]*")
-# Comment out to loop
-folder_path = sys.argv[1]
 
 
-# Pydub uses milleseconds as the units; 10 000 is 10 seconds
-ten_seconds = 10 * 1000
+def segment(
+    folder_path, segment_seconds=10, boundaries="fixed", tolerance_seconds=1
+):
+    """
+    Function that splits the `_processed.wav` file of a folder into segments
+    of at most `segment_seconds` seconds.
 
-# Loop through folders in date folder, excluding hidden files
-# Uncomment to loop
-#for folder in date_path.glob("[!.]*"):
-# Tab over to loop
-# Uncomment to loop
-# file_path = Path(next(Path(folder).glob("*_processed.wav")))
-# Comment out to loop
-file_path = Path(next(Path(folder_path).glob("*_processed.wav")))
-# Import the file
-audio_file = AudioSegment.from_file(file_path)
-# Determine the number of segments to loop through
-number_of_segments = math.floor(audio_file.duration_seconds / 10)
-# For each segment of at most 10 seconds, export the segment
-for i in range(number_of_segments+1):
-    current_segment = audio_file[i * ten_seconds : (i + 1) * ten_seconds]
-    current_segment.export(
-        Path(file_path.parent, f"{file_path.stem}_{i}.wav"), format="wav"
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    Path to the filename folder that contains the `_processed.wav` file.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    boundaries | str
+    "fixed" cuts every `segment_seconds`. "silence" moves each cut to the
+    quietest moment within `tolerance_seconds` of it, so words aren't cut in
+    half.
+
+    tolerance_seconds | float
+    How far a cut may move in "silence" mode.
+
+    Returns:
+    int
+    The number of segments written.
+    """
+    # Loop through folders in date folder, excluding hidden files
+    # Uncomment to loop
+    #for folder in date_path.glob("[!.]*"):
+    # Tab over to loop
+    # Uncomment to loop
+    # file_path = Path(next(Path(folder).glob("*_processed.wav")))
+    # Comment out to loop
+    file_path = Path(next(Path(folder_path).glob("*_processed.wav")))
+    parameters = {
+        "segment_seconds": segment_seconds,
+        "boundaries": boundaries,
+        "tolerance_seconds": tolerance_seconds,
+    }
+    # Skip the file if it was segmented before and nothing changed since
+    if is_up_to_date(folder_path, "segmentation", [file_path], parameters):
+        print(f"Segments of {file_path.name} are up to date, skipping")
+        return len(recorded_outputs(folder_path, "segmentation"))
+    # Remove the segments of the last run, a new run may write fewer
+    for old_segment in recorded_outputs(folder_path, "segmentation"):
+        old_segment.unlink(missing_ok=True)
+    with StageTimer("segmentation", folder=folder_path) as timer:
+        timer.count_file(file_path)
+        if boundaries == "silence":
+            cut_points = find_silence_cut_points(
+                [file_path],
+                segment_seconds=segment_seconds,
+                tolerance_seconds=tolerance_seconds,
+            )
+        elif boundaries == "fixed":
+            cut_points = None
+        else:
+            raise Exception(f"Error, {boundaries} is not a boundary mode!")
+        # Copy the samples of each segment of at most 10 seconds straight from
+        # the memory mapped file, without decoding them
+        segment_paths = write_wav_segments(
+            file_path,
+            output_folder=file_path.parent,
+            output_stem=file_path.stem,
+            segment_seconds=segment_seconds,
+            cut_points=cut_points,
+        )
+    for segment_path in segment_paths:
+        print(f"Segmented {segment_path.name}")
+    record_stage(
+        folder_path, "segmentation", [file_path], segment_paths, parameters
     )
-    print(f"Segmented {file_path.stem}_{i}.wav")
 
-print("Segmentation finished")
+    print("Segmentation finished")
+    return len(segment_paths)
+
+
+if __name__ == "__main__":
+    # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+    with profile_stage(
+        f"segmentation_{Path(sys.argv[1]).name}",
+        "logging/segmentation/profiles/",
+        profiling_mode(),
+    ):
+        # Comment out to loop
+        segment(
+            folder_path=sys.argv[1],
+            boundaries="silence" if "--silence-boundaries" in sys.argv[2:] else "fixed",
+        )
+    # Latency and throughput of the segmentation of this run
+    write_report("logging/segmentation/")
@@ -1,20 +1,20 @@
 import logging
 import sys
-from pathlib import Path
+from pathlib import Path  # For writing videos into the data folder
 from os import listdir
 from os.path import isfile, join
 
 from useful_functions.useful_functions import set_up_logging
 from useful_functions.convert_to_wav import convert_to_wav
-
-# Set up the logging
-set_up_logging(log_path="logging/vad/", log_level=logging.INFO)
-# Show system arguments
-logging.info(f"System arguments: {sys.argv}")
-from pathlib import Path  # For writing videos into the data folder
-from pydub import AudioSegment  # This also requires ffmpeg on the device
-import sys
-import math
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.profiling import profile_stage, profiling_mode
+from useful_functions.wav_io import write_wav_segments
+from useful_functions.segment_boundaries import find_silence_cut_points
+from useful_functions.build_manifest import (
+    is_up_to_date,
+    record_stage,
+    recorded_outputs,
+)
 
 
 # in the case where you are not loping the date_folder is just a audio file folder
@@ -44,7 +44,11 @@ def get_file(date_folder):
         # Loop through raw files in the filename folders, excluding hidden
         # files
     # tab over to loop
-    files = [f for f in listdir(file_folder) if isfile(join(file_folder, f))]
+    # Hidden files, like the build manifest, are not audio files
+    files = [
+        f for f in listdir(file_folder)
+        if isfile(join(file_folder, f)) and not f.startswith(".")
+    ]
     if len(files) == 1:
         input_filename = Path(file_folder,Path(files[0]))
         if "_raw." in files[0]:
@@ -69,12 +73,6 @@ def get_file(date_folder):
         # Comment out the following to loop
         exit(1)
     else:
-        if any("processed.wav" in filename for filename in files):
-            print(f"It appears this file has already been processed, skipping {file_folder}")
-            # Uncomment below to allow loop to continue if looping
-            #continue
-            # Comment out the following to loop
-            exit(1)
         raw_files = [file for file in files if "_raw." in file]
         input_filename = [file for file in raw_files if ".wav" in file]
         if not len(input_filename) and len(raw_files) == 1 :
@@ -104,22 +102,92 @@ def get_file(date_folder):
             exit(1)
     return input_filename
 
-folder_path = sys.argv[1]
 
-input_filename = get_file(folder_path)
-# Pydub uses milleseconds as the units; 10 000 is 10 seconds
-thirty_seconds = 10 * 1000
+def segment_unprocessed(
+    folder_path, segment_seconds=10, boundaries="fixed", tolerance_seconds=1
+):
+    """
+    Function that splits the raw audio file of a folder into segments of at
+    most `segment_seconds` seconds, converting it to `.wav` first if needed.
+
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    Path to the filename folder that contains the `_raw` audio file.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    boundaries | str
+    "fixed" cuts every `segment_seconds`. "silence" moves each cut to the
+    quietest moment within `tolerance_seconds` of it, so words aren't cut in
+    half.
+
+    tolerance_seconds | float
+    How far a cut may move in "silence" mode.
+
+    Returns:
+    int
+    The number of segments written.
+    """
+    input_filename = get_file(folder_path)
+    parameters = {
+        "segment_seconds": segment_seconds,
+        "boundaries": boundaries,
+        "tolerance_seconds": tolerance_seconds,
+    }
+    # Skip the file if it was segmented before and nothing changed since
+    stage = "unprocessed segmentation"
+    if is_up_to_date(folder_path, stage, [input_filename], parameters):
+        print(f"Segments of {input_filename.name} are up to date, skipping")
+        return len(recorded_outputs(folder_path, stage))
+    # Remove the segments of the last run, a new run may write fewer
+    for old_segment in recorded_outputs(folder_path, stage):
+        old_segment.unlink(missing_ok=True)
+
+    with StageTimer("segmentation", folder=folder_path) as timer:
+        timer.count_file(input_filename)
+        if boundaries == "silence":
+            cut_points = find_silence_cut_points(
+                [input_filename],
+                segment_seconds=segment_seconds,
+                tolerance_seconds=tolerance_seconds,
+            )
+        elif boundaries == "fixed":
+            cut_points = None
+        else:
+            raise Exception(f"Error, {boundaries} is not a boundary mode!")
+        # Copy the samples of each segment of at most 30 seconds straight from
+        # the memory mapped file, without decoding them
+        segment_paths = write_wav_segments(
+            input_filename,
+            output_folder=input_filename.parent,
+            output_stem=input_filename.stem,
+            segment_seconds=segment_seconds,
+            cut_points=cut_points,
+        )
+    for segment_path in segment_paths:
+        print(f"Segmented {segment_path.name}")
+    record_stage(folder_path, stage, [input_filename], segment_paths, parameters)
+
+    print("Segmentation finished")
+    return len(segment_paths)
+
 
-# Import the file
-audio_file = AudioSegment.from_file(input_filename)
-# Determine the number of segments to loop through
-number_of_segments = math.floor(audio_file.duration_seconds / 10)
-# For each segment of at most 30 seconds, export the segment
-for i in range(number_of_segments+1):
-    current_segment = audio_file[i * thirty_seconds : (i + 1) * thirty_seconds]
-    current_segment.export(
-        Path(input_filename.parent, f"{input_filename.stem}_{i}.wav"), format="wav"
-    )
-    print(f"Segmented {input_filename.stem}_{i}.wav")
+if __name__ == "__main__":
+    # Set up the logging
+    set_up_logging(log_path="logging/vad/", log_level=logging.INFO)
+    # Show system arguments
+    logging.info(f"System arguments: {sys.argv}")
 
-print("Segmentation finished")
+    # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+    with profile_stage(
+        f"unprocessed_segmentation_{Path(sys.argv[1]).name}",
+        "logging/vad/profiles/",
+        profiling_mode(),
+    ):
+        segment_unprocessed(
+            folder_path=sys.argv[1],
+            boundaries="silence" if "--silence-boundaries" in sys.argv[2:] else "fixed",
+        )
+    # Latency and throughput of the stages of this run
+    write_report("logging/vad/")
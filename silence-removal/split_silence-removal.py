@@ -4,7 +4,7 @@
 # Uncomment the noted lines to run the script on all folders in a single scrape
 
 import logging
-import numpy as np
+import os
 import scipy.io.wavfile as wf
 import re
 import sys
@@ -14,133 +14,17 @@ from os.path import isfile, join
 
 from useful_functions.useful_functions import set_up_logging
 from useful_functions.convert_to_wav import convert_to_wav
-
-# Set up the logging
-set_up_logging(log_path="logging/vad/", log_level=logging.INFO)
-# Show system arguments
-logging.info(f"System arguments: {sys.argv}")
-
-
-class VoiceActivityDetection:
-    def __init__(self):
-        self.__step = 160
-        self.__buffer_size = 160
-        self.__buffer = np.zeros(shape=(0, 2), dtype=np.int16)
-        self.__out_buffer = np.zeros(shape=(0, 2), dtype=np.int16)
-        self.__n = 0
-        self.__VADthd = 0.0  # Period used to convert to floating point number
-        self.__VADn = 0.0
-        self.__silence_counter = 0
-        self.__channels = 0  # Number of audio channels
-
-    # Voice Activity Detection
-    # Adaptive threshold
-    def vad(self, _frame, threshold=0.1):
-        # Each _frame consists of 160 non-overlapping amplitude measurements
-
-        # Check that the threshold is between 0 and 1
-        if threshold < 0:
-            raise Exception(f"Error, threshold: {threshold} is lower than 0.")
-        elif threshold > 1:
-            raise Exception(f"Error, threshold: {threshold} is larger than 1.")
-
-        frame = np.array(_frame) ** 2.0
-        max_frame = np.zeros(len(frame))
-        for index, array in enumerate(frame):
-            max_frame[index] = np.max(array)
-        result = True
-        threshold = 0.02
-        thd = np.min(frame) + np.ptp(frame) * threshold
-        # This is the previous frame's thd
-        self.__VADthd = (self.__VADn * self.__VADthd + thd) / float(
-            self.__VADn + 1.0
-        )
-        self.__VADn += 1.0
-
-        # Take the mean of the maximum amplitudes across any channel
-        if np.mean(max_frame) <= self.__VADthd:
-            self.__silence_counter += 1
-        else:
-            self.__silence_counter = 0
-
-        if self.__silence_counter > 60:
-            result = False
-        return result
-
-    # Push new audio samples into the buffer.
-    def add_samples(self, data):
-        self.__buffer = np.append(self.__buffer, data, axis=0)
-        result = len(self.__buffer) >= self.__buffer_size
-        return result
-
-    # Pull a portion of the buffer to process (pulled samples are deleted
-    # after being processed)
-    def get_frame(self):
-        window = self.__buffer[: self.__buffer_size]
-        self.__buffer = self.__buffer[self.__step :]
-        return window
-
-    # Adds new audio samples to the internal buffer and processes them
-    def process(self, data):
-        logging.debug(f"First frame of audio data:\n{data[ :160]}")
-        # Detects mono or stereo audio
-        self.__channels = self.get_audio_channels(data=data)
-        if self.__channels == 1:
-            logging.info("This is mono audio")
-            # Reshape data so that it works with np.append(axis = 0)
-            # and other functions that only work with 2d arrays
-            data = data.reshape(len(data), 1)
-            self.__buffer = np.zeros(shape=(0, 1), dtype=np.int16)
-            self.__out_buffer = np.zeros(shape=(0, 1), dtype=np.int16)
-
-        elif self.__channels == 2:
-            logging.info("This is stereo audio")
-
-        if self.add_samples(data):
-            while len(self.__buffer) >= self.__buffer_size:
-                # Framing
-                window = self.get_frame()
-                # Add window if threshold is met
-                if self.vad(_frame=window, threshold=0.01):  # speech frame
-                    self.__out_buffer = np.append(
-                        self.__out_buffer, window, axis=0
-                    )
-
-    def get_voice_samples(self):
-        # If mono audio, undo the earlier reshaping
-        if self.__channels == 1:
-            self.__out_buffer = self.__out_buffer.reshape(
-                len(self.__out_buffer)
-            )
-            # Check that the resulting shape is 1d instead of 2d
-            logging.debug(self.__out_buffer.shape)
-        return self.__out_buffer
-
-    def get_audio_channels(self, data):
-        """
-        Function that takes audio data and returns the number of audio   channels as an integer.
-        
-        Arguments:
-        data | numpy.ndarray
-        Audio data from
-        `scipy.io.wavfile.read(filename = 'your_file_name')[1]`.
-        
-        Returns:
-        int
-        1 for mono audio, 2 for stereo audio
-        """
-        # Mono audio is just an array
-        if len(data.shape) == 1:
-            return 1
-        # However stereo audio is an array of arrays where each inner array
-        # is the audio of both sides at that particular time point
-        elif data.shape[1] == 2:
-            return 2
-        else:
-            raise Exception("Error, data is neither mono or stereo!")
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.profiling import profile_stage, profiling_mode
+from useful_functions.wav_io import chunk_order, read_wav_mmap
+from useful_functions.parallel_vad import parallel_silence_removal
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    stream_silence_removal,
+)
 
 # in the case where you are not loping the date_folder is just a audio file folder
-def remove_silences(date_folder):
+def remove_silences(date_folder, streaming=False, workers=None):
     """
     Function that removes silences from all audio files in a folder.
     File structure is
@@ -156,6 +40,16 @@ def remove_silences(date_folder):
         date_folder | pathlib.PosixPath
         Path to the date folder that contains the filename folders that contain
         the audio files that you want to remove silences from.
+
+        streaming | bool
+        If True, each `.wav` file is read and written in fixed size blocks so
+        that memory use does not grow with the length of the recording.
+
+        workers | int
+        If given, the `_raw_N.wav` chunks are processed as one recording on
+        this many cores, carrying the threshold and the silence counter across
+        the chunks, so the result is the same as a single pass over the whole
+        recording. Otherwise each chunk starts with a new threshold.
     """
     date_folder_path = Path(date_folder)
     files = [f for f in listdir(date_folder_path) if isfile(join(date_folder_path, f))]
@@ -163,40 +57,86 @@ def remove_silences(date_folder):
     if len(to_process) == 0:
       print('There are no files with the correct format')
       exit(1)
+    if workers is not None:
+        # The chunks must be in the order of the recording
+        to_process = sorted(to_process, key=chunk_order)
+        input_paths = [Path(date_folder_path, file) for file in to_process]
+        output_paths = [
+            Path(
+                date_folder_path,
+                re.sub(pattern=f"_raw_\.*", repl=f"_processed_temp_", string=file),
+            )
+            for file in to_process
+        ]
+        print(f"Processing {len(input_paths)} chunks with {workers} workers")
+        with StageTimer("vad", folder=date_folder_path) as timer:
+            for input_path in input_paths:
+                timer.count_file(input_path)
+            parallel_silence_removal(input_paths, output_paths, workers=workers)
+        print("done silence removal")
+        return
     for file_folder in to_process:
         input_filename = Path(date_folder_path,Path(file_folder))
 
         print(f"Path: {Path(input_filename)}")
-        # Use the .wav file
-        try:
-            wav = wf.read(str(Path(Path(file_folder), input_filename)))
-        except (ValueError):
-            raise Exception(f"{input_filename} failed.")
-        sample_rate = wav[0]
-        audio_data = wav[1]
-        logging.info(f"Audio data: {audio_data}")
-
-        vad = VoiceActivityDetection()
-        # Remove the silences
-        vad.process(audio_data)
-        # Get the processed audio
-        voice_samples = vad.get_voice_samples()
         output_name = re.sub(
             pattern=f"_raw_\.*",
             repl=f"_processed_temp_",
             string=Path(input_filename).name,
         )
         output_path = Path(Path(input_filename).parent, output_name)
-        # Write the processed audio into a new `.wav` file
         print(f"writing: {output_path}")
-        wf.write(f"{output_path}", sample_rate, voice_samples)
+        with StageTimer("vad", folder=date_folder_path) as timer:
+            timer.count_file(input_filename)
+            # Read, process and write the file one block at a time
+            if streaming:
+                stream_silence_removal(
+                    input_path=input_filename, output_path=output_path
+                )
+                print("done silence removal")
+                continue
+
+            # Use the .wav file, memory mapped instead of copied into memory
+            try:
+                wav = read_wav_mmap(str(Path(Path(file_folder), input_filename)))
+            except (ValueError):
+                raise Exception(f"{input_filename} failed.")
+            sample_rate = wav[0]
+            audio_data = wav[1]
+            logging.info(f"Audio data: {audio_data}")
+
+            vad = VoiceActivityDetection(sample_rate=sample_rate)
+            # Remove the silences
+            vad.process_batch(audio_data)
+            # Get the processed audio
+            voice_samples = vad.get_voice_samples()
+            # Write the processed audio into a new `.wav` file
+            wf.write(f"{output_path}", sample_rate, voice_samples)
         print("done silence removal")
 
 
-try:
-    remove_silences(date_folder=sys.argv[1])
-except (IndexError):
-    raise Exception(
-        f"Error, you must supply a date like the example below:\n"
-        + "python vad.py 2021-07-14"
-    )
\ No newline at end of file
+if __name__ == "__main__":
+    # Set up the logging
+    set_up_logging(log_path="logging/vad/", log_level=logging.INFO)
+    # Show system arguments
+    logging.info(f"System arguments: {sys.argv}")
+
+    try:
+        # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+        with profile_stage(
+            f"vad_{Path(sys.argv[1]).name}",
+            "logging/vad/profiles/",
+            profiling_mode(),
+        ):
+            remove_silences(
+                date_folder=sys.argv[1],
+                streaming="--streaming" in sys.argv[2:],
+                workers=os.cpu_count() if "--parallel" in sys.argv[2:] else None,
+            )
+    except (IndexError):
+        raise Exception(
+            f"Error, you must supply a date like the example below:\n"
+            + "python vad.py 2021-07-14"
+        )
+    # Latency and throughput of the silence removal of this run
+    write_report("logging/vad/")
@@ -4,7 +4,7 @@
 # Uncomment the noted lines to run the script on all folders in a single scrape
 
 import logging
-import numpy as np
+import os
 import scipy.io.wavfile as wf
 import re
 import sys
@@ -13,136 +13,40 @@ from os import listdir
 from os.path import isfile, join
 
 from useful_functions.useful_functions import set_up_logging
+from useful_functions.instrumentation import StageTimer, write_report
+from useful_functions.profiling import profile_stage, profiling_mode
 from useful_functions.convert_to_wav import convert_to_wav
+from useful_functions.decode_audio import (
+    DECODE_EXTENSIONS,
+    decode_audio_blocks,
+    probe_audio,
+)
+from useful_functions.wav_io import read_wav_mmap
+from useful_functions.parallel_vad import parallel_silence_removal
+from useful_functions.build_manifest import (
+    is_up_to_date,
+    record_stage,
+    recorded_outputs,
+)
+from useful_functions.segment_writer import SegmentWriter
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    remove_silences_from_blocks,
+    stream_silence_removal,
+)
 
-# Set up the logging
-set_up_logging(log_path="logging/vad/", log_level=logging.INFO)
-# Show system arguments
-logging.info(f"System arguments: {sys.argv}")
-
-
-class VoiceActivityDetection:
-    def __init__(self):
-        self.__step = 160
-        self.__buffer_size = 160
-        self.__buffer = np.zeros(shape=(0, 2), dtype=np.int16)
-        self.__out_buffer = np.zeros(shape=(0, 2), dtype=np.int16)
-        self.__n = 0
-        self.__VADthd = 0.0  # Period used to convert to floating point number
-        self.__VADn = 0.0
-        self.__silence_counter = 0
-        self.__channels = 0  # Number of audio channels
-
-    # Voice Activity Detection
-    # Adaptive threshold
-    def vad(self, _frame, threshold=0.1):
-        # Each _frame consists of 160 non-overlapping amplitude measurements
-
-        # Check that the threshold is between 0 and 1
-        if threshold < 0:
-            raise Exception(f"Error, threshold: {threshold} is lower than 0.")
-        elif threshold > 1:
-            raise Exception(f"Error, threshold: {threshold} is larger than 1.")
-
-        frame = np.array(_frame) ** 2.0
-        max_frame = np.zeros(len(frame))
-        for index, array in enumerate(frame):
-            max_frame[index] = np.max(array)
-        result = True
-        threshold = 0.02
-        thd = np.min(frame) + np.ptp(frame) * threshold
-        # This is the previous frame's thd
-        self.__VADthd = (self.__VADn * self.__VADthd + thd) / float(
-            self.__VADn + 1.0
-        )
-        self.__VADn += 1.0
-
-        # Take the mean of the maximum amplitudes across any channel
-        if np.mean(max_frame) <= self.__VADthd:
-            self.__silence_counter += 1
-        else:
-            self.__silence_counter = 0
-
-        if self.__silence_counter > 60:
-            result = False
-        return result
-
-    # Push new audio samples into the buffer.
-    def add_samples(self, data):
-        self.__buffer = np.append(self.__buffer, data, axis=0)
-        result = len(self.__buffer) >= self.__buffer_size
-        return result
-
-    # Pull a portion of the buffer to process (pulled samples are deleted
-    # after being processed)
-    def get_frame(self):
-        window = self.__buffer[: self.__buffer_size]
-        self.__buffer = self.__buffer[self.__step :]
-        return window
-
-    # Adds new audio samples to the internal buffer and processes them
-    def process(self, data):
-        logging.debug(f"First frame of audio data:\n{data[ :160]}")
-        # Detects mono or stereo audio
-        self.__channels = self.get_audio_channels(data=data)
-        if self.__channels == 1:
-            logging.info("This is mono audio")
-            # Reshape data so that it works with np.append(axis = 0)
-            # and other functions that only work with 2d arrays
-            data = data.reshape(len(data), 1)
-            self.__buffer = np.zeros(shape=(0, 1), dtype=np.int16)
-            self.__out_buffer = np.zeros(shape=(0, 1), dtype=np.int16)
-
-        elif self.__channels == 2:
-            logging.info("This is stereo audio")
-
-        if self.add_samples(data):
-            while len(self.__buffer) >= self.__buffer_size:
-                # Framing
-                window = self.get_frame()
-                # Add window if threshold is met
-                if self.vad(_frame=window, threshold=0.01):  # speech frame
-                    self.__out_buffer = np.append(
-                        self.__out_buffer, window, axis=0
-                    )
-
-    def get_voice_samples(self):
-        # If mono audio, undo the earlier reshaping
-        if self.__channels == 1:
-            self.__out_buffer = self.__out_buffer.reshape(
-                len(self.__out_buffer)
-            )
-            # Check that the resulting shape is 1d instead of 2d
-            logging.debug(self.__out_buffer.shape)
-        return self.__out_buffer
-
-    def get_audio_channels(self, data):
-        """
-        Function that takes audio data and returns the number of audio   channels as an integer.
-        
-        Arguments:
-        data | numpy.ndarray
-        Audio data from
-        `scipy.io.wavfile.read(filename = 'your_file_name')[1]`.
-        
-        Returns:
-        int
-        1 for mono audio, 2 for stereo audio
-        """
-        # Mono audio is just an array
-        if len(data.shape) == 1:
-            return 1
-        # However stereo audio is an array of arrays where each inner array
-        # is the audio of both sides at that particular time point
-        elif data.shape[1] == 2:
-            return 2
-        else:
-            raise Exception("Error, data is neither mono or stereo!")
+# The settings of `VoiceActivityDetection` that change the processed audio,
+# recorded in the build manifest. The frames, the hop between them and the
+# hangover are in milliseconds, so they are the same at every sample rate.
+# Longer frames and hops process faster but cut less precisely; a hop shorter
+# than the frame makes the frames overlap
+VAD_PARAMETERS = {"frame_ms": 10, "hop_ms": 10, "hangover_ms": 600}
 
 # in the case where you are not loping the date_folder is just a audio file folder
-def remove_silences(date_folder):
+def get_file(date_folder, convert=False):
     """
-    Function that removes silences from all audio files in a folder.
+    Function that finds the raw audio file of a filename folder that silence
+    removal should process.
     File structure is
     ```
     | data
@@ -156,6 +60,14 @@ def remove_silences(date_folder):
         date_folder | pathlib.PosixPath
         Path to the date folder that contains the filename folders that contain
         the audio files that you want to remove silences from.
+
+        convert | bool
+        If True, `.aac` and `.mp3` files are converted into a `.wav` file
+        first.
+
+    Returns:
+        pathlib.PosixPath
+        Path to the audio file.
     """
     date_folder_path = Path(date_folder)
     # comment out to loop
@@ -166,14 +78,21 @@ def remove_silences(date_folder):
         # Loop through raw files in the filename folders, excluding hidden
         # files
     # tab over to loop
-    files = [f for f in listdir(file_folder) if isfile(join(file_folder, f))]
+    # Hidden files, like the build manifest, are not audio files, and `.part`
+    # files are downloads that `reddit_scraper.py` hasn't finished yet
+    files = [
+        f for f in listdir(file_folder)
+        if isfile(join(file_folder, f))
+        and not f.startswith(".")
+        and not f.endswith(".part")
+    ]
     if len(files) == 1:
         input_filename = Path(file_folder,Path(files[0]))
         if "_raw." in files[0]:
             audio_file_extension = Path(input_filename).suffix
             logging.info(f"Audio file extension: {audio_file_extension}")
             # If the file isn't a .wav file, convert it into a .wav file
-            if audio_file_extension != ".wav":
+            if audio_file_extension != ".wav" and convert:
                 print("creating .wav")
                 convert_to_wav(input_filename)
                 # replace filename extension with .wav
@@ -191,12 +110,6 @@ def remove_silences(date_folder):
         # Comment out the following to loop
         exit(1)
     else:
-        if any("processed.wav" in filename for filename in files):
-            print(f"It appears this file has already been processed, skipping {file_folder}")
-            # Uncomment below to allow loop to continue if looping
-            #continue
-            # Comment out the following to loop
-            exit(1)
         raw_files = [file for file in files if "_raw." in file]
         input_filename = [file for file in raw_files if ".wav" in file]
         if not len(input_filename) and len(raw_files) == 1 :
@@ -204,7 +117,7 @@ def remove_silences(date_folder):
             audio_file_extension = Path(input_filename).suffix
             logging.info(f"Audio file extension: {audio_file_extension}")
             # If the file isn't a .wav file, convert it into a .wav file
-            if audio_file_extension != ".wav":
+            if audio_file_extension != ".wav" and convert:
                 print("creating .wav")
                 convert_to_wav(input_filename)
                 # replace filename extension with .wav
@@ -224,37 +137,287 @@ def remove_silences(date_folder):
             #continue
             # Comment out the following to loop
             exit(1)
+    return input_filename
+
+
+def check_extension(input_filename):
+    # Only the formats that `convert_to_wav` converts are decoded through the
+    # ffmpeg pipe, anything else isn't a finished audio download
+    audio_file_extension = Path(input_filename).suffix
+    if audio_file_extension not in DECODE_EXTENSIONS:
+        raise Exception(
+            f"The '{audio_file_extension}' " + "extension is not supported!"
+        )
+
+
+def remove_silences(
+    date_folder, streaming=False, convert=False, workers=None, analysis_rate=None
+):
+    """
+    Function that removes silences from all audio files in a folder.
+    File structure is
+    ```
+    | data
+    | |-- reddit
+    |     |-- date_folder
+    |         |-- filename_folder
+    |             |-- audio_files
+    ```
+    
+    Arguments:
+        date_folder | pathlib.PosixPath
+        Path to the date folder that contains the filename folders that contain
+        the audio files that you want to remove silences from.
+
+        streaming | bool
+        If True, the `.wav` file is read and written in fixed size blocks so
+        that memory use does not grow with the length of the recording.
+
+        convert | bool
+        If True, `.aac` and `.mp3` files are converted into a `.wav` file
+        first. Otherwise ffmpeg decodes them straight into memory through a
+        pipe, without writing the intermediate `.wav` file.
+
+        workers | int
+        If given, a `.wav` file is processed on this many cores. The threshold
+        and the silence counter are carried across the parts in order, so the
+        result is the same.
+
+        analysis_rate | int
+        If given, e.g. 16000, the silences are found in a mono copy of the
+        audio at this sample rate and cut from the original audio. It can't
+        be combined with `workers`.
+    """
+    file_folder = Path(date_folder)
+    input_filename = get_file(date_folder, convert=convert)
 
     print(f"Path: {Path(input_filename)}")
-    # Use the .wav file
-    try:
-        wav = wf.read(str(Path(Path(file_folder), input_filename)))
-    except (ValueError):
-        raise Exception(f"{input_filename} failed.")
-    sample_rate = wav[0]
-    audio_data = wav[1]
-    logging.info(f"Audio data: {audio_data}")
-
-    vad = VoiceActivityDetection()
-    # Remove the silences
-    vad.process(audio_data)
-    # Get the processed audio
-    voice_samples = vad.get_voice_samples()
     output_name = re.sub(
         pattern=f"_raw\..*",
         repl="_processed.wav",
         string=Path(input_filename).name,
     )
     output_path = Path(Path(input_filename).parent, output_name)
-    # Write the processed audio into a new `.wav` file
-    wf.write(f"{output_path}", sample_rate, voice_samples)
+    input_path = Path(input_filename)
+    if workers is not None and analysis_rate is not None:
+        raise Exception("Error, analysis_rate can't be used with workers!")
+    # The settings that change the processed audio
+    vad_parameters = dict(VAD_PARAMETERS)
+    if analysis_rate is not None:
+        vad_parameters["analysis_rate"] = analysis_rate
+    parameters = dict(vad_parameters)
+    # Skip the file if it was processed before and nothing changed since
+    if is_up_to_date(file_folder, "vad", [input_path], parameters):
+        print(f"{output_path.name} is up to date, skipping {file_folder}")
+        return
+
+    with StageTimer("vad", folder=file_folder) as timer:
+        timer.count_file(input_path)
+        if Path(input_filename).suffix != ".wav":
+            check_extension(input_filename)
+            # Decode the file with ffmpeg and process it one block at a time
+            sample_rate, channels = probe_audio(input_filename)
+            remove_silences_from_blocks(
+                blocks=timer.count_blocks(
+                    decode_audio_blocks(input_filename, channels=channels),
+                    sample_rate,
+                ),
+                output_path=output_path,
+                sample_rate=sample_rate,
+                **vad_parameters,
+            )
+        elif workers is not None:
+            # Compute the frame energies and write the kept frames in parallel
+            parallel_silence_removal(
+                [input_path], [output_path], workers=workers, **VAD_PARAMETERS
+            )
+        elif streaming:
+            # Read, process and write the file one block at a time
+            stream_silence_removal(
+                input_path=input_path, output_path=output_path, **vad_parameters
+            )
+        else:
+            # Use the .wav file, memory mapped instead of copied into memory
+            try:
+                wav = read_wav_mmap(str(input_path))
+            except (ValueError):
+                raise Exception(f"{input_filename} failed.")
+            sample_rate = wav[0]
+            audio_data = wav[1]
+            logging.info(f"Audio data: {audio_data}")
+
+            vad = VoiceActivityDetection(sample_rate=sample_rate, **vad_parameters)
+            # Remove the silences
+            vad.process_batch(audio_data)
+            # Get the processed audio
+            voice_samples = vad.get_voice_samples()
+            # Write the processed audio into a new `.wav` file
+            wf.write(f"{output_path}", sample_rate, voice_samples)
+    record_stage(file_folder, "vad", [input_path], [output_path], parameters)
     print("done silence removal")
 
 
-try:
-    remove_silences(date_folder=sys.argv[1])
-except (IndexError):
-    raise Exception(
-        f"Error, you must supply a date like the example below:\n"
-        + "python vad.py 2021-07-14"
+def remove_silences_and_segment(
+    date_folder,
+    segment_seconds=10,
+    boundaries="fixed",
+    tolerance_seconds=1,
+    keep_processed=False,
+    block_size=1048576,
+    analysis_rate=None,
+):
+    """
+    Function that removes silences and writes the segments in a single pass,
+    instead of writing the `_processed.wav` file and reading it again for
+    segmentation. The segments are the same as running `remove_silences` and
+    then `segmentation.segment`.
+
+    Arguments:
+        date_folder | pathlib.PosixPath
+        Path to the filename folder that contains the raw audio file.
+
+        segment_seconds | int
+        The length of each segment in seconds.
+
+        boundaries | str
+        "fixed" or "silence", see `segmentation.segment`.
+
+        tolerance_seconds | float
+        How far a cut may move in "silence" mode.
+
+        keep_processed | bool
+        If True, the `_processed.wav` file is written as well.
+
+        block_size | int
+        Number of samples (per channel) processed at a time.
+
+        analysis_rate | int
+        If given, the silences are found in a mono copy of the audio at this
+        sample rate, see `remove_silences`.
+
+    Returns:
+        int
+        The number of segments written.
+    """
+    file_folder = Path(date_folder)
+    input_path = Path(get_file(date_folder))
+    print(f"Path: {input_path}")
+    processed_path = Path(
+        input_path.parent,
+        re.sub(pattern=f"_raw\..*", repl="_processed.wav", string=input_path.name),
     )
+    vad_parameters = dict(VAD_PARAMETERS)
+    if analysis_rate is not None:
+        vad_parameters["analysis_rate"] = analysis_rate
+    parameters = {
+        **vad_parameters,
+        "segment_seconds": segment_seconds,
+        "boundaries": boundaries,
+        "tolerance_seconds": tolerance_seconds,
+        "keep_processed": keep_processed,
+    }
+    stage = "vad segmentation"
+    # Skip the file if it was processed before and nothing changed since
+    if is_up_to_date(file_folder, stage, [input_path], parameters):
+        print(f"Segments of {input_path.name} are up to date, skipping")
+        return len(
+            [
+                output
+                for output in recorded_outputs(file_folder, stage)
+                if output.name != processed_path.name
+            ]
+        )
+    # Remove the files of the last run, a new run may write fewer segments
+    for old_output in recorded_outputs(file_folder, stage):
+        old_output.unlink(missing_ok=True)
+
+    timer = StageTimer("vad segmentation", folder=file_folder)
+    timer.count_file(input_path)
+    if input_path.suffix != ".wav":
+        check_extension(input_path)
+        # Decode the file with ffmpeg one block at a time
+        sample_rate, channels = probe_audio(input_path)
+        blocks = timer.count_blocks(
+            decode_audio_blocks(
+                input_path, block_size=block_size, channels=channels
+            ),
+            sample_rate,
+        )
+    else:
+        # Memory map the .wav file and process it one block at a time
+        sample_rate, audio_data = read_wav_mmap(input_path)
+        # At least one block, so that an empty file still sets the format
+        blocks = (
+            audio_data[start : start + block_size]
+            for start in range(0, max(len(audio_data), 1), block_size)
+        )
+
+    vad = VoiceActivityDetection(sample_rate=sample_rate, **vad_parameters)
+    with timer, SegmentWriter(
+        output_folder=input_path.parent,
+        output_stem=processed_path.stem,
+        sample_rate=sample_rate,
+        segment_seconds=segment_seconds,
+        boundaries=boundaries,
+        tolerance_seconds=tolerance_seconds,
+        # Look for the quietest moment in frames that line up with the VAD's
+        frame_ms=vad_parameters["frame_ms"],
+        hop_ms=vad_parameters.get("hop_ms"),
+        processed_path=processed_path if keep_processed else None,
+    ) as writer:
+        # The kept frames of each block go straight into the segments
+        for block in blocks:
+            vad.process_batch(block)
+            writer.write(vad.pop_voice_samples())
+    segment_paths = writer.segment_paths
+    for segment_path in segment_paths:
+        print(f"Segmented {segment_path.name}")
+
+    outputs = segment_paths + ([processed_path] if keep_processed else [])
+    record_stage(file_folder, stage, [input_path], outputs, parameters)
+    print("done silence removal and segmentation")
+    return len(segment_paths)
+
+
+if __name__ == "__main__":
+    # Set up the logging
+    set_up_logging(log_path="logging/vad/", log_level=logging.INFO)
+    # Show system arguments
+    logging.info(f"System arguments: {sys.argv}")
+
+    try:
+        # Opt-in profiling with --profile, --profile-sample or PIPELINE_PROFILE
+        with profile_stage(
+            f"vad_{Path(sys.argv[1]).name}",
+            "logging/vad/profiles/",
+            profiling_mode(),
+        ):
+            if "--segment" in sys.argv[2:]:
+                # Write the segments directly, in the same pass
+                remove_silences_and_segment(
+                    date_folder=sys.argv[1],
+                    boundaries=(
+                        "silence" if "--silence-boundaries" in sys.argv[2:] else "fixed"
+                    ),
+                    keep_processed="--keep-processed" in sys.argv[2:],
+                    analysis_rate=(
+                        16000 if "--analysis-16k" in sys.argv[2:] else None
+                    ),
+                )
+            else:
+                remove_silences(
+                    date_folder=sys.argv[1],
+                    streaming="--streaming" in sys.argv[2:],
+                    convert="--convert" in sys.argv[2:],
+                    workers=os.cpu_count() if "--parallel" in sys.argv[2:] else None,
+                    analysis_rate=(
+                        16000 if "--analysis-16k" in sys.argv[2:] else None
+                    ),
+                )
+    except (IndexError):
+        raise Exception(
+            f"Error, you must supply a date like the example below:\n"
+            + "python vad.py 2021-07-14"
+        )
+    # Latency and throughput of the stages of this run
+    write_report("logging/vad/")
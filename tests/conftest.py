@@ -0,0 +1,13 @@
+# conftest.py
+# Fixtures shared by the tests
+
+# Packages
+import pytest
+
+from generated_audio import make_speech
+
+
+@pytest.fixture(params=[1, 2], ids=["mono", "stereo"])
+def audio_data(request):
+    # Six seconds of generated 16 kHz speech, mono and stereo
+    return make_speech(seconds=6, channels=request.param)
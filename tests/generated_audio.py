@@ -0,0 +1,56 @@
+# generated_audio.py
+# Generated audio and reference results shared by the tests
+
+# Packages
+import numpy as np
+
+from useful_functions.voice_activity_detection import VoiceActivityDetection
+
+SAMPLE_RATE = 16000
+
+
+def make_speech(seconds, channels, sample_rate=SAMPLE_RATE, seed=0):
+    """
+    Function that makes 16 bit audio that looks like speech to the silence
+    removal: loud bursts of noise separated by quiet pauses.
+
+    Arguments:
+    seconds | float
+    Length of the audio.
+
+    channels | int
+    1 for mono audio, 2 for stereo audio.
+
+    sample_rate | int
+    Number of samples per second.
+
+    seed | int
+    Seed of the random numbers.
+
+    Returns:
+    numpy.ndarray
+    Audio data in the format of `scipy.io.wavfile.read`.
+    """
+    rng = np.random.default_rng(seed)
+    number_of_samples = int(seconds * sample_rate)
+    # Bursts of about 0.3 to 1.2 seconds, with pauses longer than the hangover
+    envelope = np.sin(np.arange(number_of_samples) / (0.4 * sample_rate)) > 0.5
+    audio_data = rng.standard_normal((number_of_samples, channels)) * (
+        3000 * envelope[:, np.newaxis] + 20
+    )
+    audio_data = audio_data.astype(np.int16)
+    return audio_data[:, 0] if channels == 1 else audio_data
+
+
+def frame_loop(audio_data, sample_rate=SAMPLE_RATE, **vad_parameters):
+    # The reference: the original one frame per iteration loop
+    vad = VoiceActivityDetection(sample_rate=sample_rate, **vad_parameters)
+    vad.process(audio_data)
+    return vad.get_voice_samples()
+
+
+def blocks_of(audio_data, block_size):
+    return [
+        audio_data[start : start + block_size]
+        for start in range(0, len(audio_data), block_size)
+    ]
@@ -0,0 +1,110 @@
+# test_analysis_front_end.py
+# Checks the 16 kHz mono analysis front end and the silence removal that
+# makes its decisions on it and cuts the original audio
+
+# Packages
+from math import gcd
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+from generated_audio import blocks_of, make_speech
+from useful_functions.analysis_front_end import AnalysisFrontEnd
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    frame_view,
+)
+
+ANALYSIS_RATE = 16000
+
+
+@pytest.fixture(params=[(44100, 2), (48000, 2), (48000, 1)], ids=str)
+def full_rate_audio(request):
+    sample_rate, channels = request.param
+    return sample_rate, make_speech(
+        seconds=4, channels=channels, sample_rate=sample_rate
+    )
+
+
+def test_front_end_matches_resample_poly(full_rate_audio):
+    sample_rate, audio_data = full_rate_audio
+    front_end = AnalysisFrontEnd(sample_rate, ANALYSIS_RATE)
+    analysis = np.concatenate(
+        [front_end.push(block) for block in blocks_of(audio_data, 3333)]
+    )
+    mono = audio_data.mean(axis=1) if audio_data.ndim == 2 else audio_data
+    divisor = gcd(sample_rate, ANALYSIS_RATE)
+    expected = resample_poly(
+        mono.astype(np.float64),
+        ANALYSIS_RATE // divisor,
+        sample_rate // divisor,
+    )
+    # Only the last few milliseconds are withheld
+    assert len(expected) - 0.01 * ANALYSIS_RATE < len(analysis) <= len(expected)
+    np.testing.assert_allclose(analysis, expected[: len(analysis)], atol=1e-9)
+
+
+def test_analysis_rate_whole_matches_uneven_blocks(full_rate_audio):
+    sample_rate, audio_data = full_rate_audio
+    vad = VoiceActivityDetection(
+        sample_rate=sample_rate, analysis_rate=ANALYSIS_RATE
+    )
+    vad.process_batch(audio_data)
+    expected = vad.get_voice_samples()
+    assert 0 < len(expected) < len(audio_data)
+    rng = np.random.default_rng(1)
+    vad = VoiceActivityDetection(
+        sample_rate=sample_rate, analysis_rate=ANALYSIS_RATE
+    )
+    start = 0
+    while start < len(audio_data):
+        block_size = int(rng.integers(1, 20000))
+        vad.process_batch(audio_data[start : start + block_size])
+        start += block_size
+    voice_samples = vad.get_voice_samples()
+    assert voice_samples.dtype == audio_data.dtype
+    np.testing.assert_array_equal(voice_samples, expected)
+
+
+def test_analysis_rate_cuts_the_full_rate_audio(full_rate_audio):
+    # The decisions are made on a 16 kHz mono copy and each kept frame keeps
+    # the samples of the original audio during its hop
+    sample_rate, audio_data = full_rate_audio
+    vad = VoiceActivityDetection(
+        sample_rate=sample_rate, analysis_rate=ANALYSIS_RATE
+    )
+    vad.process_batch(audio_data)
+    voice_samples = vad.get_voice_samples()
+
+    mono = audio_data.mean(axis=1) if audio_data.ndim == 2 else audio_data
+    divisor = gcd(sample_rate, ANALYSIS_RATE)
+    up, down = ANALYSIS_RATE // divisor, sample_rate // divisor
+    analysis = resample_poly(mono.astype(np.float64), up, down)
+    reference = VoiceActivityDetection(sample_rate=ANALYSIS_RATE)
+    hop_size = reference.hop_size
+    number_of_frames = (len(analysis) - reference.frame_size) // hop_size + 1
+    keep = reference.vad_frames(
+        frame_view(
+            analysis.reshape(-1, 1),
+            number_of_frames,
+            reference.frame_size,
+            hop_size,
+        ),
+        threshold=0.01,
+    )
+    hop_starts = (np.arange(number_of_frames + 1) * hop_size * down) // up
+    expected = np.concatenate(
+        [
+            audio_data[hop_starts[index] : hop_starts[index + 1]]
+            for index in np.flatnonzero(keep)
+        ]
+    )
+    # The front end withholds the frames at the very end of the recording
+    assert len(expected) - len(voice_samples) <= 0.05 * sample_rate
+    np.testing.assert_array_equal(voice_samples, expected[: len(voice_samples)])
+
+
+def test_process_rejects_analysis_rate():
+    vad = VoiceActivityDetection(sample_rate=48000, analysis_rate=ANALYSIS_RATE)
+    with pytest.raises(Exception, match="analysis_rate"):
+        vad.process(make_speech(seconds=1, channels=1, sample_rate=48000))
@@ -0,0 +1,83 @@
+# test_frame_settings.py
+# Checks the frame length, hop and hangover of `VoiceActivityDetection`, set
+# in milliseconds
+
+# Packages
+import numpy as np
+import pytest
+
+from generated_audio import blocks_of, frame_loop, make_speech
+from useful_functions.segment_boundaries import energy_envelope, silence_cut_points
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    frame_view,
+)
+
+
+@pytest.mark.parametrize(
+    "sample_rate, frame_size, hop_size, hangover_frames",
+    [(16000, 160, 160, 60), (44100, 441, 441, 60), (48000, 480, 480, 60)],
+)
+def test_default_settings_in_samples(
+    sample_rate, frame_size, hop_size, hangover_frames
+):
+    vad = VoiceActivityDetection(sample_rate=sample_rate)
+    assert vad.frame_size == frame_size
+    assert vad.hop_size == hop_size
+    assert vad.hangover_frames == hangover_frames
+
+
+def test_hop_longer_than_frame_is_rejected():
+    with pytest.raises(Exception, match="hop_ms"):
+        VoiceActivityDetection(frame_ms=10, hop_ms=20)
+
+
+@pytest.mark.parametrize("sample_rate", [16000, 44100])
+@pytest.mark.parametrize(
+    "vad_parameters",
+    [
+        {"frame_ms": 20, "hop_ms": 10, "hangover_ms": 300},
+        {"frame_ms": 25, "hop_ms": 5, "hangover_ms": 0},
+    ],
+    ids=["half overlap", "high overlap"],
+)
+@pytest.mark.parametrize("channels", [1, 2], ids=["mono", "stereo"])
+def test_overlapping_frames_match_frame_loop(sample_rate, vad_parameters, channels):
+    audio_data = make_speech(seconds=3, channels=channels, sample_rate=sample_rate)
+    expected = frame_loop(audio_data, sample_rate=sample_rate, **vad_parameters)
+    assert 0 < len(expected) < len(audio_data)
+    vad = VoiceActivityDetection(sample_rate=sample_rate, **vad_parameters)
+    vad.process_batch(audio_data)
+    np.testing.assert_array_equal(vad.get_voice_samples(), expected)
+    # The frames that overlap the seams between blocks are the same
+    vad = VoiceActivityDetection(sample_rate=sample_rate, **vad_parameters)
+    for block in blocks_of(audio_data, 2345):
+        vad.process_batch(block)
+    np.testing.assert_array_equal(vad.get_voice_samples(), expected)
+
+
+def test_envelope_frames_follow_the_sample_rate():
+    audio_data = make_speech(seconds=2, channels=2, sample_rate=44100)
+    envelope = energy_envelope([audio_data], 44100)
+    # 10 ms frames are 441 samples at 44.1 kHz
+    assert len(envelope) == len(audio_data) // 441
+    vad = VoiceActivityDetection(sample_rate=44100)
+    frames = frame_view(audio_data, len(envelope), 441, 441)
+    np.testing.assert_array_equal(envelope, vad.frame_energies(frames)[1])
+    # Each cut is in the middle of a 441 sample frame
+    cut_points = silence_cut_points(
+        envelope, 44100, segment_seconds=0.5, tolerance_seconds=0.1
+    )
+    assert len(cut_points) == 4
+    assert all(cut % 441 == 441 // 2 for cut in cut_points)
+
+
+@pytest.mark.parametrize("block_size", [100, 1234], ids=["short", "long"])
+def test_overlapping_envelope_in_blocks(block_size):
+    audio_data = make_speech(seconds=1, channels=2, sample_rate=44100)
+    expected = energy_envelope([audio_data], 44100, frame_ms=25, hop_ms=5)
+    # Blocks shorter than a frame, and frames across the seams of blocks
+    envelope = energy_envelope(
+        blocks_of(audio_data, block_size), 44100, frame_ms=25, hop_ms=5
+    )
+    np.testing.assert_array_equal(envelope, expected)
@@ -0,0 +1,61 @@
+# test_instrumentation.py
+# Checks the stage report of `instrumentation.py`: the time per folder and
+# the names of the report files
+
+# Packages
+import csv
+import json
+
+from useful_functions.instrumentation import (
+    StageTimer,
+    pop_records,
+    summarize_folders,
+    write_report,
+)
+
+
+def test_records_have_folders():
+    pop_records()
+    with StageTimer("vad", folder="post_a"):
+        pass
+    with StageTimer("segmentation", folder="post_a"):
+        pass
+    with StageTimer("vad"):
+        pass
+    records = pop_records()
+    assert [record["folder"] for record in records] == ["post_a", "post_a", None]
+    folders = summarize_folders(records)
+    # The timing without a folder isn't part of any folder
+    assert [row["folder"] for row in folders] == ["post_a"]
+    assert folders[0]["total_seconds"] == (
+        records[0]["seconds"] + records[1]["seconds"]
+    )
+
+
+def test_reports_in_the_same_second_are_kept(tmp_path):
+    records = [
+        {
+            "stage": "vad",
+            "folder": folder,
+            "seconds": seconds,
+            "bytes": 0,
+            "audio_seconds": 0.0,
+            "failed": False,
+        }
+        for folder, seconds in [("post_a", 1.0), ("post_b", 3.0)]
+    ]
+    first_paths = write_report(tmp_path, records=records)
+    second_paths = write_report(tmp_path, records=records)
+    assert first_paths[0] != second_paths[0]
+    assert len(list(tmp_path.glob("stage_report_*.json"))) == 2
+
+    with open(first_paths[0]) as json_file:
+        report = json.load(json_file)
+    assert [row["folder"] for row in report["folders"]] == ["post_b", "post_a"]
+    folders_path = first_paths[0].with_name(f"{first_paths[0].stem}_folders.csv")
+    with open(folders_path, newline="") as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [(row["folder"], float(row["vad"])) for row in rows] == [
+        ("post_b", 3.0),
+        ("post_a", 1.0),
+    ]
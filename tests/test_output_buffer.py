@@ -0,0 +1,44 @@
+# test_output_buffer.py
+# Checks the growable output buffer of `VoiceActivityDetection`
+
+# Packages
+import numpy as np
+
+from generated_audio import SAMPLE_RATE, blocks_of, frame_loop
+from useful_functions.voice_activity_detection import VoiceActivityDetection
+
+
+def test_pop_voice_samples_per_block_matches_frame_loop(audio_data):
+    expected = frame_loop(audio_data)
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    popped = []
+    for block in blocks_of(audio_data, 4321):
+        vad.process_batch(block)
+        popped.append(vad.pop_voice_samples())
+    # The popped arrays must not be overwritten by later blocks
+    np.testing.assert_array_equal(np.concatenate(popped), expected)
+
+
+def test_get_voice_samples_is_a_view(audio_data):
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    vad.process_batch(audio_data)
+    voice_samples = vad.get_voice_samples()
+    assert not voice_samples.flags.owndata
+    # Asking again doesn't copy the samples either
+    assert np.shares_memory(voice_samples, vad.get_voice_samples())
+
+
+def test_samples_returned_earlier_stay_valid(audio_data):
+    # Samples from `get_voice_samples` keep their values while the buffer
+    # grows and is copied
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    blocks = blocks_of(audio_data, 2000)
+    vad.process_batch(blocks[0])
+    first_samples = vad.get_voice_samples()
+    expected = first_samples.copy()
+    for block in blocks[1:]:
+        vad.process_batch(block)
+    np.testing.assert_array_equal(first_samples, expected)
+    np.testing.assert_array_equal(
+        vad.get_voice_samples()[: len(expected)], expected
+    )
@@ -0,0 +1,43 @@
+# test_parallel_vad.py
+# Checks that the parallel silence removal, which carries the threshold and
+# the silence counter across the seams between tasks and files, keeps the
+# same samples as the frame loop
+
+# Packages
+from pathlib import Path
+import numpy as np
+import pytest
+import scipy.io.wavfile as wf
+import wave
+
+from generated_audio import SAMPLE_RATE, frame_loop
+from useful_functions.parallel_vad import parallel_silence_removal
+
+
+@pytest.mark.parametrize("chunks", [1, 3], ids=["one file", "three chunks"])
+def test_parallel_matches_frame_loop(audio_data, tmp_path, chunks):
+    wav_paths = []
+    for index, chunk in enumerate(np.array_split(audio_data, chunks)):
+        wav_paths.append(Path(tmp_path, f"video_raw_{index}.wav"))
+        wf.write(wav_paths[-1], SAMPLE_RATE, chunk)
+    output_path = Path(tmp_path, "video_processed.wav")
+    # Small tasks, so that the threshold is carried across several seams
+    parallel_silence_removal(
+        wav_paths, [output_path], workers=2, frames_per_task=1000
+    )
+    np.testing.assert_array_equal(
+        wf.read(output_path)[1], frame_loop(audio_data)
+    )
+
+
+def test_parallel_rejects_24_bit_wav(tmp_path):
+    wav_path = Path(tmp_path, "video_raw.wav")
+    with wave.open(str(wav_path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(3)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(bytes(3 * SAMPLE_RATE))
+    with pytest.raises(Exception, match="24 bit"):
+        parallel_silence_removal(
+            [wav_path], [Path(tmp_path, "video_processed.wav")], workers=2
+        )
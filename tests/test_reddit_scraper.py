@@ -0,0 +1,113 @@
+# test_reddit_scraper.py
+# Checks the parts of `reddit_scraper.py` that don't need reddit's API or a
+# network connection
+
+# Packages
+from pathlib import Path
+from types import SimpleNamespace
+import os
+import pytest
+
+from useful_functions.media_index import MediaIndex
+
+pytest.importorskip("praw")
+
+
+@pytest.fixture(scope="module")
+def reddit_scraper(tmp_path_factory):
+    # Importing the scraper sets up its logging in the current folder
+    current_folder = Path.cwd()
+    os.chdir(tmp_path_factory.mktemp("scraper"))
+    try:
+        from reddit import reddit_scraper
+    finally:
+        os.chdir(current_folder)
+    return reddit_scraper
+
+
+def reddit_submission(submission_id, fallback_url):
+    return SimpleNamespace(
+        id=submission_id,
+        domain="v.redd.it",
+        url=f"https://v.redd.it/{submission_id}",
+        secure_media={"reddit_video": {"fallback_url": fallback_url}},
+    )
+
+
+def test_media_id_of_malformed_urls(reddit_scraper):
+    assert reddit_scraper.media_id("") is None
+    assert reddit_scraper.media_id("not a url") is None
+    assert (
+        reddit_scraper.media_id("https://v.redd.it/abc/DASH_audio.mp4")
+        == "v.redd.it/abc"
+    )
+
+
+def test_unresolvable_submission_is_skipped(reddit_scraper, tmp_path, monkeypatch):
+    downloads = []
+
+    def download_media_bulk(urls):
+        downloads.append(list(urls))
+        return []
+
+    monkeypatch.setattr(reddit_scraper, "download_media_bulk", download_media_bulk)
+    index = MediaIndex(Path(tmp_path, "media_index.sqlite"))
+    submissions = [
+        # `convert_reddit` finds no audio url in this one
+        reddit_submission("bad", "https://v.redd.it/bad/unexpected.mp4"),
+        reddit_submission("good", "https://v.redd.it/good/DASH_720.mp4"),
+    ]
+    reddit_scraper.scrape_submissions(submissions, index)
+    assert downloads == [["https://v.redd.it/good/DASH_audio.mp4"]]
+    # The submission is resolved again next time instead of being recorded
+    assert index.submission_urls("bad") is None
+
+    # An index written by an earlier version can hold an empty url
+    index.record_submission("bad", [""])
+    assert not reddit_scraper.is_submission_done(index, "bad")
+    reddit_scraper.scrape_submissions(submissions, index)
+    assert downloads[-1] == ["https://v.redd.it/good/DASH_audio.mp4"]
+    index.close()
+
+
+def test_download_error_is_one_row(reddit_scraper, tmp_path, monkeypatch):
+    # `media_path` writes to `../data` when run from the `reddit` folder
+    reddit_folder = Path(tmp_path, "reddit")
+    reddit_folder.mkdir()
+    Path(reddit_folder, "reddit_scraper.py").touch()
+    monkeypatch.chdir(reddit_folder)
+
+    def resumable_download(url, file_path, session, chunk_size):
+        if "full" in url:
+            raise OSError("No space left on device")
+        file_path.write_bytes(b"audio")
+        return SimpleNamespace(status_code=200, reason="OK"), 5, "hash"
+
+    monkeypatch.setattr(reddit_scraper, "resumable_download", resumable_download)
+    urls = [
+        "https://v.redd.it/full/DASH_audio.mp4",
+        "https://v.redd.it/fine/DASH_audio.mp4",
+    ]
+    results = reddit_scraper.download_media_bulk(urls, backoff=0)
+    assert [result["url"] for result in results] == urls
+    assert results[0]["status"] == "failed"
+    assert results[0]["attempts"] == 1
+    assert "No space left on device" in results[0]["error"]
+    assert results[1]["status"] == "downloaded"
+
+
+def test_resume_with_glob_characters_in_the_name(
+    reddit_scraper, tmp_path, monkeypatch
+):
+    reddit_folder = Path(tmp_path, "reddit")
+    reddit_folder.mkdir()
+    Path(reddit_folder, "reddit_scraper.py").touch()
+    monkeypatch.chdir(reddit_folder)
+    # A partial download from an earlier day, named after the url
+    url = "https://v.redd.it/ab[c]/DASH_audio.mp4"
+    earlier_folder = Path(tmp_path, "data", "reddit", "2021-07-14", "ab[c]")
+    earlier_folder.mkdir(parents=True)
+    Path(earlier_folder, "ab[c]_raw.aac.part").write_bytes(b"audio")
+    path2, path3, local_filename = reddit_scraper.media_path(url)
+    assert path2 == earlier_folder
+    assert path3 == Path(earlier_folder, "ab[c]_raw.aac")
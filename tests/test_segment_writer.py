@@ -0,0 +1,126 @@
+# test_segment_writer.py
+# Checks that the fused silence removal and segmentation writes the same
+# segments as removing the silences first and segmenting the processed file
+
+# Packages
+from pathlib import Path
+import numpy as np
+import pytest
+import scipy.io.wavfile as wf
+
+from generated_audio import SAMPLE_RATE, blocks_of, frame_loop, make_speech
+from useful_functions.segment_boundaries import energy_envelope, find_silence_cut_points
+from useful_functions.segment_writer import SegmentWriter
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    frame_view,
+)
+from useful_functions.wav_io import write_wav_segments
+
+
+@pytest.mark.parametrize("boundaries", ["fixed", "silence"])
+def test_fused_segments_match_segmenting_the_processed_file(
+    audio_data, tmp_path, boundaries
+):
+    # Segments of the processed file, written by the frame loop
+    processed_path = Path(tmp_path, "video_processed.wav")
+    wf.write(processed_path, SAMPLE_RATE, frame_loop(audio_data))
+    fused_folder = Path(tmp_path, "fused")
+    fused_folder.mkdir()
+    # The same segments, written while the silences are removed
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    with SegmentWriter(
+        output_folder=fused_folder,
+        output_stem="video_processed",
+        sample_rate=SAMPLE_RATE,
+        segment_seconds=1,
+        boundaries=boundaries,
+        tolerance_seconds=0.2,
+    ) as writer:
+        for block in blocks_of(audio_data, 3000):
+            vad.process_batch(block)
+            writer.write(vad.pop_voice_samples())
+
+    expected_folder = Path(tmp_path, "expected")
+    expected_folder.mkdir()
+    # The cut points that `segmentation.segment` uses
+    cut_points = None
+    if boundaries == "silence":
+        cut_points = find_silence_cut_points(
+            [processed_path], segment_seconds=1, tolerance_seconds=0.2
+        )
+    expected_paths = write_wav_segments(
+        processed_path,
+        output_folder=expected_folder,
+        output_stem="video_processed",
+        segment_seconds=1,
+        cut_points=cut_points,
+    )
+    assert [path.name for path in writer.segment_paths] == [
+        path.name for path in expected_paths
+    ]
+    for fused_path, expected_path in zip(writer.segment_paths, expected_paths):
+        np.testing.assert_array_equal(
+            wf.read(fused_path)[1], wf.read(expected_path)[1]
+        )
+
+
+def test_envelope_frames_line_up_with_vad_frames():
+    vad_parameters = {"frame_ms": 20, "hop_ms": 10}
+    audio_data = make_speech(seconds=1, channels=2, sample_rate=44100)
+    envelope = energy_envelope([audio_data], 44100, **vad_parameters)
+    # The frames the silence removal decides on at the same settings
+    vad = VoiceActivityDetection(sample_rate=44100, **vad_parameters)
+    number_of_frames = (len(audio_data) - vad.frame_size) // vad.hop_size + 1
+    frames = frame_view(audio_data, number_of_frames, vad.frame_size, vad.hop_size)
+    np.testing.assert_array_equal(envelope, vad.frame_energies(frames)[1])
+
+
+def test_fused_segments_with_the_vad_frames(tmp_path):
+    vad_parameters = {"frame_ms": 20, "hop_ms": 10, "hangover_ms": 300}
+    audio_data = make_speech(seconds=3, channels=2, sample_rate=44100)
+    processed_path = Path(tmp_path, "video_processed.wav")
+    wf.write(
+        processed_path,
+        44100,
+        frame_loop(audio_data, sample_rate=44100, **vad_parameters),
+    )
+    fused_folder = Path(tmp_path, "fused")
+    fused_folder.mkdir()
+    vad = VoiceActivityDetection(sample_rate=44100, **vad_parameters)
+    # Like `vad.remove_silences_and_segment`
+    with SegmentWriter(
+        output_folder=fused_folder,
+        output_stem="video_processed",
+        sample_rate=44100,
+        segment_seconds=1,
+        boundaries="silence",
+        tolerance_seconds=0.2,
+        frame_ms=vad_parameters["frame_ms"],
+        hop_ms=vad_parameters["hop_ms"],
+    ) as writer:
+        for block in blocks_of(audio_data, 5000):
+            vad.process_batch(block)
+            writer.write(vad.pop_voice_samples())
+
+    cut_points = find_silence_cut_points(
+        [processed_path],
+        segment_seconds=1,
+        tolerance_seconds=0.2,
+        frame_ms=vad_parameters["frame_ms"],
+        hop_ms=vad_parameters["hop_ms"],
+    )
+    expected_folder = Path(tmp_path, "expected")
+    expected_folder.mkdir()
+    expected_paths = write_wav_segments(
+        processed_path,
+        output_folder=expected_folder,
+        output_stem="video_processed",
+        segment_seconds=1,
+        cut_points=cut_points,
+    )
+    assert len(writer.segment_paths) == len(expected_paths) > 1
+    for fused_path, expected_path in zip(writer.segment_paths, expected_paths):
+        np.testing.assert_array_equal(
+            wf.read(fused_path)[1], wf.read(expected_path)[1]
+        )
@@ -0,0 +1,60 @@
+# test_streaming.py
+# Checks that `stream_silence_removal`, which reads and writes one block at a
+# time, keeps the same samples as processing the whole file
+
+# Packages
+from pathlib import Path
+import numpy as np
+import scipy.io.wavfile as wf
+import wave
+
+from generated_audio import SAMPLE_RATE, frame_loop, make_speech
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    stream_silence_removal,
+)
+
+
+def test_streaming_matches_frame_loop(audio_data, tmp_path):
+    wav_path = Path(tmp_path, "video_raw.wav")
+    output_path = Path(tmp_path, "video_processed.wav")
+    wf.write(wav_path, SAMPLE_RATE, audio_data)
+    # Blocks that aren't multiples of the frame size
+    stream_silence_removal(wav_path, output_path, block_size=5000)
+    sample_rate, voice_samples = wf.read(output_path)
+    assert sample_rate == SAMPLE_RATE
+    np.testing.assert_array_equal(voice_samples, frame_loop(audio_data))
+
+
+def test_streaming_float_wav_falls_back_to_memory_map(tmp_path):
+    # `wave` can't read 32 bit float files
+    audio_data = (make_speech(seconds=3, channels=2) / 32768).astype(np.float32)
+    wav_path = Path(tmp_path, "video_raw.wav")
+    output_path = Path(tmp_path, "video_processed.wav")
+    wf.write(wav_path, SAMPLE_RATE, audio_data)
+    stream_silence_removal(wav_path, output_path, block_size=5000)
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    vad.process_batch(audio_data)
+    voice_samples = wf.read(output_path)[1]
+    assert voice_samples.dtype == np.float32
+    np.testing.assert_array_equal(voice_samples, vad.get_voice_samples())
+
+
+def test_streaming_24_bit_wav_falls_back_to_memory_map(tmp_path):
+    # `wave` opens 24 bit files, but they can't be read in blocks
+    audio_data = make_speech(seconds=3, channels=1).astype(np.int32) * 256
+    wav_path = Path(tmp_path, "video_raw.wav")
+    output_path = Path(tmp_path, "video_processed.wav")
+    with wave.open(str(wav_path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(3)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(
+            audio_data.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+        )
+    stream_silence_removal(wav_path, output_path)
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    vad.process_batch(wf.read(wav_path)[1])
+    np.testing.assert_array_equal(
+        wf.read(output_path)[1], vad.get_voice_samples()
+    )
@@ -0,0 +1,32 @@
+# test_voice_activity_detection.py
+# Checks that `VoiceActivityDetection.process_batch` keeps exactly the same
+# samples as the original frame loop, `VoiceActivityDetection.process`
+
+# To run the tests, do `python -m pytest tests` from the `data-collection`
+# folder
+
+# Packages
+import numpy as np
+
+from generated_audio import SAMPLE_RATE, blocks_of, frame_loop
+from useful_functions.voice_activity_detection import VoiceActivityDetection
+
+
+def test_process_batch_matches_frame_loop(audio_data):
+    expected = frame_loop(audio_data)
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    vad.process_batch(audio_data)
+    voice_samples = vad.get_voice_samples()
+    # Some of the audio is cut, but not all of it
+    assert 0 < len(expected) < len(audio_data)
+    assert voice_samples.dtype == expected.dtype
+    np.testing.assert_array_equal(voice_samples, expected)
+
+
+def test_process_batch_in_blocks_matches_frame_loop(audio_data):
+    expected = frame_loop(audio_data)
+    vad = VoiceActivityDetection(sample_rate=SAMPLE_RATE)
+    # Block sizes that aren't multiples of the frame size
+    for block in blocks_of(audio_data, 1234):
+        vad.process_batch(block)
+    np.testing.assert_array_equal(vad.get_voice_samples(), expected)
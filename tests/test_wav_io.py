@@ -0,0 +1,67 @@
+# test_wav_io.py
+# Checks the `.wav` reading and writing functions of `wav_io`
+
+# Packages
+from pathlib import Path
+import numpy as np
+import pytest
+import scipy.io.wavfile as wf
+
+from generated_audio import SAMPLE_RATE, frame_loop
+from useful_functions.voice_activity_detection import VoiceActivityDetection
+from useful_functions.wav_io import read_wav_mmap, stream_wav_segments
+
+
+def test_read_wav_mmap_matches_wavfile_read(audio_data, tmp_path):
+    wav_path = Path(tmp_path, "video_raw.wav")
+    wf.write(wav_path, SAMPLE_RATE, audio_data)
+    sample_rate, mapped_data = read_wav_mmap(wav_path)
+    assert sample_rate == SAMPLE_RATE
+    # A view of the file, not a copy
+    assert isinstance(mapped_data, np.memmap)
+    np.testing.assert_array_equal(mapped_data, audio_data)
+
+
+def test_mmap_path_matches_frame_loop(audio_data, tmp_path):
+    wav_path = Path(tmp_path, "video_raw.wav")
+    wf.write(wav_path, SAMPLE_RATE, audio_data)
+    sample_rate, mapped_data = read_wav_mmap(wav_path)
+    vad = VoiceActivityDetection(sample_rate=sample_rate)
+    vad.process_batch(mapped_data)
+    np.testing.assert_array_equal(vad.get_voice_samples(), frame_loop(audio_data))
+
+
+def test_stream_wav_segments_at_cut_points(audio_data, tmp_path):
+    # Two files that are segmented as if they were joined
+    wav_paths = [Path(tmp_path, "chunk_0.wav"), Path(tmp_path, "chunk_1.wav")]
+    wf.write(wav_paths[0], SAMPLE_RATE, audio_data[:40000])
+    wf.write(wav_paths[1], SAMPLE_RATE, audio_data[40000:])
+    cut_points = [30000, 40000, 70000, len(audio_data)]
+    segment_paths = stream_wav_segments(
+        wav_paths, tmp_path, "video_processed", cut_points=cut_points
+    )
+    expected = np.split(audio_data, cut_points)
+    assert len(segment_paths) == len(expected)
+    for segment_path, expected_segment in zip(segment_paths, expected):
+        np.testing.assert_array_equal(
+            wf.read(segment_path)[1].reshape(expected_segment.shape),
+            expected_segment,
+        )
+
+
+@pytest.mark.parametrize(
+    "cut_points",
+    [[0, 30000], [30000, 30000], [40000, 30000], [200000]],
+    ids=["at the start", "repeated", "decreasing", "past the end"],
+)
+def test_stream_wav_segments_rejects_bad_cut_points(
+    audio_data, tmp_path, cut_points
+):
+    wav_path = Path(tmp_path, "video_processed.wav")
+    wf.write(wav_path, SAMPLE_RATE, audio_data)
+    with pytest.raises(Exception, match="cut point"):
+        stream_wav_segments(
+            [wav_path], tmp_path, "video_processed", cut_points=cut_points
+        )
+    # Nothing is left behind
+    assert list(tmp_path.glob("*video_processed_*")) == []
@@ -0,0 +1,121 @@
+# analysis_front_end.py
+# Turns audio into the mono, low sample rate signal that voice activity
+# detection looks at, one block at a time. Speech detection doesn't need
+# 48 kHz stereo, so analysing a 16 kHz mono copy does a fraction of the work
+
+# Packages
+from math import gcd
+import numpy as np
+from scipy.signal import firwin, upfirdn
+
+
+class AnalysisFrontEnd:
+    """
+    Downmixes audio to mono and resamples it to `analysis_rate` with a
+    polyphase filter, block by block. The filter is the one that
+    `scipy.signal.resample_poly` designs. An output sample is only returned
+    once every input sample under the filter has arrived, so the output
+    doesn't depend on how the input is split into blocks. The last few
+    milliseconds of a recording are never returned.
+
+    Arguments:
+    sample_rate | int
+    Number of samples per second of the input.
+
+    analysis_rate | int
+    Number of samples per second of the output.
+
+    Example:
+    front_end = AnalysisFrontEnd(48000, 16000)
+    for block in blocks:
+        analysis_samples = front_end.push(block)
+    """
+
+    def __init__(self, sample_rate, analysis_rate=16000):
+        divisor = gcd(int(sample_rate), int(analysis_rate))
+        self.up = int(analysis_rate) // divisor
+        self.down = int(sample_rate) // divisor
+        if self.up == self.down:
+            # Same sample rate: only downmix
+            self.__half_length = 0
+            self.__filter = np.ones(1)
+        else:
+            # The same filter as `scipy.signal.resample_poly`
+            max_rate = max(self.up, self.down)
+            self.__half_length = 10 * max_rate
+            self.__filter = (
+                firwin(
+                    2 * self.__half_length + 1,
+                    1.0 / max_rate,
+                    window=("kaiser", 5.0),
+                )
+                * self.up
+            )
+        # Input samples that later output samples still need, the index of
+        # the first of them, and the index of the next output sample
+        self.__carry = np.zeros(0)
+        self.__carry_start = 0
+        self.__next_output = 0
+
+    def __first_input(self, output_index):
+        # Index of the first input sample under the filter of an output sample
+        return -(-(output_index * self.down - self.__half_length) // self.up)
+
+    def push(self, samples):
+        """
+        Add samples and return the output samples that can now be computed.
+
+        Arguments:
+        samples | numpy.ndarray
+        The next samples, in the format of `scipy.io.wavfile.read` (one row
+        per sample for more than one channel).
+
+        Returns:
+        numpy.ndarray
+        The next mono output samples, as 64 bit floats.
+        """
+        # Downmix to mono by averaging the channels, one channel at a time
+        # (`mean(axis=1)` is several times slower over two columns)
+        if samples.ndim == 2:
+            mono = samples[:, 0].astype(np.float64)
+            for channel in range(1, samples.shape[1]):
+                mono += samples[:, channel]
+            mono /= samples.shape[1]
+        else:
+            mono = samples
+        carry = np.concatenate([self.__carry, mono.astype(np.float64)])
+        received = self.__carry_start + len(carry)
+        # Output samples whose last input sample has arrived
+        first_output = self.__next_output
+        last_output = (
+            ((received - 1) * self.up - self.__half_length) // self.down + 1
+        )
+        if last_output <= first_output:
+            self.__carry = carry
+            return np.zeros(0)
+        start = self.__first_input(first_output)
+        stop = ((last_output - 1) * self.down + self.__half_length) // self.up + 1
+        # Inputs before the start of the recording are zeros
+        segment = np.concatenate(
+            [
+                np.zeros(max(self.__carry_start - start, 0)),
+                carry[max(start - self.__carry_start, 0) : stop - self.__carry_start],
+            ]
+        )
+        # Pad the filter so that its centre lines up with the output samples
+        offset = self.__half_length - start * self.up
+        padding = -offset % self.down
+        shift = (offset + padding) // self.down
+        output = upfirdn(
+            np.concatenate([np.zeros(padding), self.__filter]),
+            segment,
+            self.up,
+            self.down,
+        )[first_output + shift : last_output + shift]
+
+        # Keep the inputs that the next output samples need
+        next_start = max(self.__first_input(last_output), self.__carry_start)
+        self.__carry = carry[next_start - self.__carry_start :]
+        self.__carry_start = next_start
+        self.__next_output = last_output
+        return output
@@ -0,0 +1,172 @@
+# build_manifest.py
+# Make-style bookkeeping for the pipeline stages: each stage records the
+# content hashes of its inputs and outputs and its parameters in a manifest,
+# and only runs again when one of them changed
+
+# Packages
+from pathlib import Path
+import hashlib
+import json
+import os
+
+# Name of the manifest file kept in each filename folder (hidden, so the
+# stages' file listings skip it)
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_state(file_path, previous=None):
+    """
+    Function that describes a file by its size, modification time and
+    SHA-256 hash. If the size and modification time match `previous`, its
+    hash is reused instead of reading the file again.
+
+    Arguments:
+    file_path | str or pathlib.PosixPath
+    Path to the file.
+
+    previous | dict
+    An earlier result of `file_state` for the same file.
+
+    Returns:
+    dict
+    The "size", "mtime_ns" and "sha256" of the file.
+    """
+    stat = Path(file_path).stat()
+    if (
+        previous is not None
+        and previous["size"] == stat.st_size
+        and previous["mtime_ns"] == stat.st_mtime_ns
+    ):
+        return dict(previous)
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256.hexdigest(),
+    }
+
+
+def load_manifest(folder_path):
+    manifest_path = Path(folder_path, MANIFEST_NAME)
+    if not manifest_path.is_file():
+        return {}
+    with open(manifest_path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(folder_path, manifest):
+    # Write to a temporary file first so that an interrupted run can't leave
+    # a half written manifest
+    manifest_path = Path(folder_path, MANIFEST_NAME)
+    temporary_path = Path(folder_path, f"{MANIFEST_NAME}.tmp")
+    with open(temporary_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(temporary_path, manifest_path)
+
+
+def is_up_to_date(folder_path, stage, inputs, parameters):
+    """
+    Function that checks whether a stage has to run for a folder. It is up to
+    date if it ran before with the same inputs and parameters, and none of
+    its inputs or outputs changed (or went missing) since.
+
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    The filename folder the stage works on.
+
+    stage | str
+    Name of the stage, e.g. "vad".
+
+    inputs | list
+    Paths of the files the stage reads.
+
+    parameters | dict
+    The settings that change the stage's output (JSON serializable).
+
+    Returns:
+    bool
+    """
+    manifest = load_manifest(folder_path)
+    entry = manifest.get(stage)
+    if entry is None:
+        return False
+    if entry["parameters"] != json.loads(json.dumps(parameters)):
+        return False
+    names = sorted(os.path.relpath(path, folder_path) for path in inputs)
+    if names != sorted(entry["inputs"]):
+        return False
+
+    changed = False
+    for files in [entry["inputs"], entry["outputs"]]:
+        for name, previous in files.items():
+            file_path = Path(folder_path, name)
+            if not file_path.is_file():
+                return False
+            state = file_state(file_path, previous)
+            if state["sha256"] != previous["sha256"]:
+                return False
+            # Touched but not changed: remember the new time so the file
+            # doesn't have to be hashed again next time
+            if state != previous:
+                files[name] = state
+                changed = True
+    if changed:
+        save_manifest(folder_path, manifest)
+    return True
+
+
+def recorded_outputs(folder_path, stage):
+    """
+    Function that returns the paths of the files a stage wrote the last time
+    it ran, e.g. to remove segments that a new run won't overwrite.
+
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    The filename folder the stage works on.
+
+    stage | str
+    Name of the stage, e.g. "segmentation".
+
+    Returns:
+    list
+    """
+    entry = load_manifest(folder_path).get(stage, {})
+    return [Path(folder_path, name) for name in entry.get("outputs", {})]
+
+
+def record_stage(folder_path, stage, inputs, outputs, parameters):
+    """
+    Function that stores a finished stage run in the folder's manifest.
+
+    Arguments:
+    folder_path | str or pathlib.PosixPath
+    The filename folder the stage works on.
+
+    stage | str
+    Name of the stage, e.g. "vad".
+
+    inputs | list
+    Paths of the files the stage read.
+
+    outputs | list
+    Paths of the files the stage wrote.
+
+    parameters | dict
+    The settings that change the stage's output (JSON serializable).
+    """
+    manifest = load_manifest(folder_path)
+    manifest[stage] = {
+        "parameters": json.loads(json.dumps(parameters)),
+        "inputs": {
+            os.path.relpath(path, folder_path): file_state(path)
+            for path in inputs
+        },
+        "outputs": {
+            os.path.relpath(path, folder_path): file_state(path)
+            for path in outputs
+        },
+    }
+    save_manifest(folder_path, manifest)
@@ -6,6 +6,7 @@ from pydub import AudioSegment  # This also requires ffmpeg on the device
 import re
 import logging
 
+from useful_functions.instrumentation import StageTimer
 from useful_functions.useful_functions import set_up_logging
 
 # Function that converts `.aac` or `.mp3` files to `.wav`
@@ -28,8 +29,6 @@ def convert_to_wav(audio_file_path):
     audio_file_extension = audio_file_path.suffix
     audio_extensions = [".aac", ".mp3"]
     if audio_file_extension in audio_extensions:
-        # Load the audio file
-        sound = AudioSegment.from_file(audio_file_path)
         # Convert filename extension to `.wav`
         new_filename = re.sub(
             pattern=f"{audio_file_extension}$",
@@ -38,9 +37,14 @@ def convert_to_wav(audio_file_path):
         )
         logging.info(f"New audio filename: {new_filename}")
         print(new_filename)
-        sound.export(
-            Path(Path(audio_file_path).parent, new_filename), format="wav"
-        )
+        with StageTimer("convert", folder=Path(audio_file_path).parent) as timer:
+            timer.count(bytes=Path(audio_file_path).stat().st_size)
+            # Load the audio file
+            sound = AudioSegment.from_file(audio_file_path)
+            timer.count(audio_seconds=sound.duration_seconds)
+            sound.export(
+                Path(Path(audio_file_path).parent, new_filename), format="wav"
+            )
     else:
         raise Exception(
             f"The '{audio_file_extension}' " + "extension is not supported!"
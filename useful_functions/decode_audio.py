@@ -0,0 +1,122 @@
+# decode_audio.py
+# Functions that decode audio files with ffmpeg straight into NumPy arrays,
+# without writing an intermediate `.wav` file
+
+# Packages
+import ffmpeg  # This also requires ffmpeg on the device
+import logging
+import numpy as np
+
+from useful_functions.instrumentation import StageTimer
+
+# Audio file extensions that are decoded through the pipe, the same ones that
+# `convert_to_wav` converts
+DECODE_EXTENSIONS = [".aac", ".mp3"]
+
+# Raw PCM formats that ffmpeg can write to a pipe, with their NumPy data types
+PIPE_FORMATS = {
+    "u8": ("u8", "pcm_u8", np.dtype("u1")),
+    "s16": ("s16le", "pcm_s16le", np.dtype("<i2")),
+    "s32": ("s32le", "pcm_s32le", np.dtype("<i4")),
+}
+
+
+@StageTimer("probe")
+def probe_audio(audio_file_path):
+    """
+    Function that returns the sample rate and number of channels of the first
+    audio stream of a file.
+
+    Arguments:
+    audio_file_path | str or pathlib.PosixPath
+    Path to the audio (or video) file.
+
+    Returns:
+    tuple
+    The sample rate and the number of channels.
+    """
+    probe = ffmpeg.probe(str(audio_file_path), select_streams="a:0")
+    if not probe["streams"]:
+        raise Exception(f"Error, {audio_file_path} has no audio stream!")
+    stream = probe["streams"][0]
+    return int(stream["sample_rate"]), int(stream["channels"])
+
+
+def decode_audio_blocks(
+    audio_file_path, block_size=1048576, sample_format="s16", channels=None
+):
+    """
+    Generator that decodes an audio file with ffmpeg and yields the samples in
+    blocks, read from ffmpeg's output pipe. Only one block is held in memory
+    at a time.
+
+    Arguments:
+    audio_file_path | str or pathlib.PosixPath
+    Path to the audio file, e.g. a `.aac` or `.mp3` file.
+
+    block_size | int
+    The number of samples (per channel) in each block.
+
+    sample_format | str
+    One of the keys of `PIPE_FORMATS`.
+
+    channels | int
+    The number of channels from `probe_audio`, if the caller already probed
+    the file. Otherwise the file is probed here.
+
+    Yields:
+    numpy.ndarray
+    Audio data in the same format as `scipy.io.wavfile.read`: an array of
+    amplitudes for mono audio, an array with one row per sample for stereo
+    audio.
+    """
+    if channels is None:
+        _, channels = probe_audio(audio_file_path)
+    pipe_format, codec, dtype = PIPE_FORMATS[sample_format]
+    process = (
+        ffmpeg.input(str(audio_file_path))
+        .output("pipe:", format=pipe_format, acodec=codec, map="a:0")
+        .global_args("-nostdin", "-loglevel", "error")
+        .run_async(pipe_stdout=True)
+    )
+    try:
+        while True:
+            raw_block = process.stdout.read(block_size * channels * dtype.itemsize)
+            if not raw_block:
+                break
+            block = np.frombuffer(raw_block, dtype=dtype)
+            if channels > 1:
+                block = block.reshape(-1, channels)
+            yield block
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+    if return_code != 0:
+        raise Exception(f"Error, ffmpeg failed to decode {audio_file_path}")
+    logging.info(f"Decoded {audio_file_path} through a pipe")
+
+
+def decode_audio(audio_file_path, sample_format="s16"):
+    """
+    Function that decodes a whole audio file into memory with ffmpeg.
+
+    Arguments:
+    audio_file_path | str or pathlib.PosixPath
+    Path to the audio file, e.g. a `.aac` or `.mp3` file.
+
+    sample_format | str
+    One of the keys of `PIPE_FORMATS`.
+
+    Returns:
+    tuple
+    The sample rate and the audio data, like `scipy.io.wavfile.read`.
+    """
+    sample_rate, channels = probe_audio(audio_file_path)
+    blocks = list(
+        decode_audio_blocks(
+            audio_file_path, sample_format=sample_format, channels=channels
+        )
+    )
+    if not blocks:
+        raise Exception(f"Error, {audio_file_path} has no audio samples!")
+    return sample_rate, np.concatenate(blocks)
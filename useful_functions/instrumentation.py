@@ -0,0 +1,321 @@
+# instrumentation.py
+# Timers and counters for the stages of the audio pipeline (download, probe,
+# extraction, conversion, silence removal and segmentation), and a per-run
+# report of the latency and throughput of each stage
+
+# Packages
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+import csv
+import json
+import numpy as np
+import os
+import threading
+import time
+
+from useful_functions.wav_io import read_wav_layout
+
+# Timings of this process. Worker processes hand theirs to the main process
+# with `pop_records` and `add_records`
+_records = []
+# Extraction and downloads time their stages from several threads
+_records_lock = threading.Lock()
+
+# Columns of the CSV report
+REPORT_COLUMNS = [
+    "stage",
+    "calls",
+    "failures",
+    "total_seconds",
+    "p50_seconds",
+    "p95_seconds",
+    "max_seconds",
+    "bytes",
+    "audio_seconds",
+    "bytes_per_second",
+    "audio_seconds_per_second",
+]
+
+
+class StageTimer:
+    """
+    Times one run of a stage and counts the bytes and seconds of audio it
+    handled. Used as a context manager it records a single run; used as a
+    decorator it records every call of the function.
+
+    Arguments:
+    stage | str
+    The name of the stage, e.g. "vad".
+
+    folder | str or pathlib.PosixPath
+    The filename folder the stage worked on, so that the time spent on each
+    post can be reported. None if the run isn't about one folder.
+
+    Example:
+    with StageTimer("vad", folder=file_folder) as timer:
+        timer.count_file(input_path)
+        remove_silences(...)
+
+    @StageTimer("probe")
+    def probe_audio(audio_file_path):
+        ...
+    """
+
+    def __init__(self, stage, folder=None):
+        self.stage = stage
+        self.folder = None if folder is None else str(folder)
+        self.bytes = 0
+        self.audio_seconds = 0.0
+        self.__start = None
+
+    def __enter__(self):
+        self.__start = time.perf_counter()
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        record = {
+            "stage": self.stage,
+            "folder": self.folder,
+            "seconds": time.perf_counter() - self.__start,
+            "bytes": self.bytes,
+            "audio_seconds": self.audio_seconds,
+            "failed": exception_type is not None,
+        }
+        with _records_lock:
+            _records.append(record)
+
+    def __call__(self, function):
+        @wraps(function)
+        def timed_function(*args, **kwargs):
+            # A new timer for every call, so that calls can overlap
+            with StageTimer(self.stage, folder=self.folder):
+                return function(*args, **kwargs)
+
+        return timed_function
+
+    def count(self, bytes=0, audio_seconds=0.0):
+        """
+        Add to the amount of data the stage handled.
+
+        Arguments:
+        bytes | int
+        Number of bytes read.
+
+        audio_seconds | float
+        Seconds of audio processed.
+        """
+        self.bytes += bytes
+        self.audio_seconds += audio_seconds
+
+    def count_file(self, file_path):
+        """
+        Count the size of an input file and, for a PCM or float `.wav` file,
+        the seconds of audio in it (read from its header).
+
+        Arguments:
+        file_path | str or pathlib.PosixPath
+        Path to the file.
+        """
+        self.bytes += Path(file_path).stat().st_size
+        if Path(file_path).suffix == ".wav":
+            layout = read_wav_layout(file_path)
+            block_align = layout["channels"] * layout["sample_width"]
+            self.audio_seconds += (
+                layout["data_size"] // block_align / layout["sample_rate"]
+            )
+
+    def count_blocks(self, blocks, sample_rate):
+        """
+        Generator that passes blocks of audio data through, counting the
+        seconds of audio in them. Used for audio that is decoded through a
+        pipe, whose length isn't known in advance.
+
+        Arguments:
+        blocks | iterable
+        Arrays of audio data, one row per sample.
+
+        sample_rate | int
+        Number of samples per second.
+
+        Yields:
+        numpy.ndarray
+        The same blocks.
+        """
+        for block in blocks:
+            self.audio_seconds += len(block) / sample_rate
+            yield block
+
+
+def get_records():
+    """
+    Function that returns the timings recorded in this process so far.
+
+    Returns:
+    list
+    A copy of the timings, one dictionary per run of a stage.
+    """
+    with _records_lock:
+        return list(_records)
+
+
+def pop_records():
+    """
+    Function that returns the timings recorded in this process and forgets
+    them, e.g. at the end of a task in a worker process.
+
+    Returns:
+    list
+    The timings, one dictionary per run of a stage.
+    """
+    with _records_lock:
+        records = list(_records)
+        _records.clear()
+    return records
+
+
+def add_records(records):
+    """
+    Function that adds timings from another process to the ones of this one.
+
+    Arguments:
+    records | list
+    Timings from `pop_records`.
+    """
+    with _records_lock:
+        _records.extend(records)
+
+
+def summarize_records(records):
+    """
+    Function that computes the latency and throughput of every stage.
+
+    Arguments:
+    records | list
+    Timings from `get_records` or `pop_records`.
+
+    Returns:
+    list
+    One dictionary per stage with the keys of `REPORT_COLUMNS`, the stage
+    with the most total time (the bottleneck) first. The throughputs are
+    based on the total time of the stage.
+    """
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+    summary = []
+    for stage, stage_records in stages.items():
+        seconds = np.array([record["seconds"] for record in stage_records])
+        total_seconds = float(seconds.sum())
+        total_bytes = sum(record["bytes"] for record in stage_records)
+        audio_seconds = sum(record["audio_seconds"] for record in stage_records)
+        p50, p95 = np.percentile(seconds, [50, 95])
+        summary.append(
+            {
+                "stage": stage,
+                "calls": len(stage_records),
+                "failures": sum(record["failed"] for record in stage_records),
+                "total_seconds": total_seconds,
+                "p50_seconds": float(p50),
+                "p95_seconds": float(p95),
+                "max_seconds": float(seconds.max()),
+                "bytes": total_bytes,
+                "audio_seconds": audio_seconds,
+                "bytes_per_second": (
+                    total_bytes / total_seconds if total_seconds else None
+                ),
+                "audio_seconds_per_second": (
+                    audio_seconds / total_seconds if total_seconds else None
+                ),
+            }
+        )
+    return sorted(summary, key=lambda row: row["total_seconds"], reverse=True)
+
+
+def summarize_folders(records):
+    """
+    Function that computes the time every stage spent on each filename
+    folder, i.e. on each post.
+
+    Arguments:
+    records | list
+    Timings from `get_records` or `pop_records`. Timings without a folder are
+    left out.
+
+    Returns:
+    list
+    One dictionary per folder with the keys "folder", "total_seconds" and
+    "failures", and the total seconds of every stage under the name of the
+    stage, the slowest folder first.
+    """
+    folders = {}
+    for record in records:
+        # Records written before folders were recorded have no "folder" key
+        if record.get("folder") is None:
+            continue
+        row = folders.setdefault(
+            record["folder"],
+            {"folder": record["folder"], "total_seconds": 0.0, "failures": 0},
+        )
+        row["total_seconds"] += record["seconds"]
+        row["failures"] += record["failed"]
+        row[record["stage"]] = row.get(record["stage"], 0.0) + record["seconds"]
+    return sorted(
+        folders.values(), key=lambda row: row["total_seconds"], reverse=True
+    )
+
+
+def write_report(report_folder, records=None):
+    """
+    Function that writes the stage timings of a run to a JSON file (the
+    summary, the time per folder and every single timing), a CSV file (the
+    summary) and, if the timings have folders, a `_folders.csv` file (the
+    time per folder). The names have the current time and the process id, so
+    that runs that finish in the same second don't overwrite each other.
+
+    Arguments:
+    report_folder | str or pathlib.PosixPath
+    Folder to write the report to, e.g. the logging folder of the script.
+
+    records | list
+    The timings to report. The default is every timing of this process.
+
+    Returns:
+    tuple
+    The paths of the JSON and the CSV file, or None if nothing was timed.
+    """
+    if records is None:
+        records = get_records()
+    if not records:
+        return None
+    summary = summarize_records(records)
+    folders = summarize_folders(records)
+    Path(report_folder).mkdir(parents=True, exist_ok=True)
+    current_time = datetime.now().strftime("%Y-%m-%d_%HH%MM%SS_%f")
+    json_path = Path(
+        report_folder, f"stage_report_{current_time}_{os.getpid()}.json"
+    )
+    csv_path = json_path.with_suffix(".csv")
+    with open(json_path, "w") as json_file:
+        json.dump(
+            {"stages": summary, "folders": folders, "records": records},
+            json_file,
+            indent=1,
+        )
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(summary)
+    if folders:
+        # One column per stage, in the order of the summary
+        stage_columns = [row["stage"] for row in summary]
+        folders_path = json_path.with_name(f"{json_path.stem}_folders.csv")
+        with open(folders_path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(
+                csv_file,
+                fieldnames=["folder", "total_seconds", "failures"] + stage_columns,
+                restval=0.0,
+            )
+            writer.writeheader()
+            writer.writerows(folders)
+    return json_path, csv_path
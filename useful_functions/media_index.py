@@ -0,0 +1,145 @@
+# media_index.py
+# On-disk index of the submissions and media that have already been scraped,
+# so that repeat scrapes only download what is new
+
+# Packages
+from datetime import datetime
+from pathlib import Path
+import json
+import sqlite3
+
+
+class MediaIndex:
+    """
+    SQLite index of resolved submissions and downloaded media.
+
+    Arguments:
+    index_path | str or pathlib.PosixPath
+    Path to the SQLite file; it is created if it doesn't exist.
+
+    Example:
+    index = MediaIndex("../data/media_index.sqlite")
+    if not index.is_downloaded("v.redd.it/9v2san14was51"):
+        ...
+    """
+
+    def __init__(self, index_path):
+        Path(index_path).parent.mkdir(parents=True, exist_ok=True)
+        self.__connection = sqlite3.connect(str(index_path))
+        with self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS submissions ("
+                "submission_id TEXT PRIMARY KEY, "
+                "urls TEXT NOT NULL, "
+                "resolved_at TEXT NOT NULL)"
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                "media_id TEXT PRIMARY KEY, "
+                "submission_id TEXT, "
+                "url TEXT NOT NULL, "
+                "path TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "sha256 TEXT NOT NULL, "
+                "downloaded_at TEXT NOT NULL)"
+            )
+
+    def close(self):
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def record_submission(self, submission_id, urls):
+        """
+        Store the urls that a submission resolved to.
+
+        Arguments:
+        submission_id | str
+        The reddit id of the submission.
+
+        urls | list
+        The urls from `audio_url_from_submission`; an empty list marks a
+        submission that has nothing to download.
+        """
+        with self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO submissions VALUES (?, ?, ?)",
+                (submission_id, json.dumps(urls), datetime.now().isoformat()),
+            )
+
+    def submission_urls(self, submission_id):
+        """
+        Get the urls stored for a submission.
+
+        Returns:
+        list or None
+        The urls, or None if the submission hasn't been resolved yet.
+        """
+        row = self.__connection.execute(
+            "SELECT urls FROM submissions WHERE submission_id = ?",
+            (submission_id,),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def record_download(self, media_id, submission_id, url, path, size, sha256):
+        """
+        Store a downloaded media file.
+
+        Arguments:
+        media_id | str
+        Identifier of the media that stays the same between scrapes.
+
+        submission_id | str
+        The reddit id of the submission the media belongs to.
+
+        url | str
+        The url the file was downloaded from.
+
+        path | str or pathlib.PosixPath
+        Where the file was written.
+
+        size | int
+        The size of the file in bytes.
+
+        sha256 | str
+        The SHA-256 hex digest of the file.
+        """
+        with self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    media_id,
+                    submission_id,
+                    url,
+                    str(path),
+                    size,
+                    sha256,
+                    datetime.now().isoformat(),
+                ),
+            )
+
+    def downloaded_path(self, media_id):
+        """
+        Get the path of a downloaded media file, checking that the file is
+        still there with the recorded size.
+
+        Returns:
+        pathlib.PosixPath or None
+        The path, or None if the media needs to be downloaded.
+        """
+        row = self.__connection.execute(
+            "SELECT path, size FROM media WHERE media_id = ?", (media_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        path = Path(row[0])
+        if not path.is_file() or path.stat().st_size != row[1]:
+            return None
+        return path
+
+    def is_downloaded(self, media_id):
+        return self.downloaded_path(media_id) is not None
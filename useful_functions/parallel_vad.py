@@ -0,0 +1,276 @@
+# parallel_vad.py
+# Silence removal on several cores. The frame energies of a long recording (or
+# of the chunks it was split into) are computed in parallel, the running
+# threshold and the silence counter are then carried across the chunk seams in
+# order, and the kept frames are written in parallel. The result is the same
+# as a single `VoiceActivityDetection` reading the whole recording.
+
+# Packages
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import numpy as np
+import os
+
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    frame_view,
+)
+from useful_functions.wav_io import (
+    PCM_DTYPES,
+    WAVE_FORMAT_IEEE_FLOAT,
+    WAVE_FORMAT_PCM,
+    read_wav_layout,
+    read_wav_mmap,
+    wav_header,
+)
+
+# Size of the header that `wav_header` writes
+HEADER_SIZE = 44
+
+
+def read_samples(wav_paths, file_starts, start, stop):
+    """
+    Function that reads samples `start` to `stop` of `.wav` files that are
+    treated as one joined recording. Only samples that run across a seam
+    between two files are copied.
+
+    Arguments:
+    wav_paths | list
+    Paths to the `.wav` files, in order.
+
+    file_starts | list
+    The sample offset of each file in the joined recording, followed by the
+    total number of samples.
+
+    start | int
+    First sample to read.
+
+    stop | int
+    Sample after the last sample to read.
+
+    Returns:
+    numpy.ndarray
+    Array with one row per sample and one column per channel.
+    """
+    pieces = []
+    for i, wav_path in enumerate(wav_paths):
+        file_start, file_stop = file_starts[i], file_starts[i + 1]
+        if file_stop <= start or file_start >= stop:
+            continue
+        audio_data = read_wav_mmap(wav_path)[1]
+        if audio_data.ndim == 1:
+            audio_data = audio_data.reshape(len(audio_data), 1)
+        pieces.append(
+            audio_data[max(start, file_start) - file_start : stop - file_start]
+        )
+    if len(pieces) == 1:
+        return pieces[0]
+    return np.concatenate(pieces)
+
+
+def frame_energy_task(
+    wav_paths, file_starts, first_frame, last_frame, frame_size, hop_size
+):
+    # Runs in a worker process: the values of `frame_energies` for a range of
+    # frames of the joined recording
+    samples = read_samples(
+        wav_paths,
+        file_starts,
+        first_frame * hop_size,
+        (last_frame - 1) * hop_size + frame_size,
+    )
+    frames = frame_view(samples, last_frame - first_frame, frame_size, hop_size)
+    return VoiceActivityDetection().frame_energies(frames=frames)
+
+
+def write_kept_frames_task(
+    wav_paths, file_starts, first_frame, keep, hop_size, output_path, output_offset
+):
+    # Runs in a worker process: writes the kept hops of a range of frames into
+    # an output file that was already created with the right size
+    samples = read_samples(
+        wav_paths,
+        file_starts,
+        first_frame * hop_size,
+        (first_frame + len(keep)) * hop_size,
+    )
+    hops = samples.reshape(len(keep), hop_size, -1)
+    kept = np.ascontiguousarray(hops[keep])
+    output_file = os.open(output_path, os.O_WRONLY)
+    try:
+        os.pwrite(output_file, kept.tobytes(), output_offset)
+    finally:
+        os.close(output_file)
+
+
+def parallel_silence_removal(
+    wav_paths,
+    output_paths,
+    workers=None,
+    frames_per_task=16384,
+    frame_ms=10,
+    hop_ms=None,
+    hangover_ms=600,
+):
+    """
+    Function that removes silences from `.wav` files that are treated as one
+    joined recording, on several cores. The output is the same as joining the
+    files, removing the silences with `VoiceActivityDetection.process_batch`
+    and writing the result.
+
+    Arguments:
+    wav_paths | list
+    Paths to the `.wav` files, in order, e.g. the `_raw_N.wav` chunks of one
+    recording. They must have the same format.
+
+    output_paths | list
+    Either one path, for a single output file, or one path for each input
+    file. In the second case each output gets the kept hops that start in
+    its input file, so joining the outputs gives the single output.
+
+    workers | int
+    The number of worker processes. The default is the number of CPUs.
+
+    frames_per_task | int
+    The number of frames that a worker processes at a time.
+
+    frame_ms, hop_ms, hangover_ms | float
+    The settings of the `VoiceActivityDetection`.
+
+    Returns:
+    int
+    The number of samples (per channel) written.
+    """
+    if not wav_paths:
+        raise Exception("Error, there are no .wav files to process!")
+    if len(output_paths) not in [1, len(wav_paths)]:
+        raise Exception(
+            "Error, there must be one output file or one for each input file!"
+        )
+    layouts = [read_wav_layout(wav_path) for wav_path in wav_paths]
+    formats = {
+        (
+            layout["format_tag"],
+            layout["sample_rate"],
+            layout["channels"],
+            layout["sample_width"],
+        )
+        for layout in layouts
+    }
+    if len(formats) != 1:
+        raise Exception(f"Error, {wav_paths} have different formats!")
+    if layouts[0]["format_tag"] not in [WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT]:
+        raise Exception(f"Error, the format of {wav_paths[0]} isn't supported!")
+    # The kept frames are written with the sample width of the header, but
+    # scipy reads 24 bit audio as 32 bit samples, so it is rejected like in
+    # `read_wav_blocks`
+    sample_width = layouts[0]["sample_width"]
+    if (
+        layouts[0]["format_tag"] == WAVE_FORMAT_PCM
+        and sample_width not in PCM_DTYPES
+    ) or (
+        layouts[0]["format_tag"] == WAVE_FORMAT_IEEE_FLOAT
+        and sample_width not in [4, 8]
+    ):
+        raise Exception(
+            f"Error, {8 * sample_width} bit .wav files are not supported!"
+        )
+    block_align = layouts[0]["channels"] * layouts[0]["sample_width"]
+    vad = VoiceActivityDetection(
+        sample_rate=layouts[0]["sample_rate"],
+        frame_ms=frame_ms,
+        hop_ms=hop_ms,
+        hangover_ms=hangover_ms,
+    )
+    frame_size, hop_size = vad.frame_size, vad.hop_size
+    file_starts = np.cumsum(
+        [0] + [layout["data_size"] // block_align for layout in layouts]
+    ).tolist()
+    # Samples that don't fill a whole frame at the end are dropped, like in
+    # `VoiceActivityDetection`
+    number_of_frames = max((file_starts[-1] - frame_size) // hop_size + 1, 0)
+    tasks = [
+        (first_frame, min(first_frame + frames_per_task, number_of_frames))
+        for first_frame in range(0, number_of_frames, frames_per_task)
+    ]
+    logging.info(
+        f"Removing silences from {number_of_frames} frames in {len(tasks)} tasks"
+    )
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # The frame energies don't depend on each other
+        energy_futures = [
+            executor.submit(
+                frame_energy_task,
+                wav_paths,
+                file_starts,
+                first_frame,
+                last_frame,
+                frame_size,
+                hop_size,
+            )
+            for first_frame, last_frame in tasks
+        ]
+        # The running threshold and the silence counter depend on every
+        # earlier frame, so they are carried across the seams in order. This
+        # is a cheap pass over one number per frame
+        keep = np.zeros(number_of_frames, dtype=bool)
+        for (first_frame, last_frame), future in zip(tasks, energy_futures):
+            frame_thd, frame_level = future.result()
+            keep[first_frame:last_frame] = vad.keep_frames(
+                frame_thd=frame_thd, frame_level=frame_level
+            )
+        # Number of kept frames before each frame, for the output offsets
+        kept_before = np.concatenate([[0], np.cumsum(keep)])
+
+        # Each output file gets the hops of the frames that start in its
+        # input file(s)
+        if len(output_paths) == 1:
+            output_frames = [(0, number_of_frames)]
+        else:
+            output_frames = [
+                (
+                    min(-(-file_start // hop_size), number_of_frames),
+                    min(-(-file_stop // hop_size), number_of_frames),
+                )
+                for file_start, file_stop in zip(file_starts, file_starts[1:])
+            ]
+        written = 0
+        write_futures = []
+        for output_path, (first_frame, last_frame) in zip(
+            output_paths, output_frames
+        ):
+            kept_frames = int(kept_before[last_frame] - kept_before[first_frame])
+            data_size = kept_frames * hop_size * block_align
+            # Create the output with its header and final size, so that the
+            # workers can write their frames at their offsets
+            with open(output_path, "wb") as output_file:
+                output_file.write(
+                    wav_header(
+                        layouts[0]["format_tag"],
+                        layouts[0]["sample_rate"],
+                        layouts[0]["channels"],
+                        layouts[0]["sample_width"],
+                        data_size,
+                    )
+                )
+                output_file.truncate(HEADER_SIZE + data_size + data_size % 2)
+            for task_start in range(first_frame, last_frame, frames_per_task):
+                task_stop = min(task_start + frames_per_task, last_frame)
+                offset = int(kept_before[task_start] - kept_before[first_frame])
+                write_futures.append(
+                    executor.submit(
+                        write_kept_frames_task,
+                        wav_paths,
+                        file_starts,
+                        task_start,
+                        keep[task_start:task_stop],
+                        hop_size,
+                        str(output_path),
+                        HEADER_SIZE + offset * hop_size * block_align,
+                    )
+                )
+            written += kept_frames * hop_size
+        for future in write_futures:
+            future.result()
+    return written
@@ -0,0 +1,180 @@
+# probe_cache.py
+# Cache of ffmpeg probe results and audio extractions, so that files that
+# haven't changed are neither probed nor extracted again
+
+# Packages
+from pathlib import Path
+import ffmpeg  # This also requires ffmpeg on the device
+import json
+import sqlite3
+
+from useful_functions.instrumentation import StageTimer
+
+
+def summarize_probe(probe):
+    """
+    Function that keeps the parts of an `ffmpeg.probe` result that the
+    pipeline uses.
+
+    Arguments:
+    probe | dict
+    The result of `ffmpeg.probe`.
+
+    Returns:
+    dict
+    The duration in seconds (None if unknown) and, for every stream, its
+    index, codec type, codec name, sample rate and number of channels.
+    """
+    duration = probe.get("format", {}).get("duration")
+    return {
+        "duration": None if duration is None else float(duration),
+        "streams": [
+            {
+                "index": stream.get("index"),
+                "codec_type": stream.get("codec_type"),
+                "codec_name": stream.get("codec_name"),
+                "sample_rate": (
+                    int(stream["sample_rate"]) if "sample_rate" in stream else None
+                ),
+                "channels": stream.get("channels"),
+            }
+            for stream in probe["streams"]
+        ],
+    }
+
+
+class ProbeCache:
+    """
+    SQLite cache of media metadata, keyed by the path, size and modification
+    time of each file. A file whose size or modification time changed is
+    probed again and its extraction record is dropped.
+
+    Arguments:
+    cache_path | str or pathlib.PosixPath
+    Path to the SQLite file; it is created if it doesn't exist. Several
+    processes can share it.
+
+    Example:
+    cache = ProbeCache("data/reddit/2021-07-08/.probe_cache.sqlite")
+    metadata = cache.probe("data/reddit/2021-07-08/video2/video2.mp4")
+    """
+
+    def __init__(self, cache_path):
+        Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        # Wait for other processes that are writing instead of failing
+        self.__connection = sqlite3.connect(str(cache_path), timeout=60)
+        with self.__connection:
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS probes ("
+                "path TEXT PRIMARY KEY, "
+                "size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, "
+                "metadata TEXT NOT NULL, "
+                "extraction TEXT)"
+            )
+
+    def close(self):
+        self.__connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __lookup(self, media_path):
+        # Returns the cached row if the file hasn't changed since it was probed
+        media_path = Path(media_path).resolve()
+        stat = media_path.stat()
+        row = self.__connection.execute(
+            "SELECT size, mtime_ns, metadata, extraction FROM probes "
+            "WHERE path = ?",
+            (str(media_path),),
+        ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return media_path, stat, None
+        return media_path, stat, row
+
+    def probe(self, media_path):
+        """
+        Get the metadata of a media file, running `ffmpeg.probe` only if the
+        file isn't cached or has changed.
+
+        Arguments:
+        media_path | str or pathlib.PosixPath
+        Path to the media file.
+
+        Returns:
+        dict
+        The metadata from `summarize_probe`.
+        """
+        media_path, stat, row = self.__lookup(media_path)
+        if row is not None:
+            return json.loads(row[2])
+        with StageTimer("probe", folder=Path(media_path).parent) as timer:
+            timer.count(bytes=stat.st_size)
+            metadata = summarize_probe(ffmpeg.probe(str(media_path)))
+        with self.__connection:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, NULL)",
+                (
+                    str(media_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    json.dumps(metadata),
+                ),
+            )
+        return metadata
+
+    def is_extracted(self, media_path, output_path, options):
+        """
+        Check whether the audio of an unchanged media file was already
+        extracted to `output_path` with the same ffmpeg options, and that the
+        output is still there.
+
+        Arguments:
+        media_path | str or pathlib.PosixPath
+        Path to the media file.
+
+        output_path | str or pathlib.PosixPath
+        Path to the extracted audio file.
+
+        options | dict
+        The ffmpeg output options used for the extraction.
+
+        Returns:
+        bool
+        """
+        _, _, row = self.__lookup(media_path)
+        if row is None or row[3] is None or not Path(output_path).is_file():
+            return False
+        extraction = json.loads(row[3])
+        return extraction == {
+            "output_path": str(Path(output_path).resolve()),
+            "options": json.loads(json.dumps(options)),
+        }
+
+    def record_extraction(self, media_path, output_path, options):
+        """
+        Store that the audio of a media file was extracted; the media file
+        must have been probed with `probe` first.
+
+        Arguments:
+        media_path | str or pathlib.PosixPath
+        Path to the media file.
+
+        output_path | str or pathlib.PosixPath
+        Path to the extracted audio file.
+
+        options | dict
+        The ffmpeg output options used for the extraction.
+        """
+        extraction = {
+            "output_path": str(Path(output_path).resolve()),
+            "options": options,
+        }
+        with self.__connection:
+            self.__connection.execute(
+                "UPDATE probes SET extraction = ? WHERE path = ?",
+                (json.dumps(extraction), str(Path(media_path).resolve())),
+            )
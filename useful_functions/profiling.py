@@ -0,0 +1,304 @@
+# profiling.py
+# Opt-in profiling of the pipeline scripts. A run (or each stage of a run) is
+# profiled with cProfile or with a stack sampler, the profiles are written
+# next to the logs, and `hot_functions` merges the profiles of many runs and
+# folders into one table of the functions that take the most time
+
+# To merge the profiles of a run, do
+# `python -m useful_functions.profiling logging/vad/profiles --top 30`
+
+# Packages
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import argparse
+import cProfile
+import csv
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+
+# Environment variable that turns profiling on for every script, and for the
+# worker processes of `audio_pipeline.py`. "cprofile" or "sample"
+PROFILE_VARIABLE = "PIPELINE_PROFILE"
+PROFILE_MODES = ["cprofile", "sample"]
+
+# Seconds between two stack samples
+SAMPLE_INTERVAL = 0.005
+
+# Columns of the hot function table
+HOT_FUNCTION_COLUMNS = [
+    "function",
+    "calls",
+    "self_seconds",
+    "cumulative_seconds",
+    "profiles",
+]
+
+
+def profiling_mode(argv=None):
+    """
+    Function that reads whether a script should be profiled, from its
+    command line (`--profile` for cProfile, `--profile-sample` for the stack
+    sampler) or else from the `PIPELINE_PROFILE` environment variable.
+
+    Arguments:
+    argv | list
+    The command line arguments. The default is `sys.argv`.
+
+    Returns:
+    str
+    "cprofile", "sample" or None if profiling is off.
+    """
+    if argv is None:
+        argv = sys.argv
+    if "--profile" in argv:
+        return "cprofile"
+    if "--profile-sample" in argv:
+        return "sample"
+    mode = os.environ.get(PROFILE_VARIABLE, "").strip().lower()
+    if not mode:
+        return None
+    if mode not in PROFILE_MODES:
+        raise Exception(
+            f"Error, {PROFILE_VARIABLE}={mode} must be one of {PROFILE_MODES}!"
+        )
+    return mode
+
+
+class StackSampler:
+    """
+    Samples the call stacks of every thread of the process at a fixed
+    interval, from a background thread. Unlike cProfile it doesn't slow down
+    every function call, so it suits long runs, and it also sees the threads
+    of downloads and audio extraction. Each sample of a thread counts towards
+    the self time of its innermost function and the cumulative time of every
+    function on its stack.
+
+    Arguments:
+    interval | float
+    Seconds between two samples.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def __sample(self):
+        sampler_id = threading.get_ident()
+        while not self.__stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == sampler_id:
+                    continue
+                self.samples += 1
+                self.self_counts[function_name(frame.f_code)] += 1
+                # Count recursive functions once per sample
+                on_stack = set()
+                while frame is not None:
+                    on_stack.add(function_name(frame.f_code))
+                    frame = frame.f_back
+                self.total_counts.update(on_stack)
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__sample, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
+
+    def dump(self, file_path):
+        """
+        Write the samples to a JSON file that `hot_functions` can read.
+
+        Arguments:
+        file_path | str or pathlib.PosixPath
+        Path to the `.samples.json` file.
+        """
+        with open(file_path, "w") as samples_file:
+            json.dump(
+                {
+                    "interval": self.interval,
+                    "samples": self.samples,
+                    "self": dict(self.self_counts),
+                    "total": dict(self.total_counts),
+                },
+                samples_file,
+            )
+
+
+def function_name(code):
+    # The same "file:line(function)" names that `pstats` prints
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+@contextmanager
+def profile_stage(stage, profile_folder, mode=None):
+    """
+    Context manager that profiles the code inside it and writes the profile
+    to `profile_folder`, named after the stage, the current time and the
+    process id so that profiles of parallel runs don't overwrite each other.
+    Only the process that runs the code is profiled, not the worker
+    processes it starts, and cProfile only sees the thread that runs it.
+
+    Arguments:
+    stage | str
+    Name of the stage, e.g. "vad" or "segmentation_video2".
+
+    profile_folder | str or pathlib.PosixPath
+    Folder to write the profile to, e.g. `logging/vad/profiles/`.
+
+    mode | str
+    "cprofile" writes a `.prof` file, "sample" a `.samples.json` file. None
+    (profiling off) runs the code without profiling it.
+
+    Example:
+    with profile_stage("vad", "logging/vad/profiles/", profiling_mode()):
+        remove_silences(date_folder)
+    """
+    if mode is None:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise Exception(f"Error, {mode} is not a profiling mode!")
+    Path(profile_folder).mkdir(parents=True, exist_ok=True)
+    current_time = datetime.now().strftime("%Y-%m-%d_%HH%MM%SS")
+    # Folder names can contain characters that don't belong in a file name
+    stage_name = re.sub(r"[^\w.-]+", "_", stage)
+    profile_name = f"{stage_name}_{current_time}_{os.getpid()}"
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(str(Path(profile_folder, f"{profile_name}.prof")))
+    else:
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            sampler.dump(Path(profile_folder, f"{profile_name}.samples.json"))
+
+
+def hot_functions(profile_folders, top=None):
+    """
+    Function that merges the `.prof` and `.samples.json` profiles in some
+    folders into one table of functions, ranked by self time. The time of a
+    sampled function is estimated as its number of samples times the sample
+    interval.
+
+    Arguments:
+    profile_folders | list
+    Folders that contain profiles from `profile_stage`, e.g. the profile
+    folders of `vad.py` and `segmentation.py`.
+
+    top | int
+    The number of functions to keep. The default keeps every function.
+
+    Returns:
+    list
+    One dictionary per function with the keys of `HOT_FUNCTION_COLUMNS`.
+    `calls` is only known for functions that were profiled with cProfile.
+    """
+    functions = {}
+
+    def row(name):
+        return functions.setdefault(
+            name,
+            {
+                "function": name,
+                "calls": 0,
+                "self_seconds": 0.0,
+                "cumulative_seconds": 0.0,
+                "profiles": 0,
+            },
+        )
+
+    for profile_folder in profile_folders:
+        for profile_path in sorted(Path(profile_folder).glob("*.prof")):
+            # `pstats` keys functions by (file, line, function)
+            for (file_name, line, name), (
+                _,
+                calls,
+                self_seconds,
+                cumulative_seconds,
+                _,
+            ) in pstats.Stats(str(profile_path)).stats.items():
+                function = row(f"{file_name}:{line}({name})")
+                function["calls"] += calls
+                function["self_seconds"] += self_seconds
+                function["cumulative_seconds"] += cumulative_seconds
+                function["profiles"] += 1
+        for samples_path in sorted(Path(profile_folder).glob("*.samples.json")):
+            with open(samples_path) as samples_file:
+                samples = json.load(samples_file)
+            for name, count in samples["total"].items():
+                function = row(name)
+                function["cumulative_seconds"] += count * samples["interval"]
+                function["profiles"] += 1
+            for name, count in samples["self"].items():
+                row(name)["self_seconds"] += count * samples["interval"]
+    table = sorted(
+        functions.values(),
+        key=lambda function: (
+            function["self_seconds"],
+            function["cumulative_seconds"],
+        ),
+        reverse=True,
+    )
+    return table if top is None else table[:top]
+
+
+def write_hot_functions(table, csv_path):
+    """
+    Function that writes a table from `hot_functions` to a CSV file.
+
+    Arguments:
+    table | list
+    The rows from `hot_functions`.
+
+    csv_path | str or pathlib.PosixPath
+    Path to the CSV file.
+    """
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=HOT_FUNCTION_COLUMNS)
+        writer.writeheader()
+        writer.writerows(table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Merge profiles into one table of the slowest functions"
+    )
+    parser.add_argument(
+        "profile_folders", nargs="+", help="folders that contain the profiles"
+    )
+    parser.add_argument(
+        "--top", type=int, default=30, help="number of functions to show"
+    )
+    parser.add_argument("--output", help="also write the whole table to a CSV file")
+    arguments = parser.parse_args()
+
+    table = hot_functions(arguments.profile_folders)
+    if arguments.output is not None:
+        write_hot_functions(table, arguments.output)
+    print(f"{'self s':>10} {'cum. s':>10} {'calls':>10}  function")
+    for function in table[: arguments.top]:
+        print(
+            f"{function['self_seconds']:10.3f} "
+            + f"{function['cumulative_seconds']:10.3f} "
+            + f"{function['calls'] or '':>10}  {function['function']}"
+        )
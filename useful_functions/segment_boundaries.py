@@ -0,0 +1,243 @@
+# segment_boundaries.py
+# Functions that move segment boundaries into the quietest moment near each
+# 10 second mark, so that words aren't cut in half
+
+# Packages
+import numpy as np
+
+from useful_functions.voice_activity_detection import (
+    VoiceActivityDetection,
+    frame_view,
+)
+from useful_functions.wav_io import read_wav_mmap
+
+# Length in milliseconds of each frame of the energy envelope, the default
+# `VoiceActivityDetection` frame. It is converted to samples with the sample
+# rate of each file, like the VAD frames
+FRAME_MS = 10
+
+
+def envelope_frame_sizes(sample_rate, frame_ms=FRAME_MS, hop_ms=None):
+    """
+    Function that converts the frame length and hop of the energy envelope
+    to samples, the same way `VoiceActivityDetection` does.
+
+    Arguments:
+    sample_rate | int
+    Number of samples per second.
+
+    frame_ms | float
+    Length of each frame in milliseconds.
+
+    hop_ms | float
+    Milliseconds between the starts of two frames. The default is
+    `frame_ms`.
+
+    Returns:
+    tuple
+    The number of samples per frame and between the starts of two frames.
+    """
+    vad = VoiceActivityDetection(
+        sample_rate=sample_rate, frame_ms=frame_ms, hop_ms=hop_ms
+    )
+    return vad.frame_size, vad.hop_size
+
+
+def energy_envelope(blocks, sample_rate, frame_ms=FRAME_MS, hop_ms=None):
+    """
+    Function that computes the energy of every frame of a recording with
+    `VoiceActivityDetection.frame_energies`. The recording can be passed in
+    several consecutive blocks (e.g. memory mapped chunk files); frames run
+    across the seams between blocks as if the blocks were joined.
+
+    Arguments:
+    blocks | iterable
+    Consecutive arrays of audio data, like `scipy.io.wavfile.read` returns.
+
+    sample_rate | int
+    Number of samples per second.
+
+    frame_ms | float
+    Length of each frame in milliseconds. Pass the `frame_ms` and `hop_ms`
+    of the silence removal so that the frames line up with the VAD frames.
+
+    hop_ms | float
+    Milliseconds between the starts of two frames. The default is
+    `frame_ms`.
+
+    Returns:
+    numpy.ndarray
+    The energy of each whole frame; frame `i` starts at sample
+    `i * hop_size` (see `envelope_frame_sizes`).
+    """
+    vad = VoiceActivityDetection(
+        sample_rate=sample_rate, frame_ms=frame_ms, hop_ms=hop_ms
+    )
+    frame_size, hop_size = vad.frame_size, vad.hop_size
+    levels = []
+    # Samples from the start of the first frame that isn't computed yet
+    leftover = None
+    for data in blocks:
+        if data.ndim == 1:
+            data = data.reshape(len(data), 1)
+        # Complete the frames that start in the samples the previous block
+        # ended with, copying less than one frame of this block
+        if leftover is not None and len(leftover):
+            joined = np.concatenate([leftover, data[: frame_size - 1]])
+            seam_frames = min(
+                -(-len(leftover) // hop_size),
+                max(0, (len(joined) - frame_size) // hop_size + 1),
+            )
+            if seam_frames:
+                levels.append(
+                    vad.frame_energies(
+                        frame_view(joined, seam_frames, frame_size, hop_size)
+                    )[1]
+                )
+            if seam_frames * hop_size < len(leftover):
+                # The block is too short to complete them, wait for the next
+                leftover = joined[seam_frames * hop_size :]
+                continue
+            data = data[seam_frames * hop_size - len(leftover) :]
+        number_of_frames = max(0, (len(data) - frame_size) // hop_size + 1)
+        if number_of_frames:
+            levels.append(
+                vad.frame_energies(
+                    frame_view(data, number_of_frames, frame_size, hop_size)
+                )[1]
+            )
+        leftover = data[number_of_frames * hop_size :]
+    if not levels:
+        return np.zeros(0)
+    return np.concatenate(levels)
+
+
+def silence_cut_points(
+    envelope,
+    sample_rate,
+    segment_seconds=10,
+    tolerance_seconds=1,
+    frame_ms=FRAME_MS,
+    hop_ms=None,
+    number_of_samples=None,
+):
+    """
+    Function that finds where to cut a recording into segments of about
+    `segment_seconds`. Each cut is made in the middle of the quietest frame
+    within `tolerance_seconds` of a multiple of `segment_seconds`, so segments
+    can be up to `2 * tolerance_seconds` longer or shorter than
+    `segment_seconds`. All windows are searched at once with a single argmin.
+
+    Arguments:
+    envelope | numpy.ndarray
+    Frame energies from `energy_envelope`.
+
+    sample_rate | int
+    Number of samples per second.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    tolerance_seconds | float
+    How far a cut may move from its 10 second mark; it must be less than half
+    of `segment_seconds` so that the cuts stay in order.
+
+    frame_ms | float
+    Length of each frame of `envelope` in milliseconds.
+
+    hop_ms | float
+    Milliseconds between the starts of two frames of `envelope`. The default
+    is `frame_ms`.
+
+    number_of_samples | int
+    The length of the recording in samples. The default is the number of
+    samples covered by whole frames of `envelope`.
+
+    Returns:
+    list
+    The sample offsets to cut at, one for each whole multiple of
+    `segment_seconds` in the recording (the same number of cuts as fixed
+    boundaries).
+    """
+    if not 0 <= tolerance_seconds < segment_seconds / 2:
+        raise Exception(
+            f"Error, tolerance_seconds: {tolerance_seconds} must be at least 0 "
+            + f"and less than half of segment_seconds: {segment_seconds}."
+        )
+    frame_size, hop_size = envelope_frame_sizes(sample_rate, frame_ms, hop_ms)
+    segment_length = int(segment_seconds * sample_rate)
+    if number_of_samples is None:
+        number_of_samples = (
+            (len(envelope) - 1) * hop_size + frame_size if len(envelope) else 0
+        )
+    number_of_cuts = number_of_samples // segment_length
+    if not number_of_cuts or not len(envelope):
+        return []
+
+    # Last frame that starts at or before each 10 second mark, and the
+    # tolerance in frames
+    marks = np.arange(1, number_of_cuts + 1) * segment_length
+    targets = marks // hop_size
+    tolerance = int(round(tolerance_seconds * sample_rate / hop_size))
+    # Pad with infinite energy so windows at the end never pick a frame that
+    # doesn't exist, then look at every window in one array of views
+    padded = np.concatenate(
+        [np.full(tolerance, np.inf), envelope, np.full(tolerance + 1, np.inf)]
+    )
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * tolerance + 1)
+    # Window `t` of the padded envelope is centered on frame `t`
+    choice = np.argmin(windows[targets], axis=1)
+    cuts = (targets - tolerance + choice) * hop_size + frame_size // 2
+    # A window past the last whole frame has nothing to choose from, so cut at
+    # the mark itself
+    no_frames = np.isinf(windows[targets, choice])
+    cuts[no_frames] = np.minimum(marks[no_frames], number_of_samples)
+    return cuts.tolist()
+
+
+def find_silence_cut_points(
+    wav_paths, segment_seconds=10, tolerance_seconds=1, frame_ms=FRAME_MS, hop_ms=None
+):
+    """
+    Function that runs `silence_cut_points` on `.wav` files as if they were
+    joined, reading them memory mapped.
+
+    Arguments:
+    wav_paths | list
+    Paths to the `.wav` files, in order.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    tolerance_seconds | float
+    How far a cut may move from its 10 second mark.
+
+    frame_ms | float
+    Length of each frame of the energy envelope in milliseconds.
+
+    hop_ms | float
+    Milliseconds between the starts of two frames. The default is
+    `frame_ms`.
+
+    Returns:
+    list
+    The sample offsets to cut at, for `wav_io.write_wav_segments` or
+    `wav_io.stream_wav_segments`.
+    """
+    wavs = [read_wav_mmap(wav_path) for wav_path in wav_paths]
+    sample_rate = wavs[0][0]
+    envelope = energy_envelope(
+        (audio_data for _, audio_data in wavs),
+        sample_rate,
+        frame_ms=frame_ms,
+        hop_ms=hop_ms,
+    )
+    return silence_cut_points(
+        envelope,
+        sample_rate=sample_rate,
+        segment_seconds=segment_seconds,
+        tolerance_seconds=tolerance_seconds,
+        frame_ms=frame_ms,
+        hop_ms=hop_ms,
+        number_of_samples=sum(len(audio_data) for _, audio_data in wavs),
+    )
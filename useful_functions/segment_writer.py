@@ -0,0 +1,246 @@
+# segment_writer.py
+# Writes audio into fixed length (or silence-aware) `.wav` segments as the
+# samples arrive, e.g. straight from silence removal
+
+# Packages
+from pathlib import Path
+import numpy as np
+import wave
+
+from useful_functions.segment_boundaries import (
+    FRAME_MS,
+    energy_envelope,
+    envelope_frame_sizes,
+)
+from useful_functions.wav_io import PCM_DTYPES
+
+
+class SegmentWriter:
+    """
+    Splits a stream of audio data into `{output_stem}_{i}.wav` files. The
+    segments are the same as writing the whole stream to a `.wav` file and
+    passing it to `wav_io.write_wav_segments`, with the cut points of
+    `segment_boundaries.find_silence_cut_points` in "silence" mode. Only the
+    samples within the tolerance of the next cut are held in memory.
+
+    Arguments:
+    output_folder | str or pathlib.PosixPath
+    Folder to write the segments into.
+
+    output_stem | str
+    Start of the segment file names.
+
+    sample_rate | int
+    Number of samples per second.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    boundaries | str
+    "fixed" cuts every `segment_seconds`. "silence" moves each cut to the
+    quietest moment within `tolerance_seconds` of it.
+
+    tolerance_seconds | float
+    How far a cut may move in "silence" mode.
+
+    frame_ms | float
+    Length in milliseconds of each frame of the energy envelope that the
+    quietest moment is found in, e.g. the `frame_ms` of the silence removal.
+
+    hop_ms | float
+    Milliseconds between the starts of two frames of the energy envelope.
+    The default is `frame_ms`.
+
+    processed_path | str or pathlib.PosixPath
+    If given, the whole stream is also written to this `.wav` file.
+
+    Example:
+    with SegmentWriter(folder, "video_processed", 16000) as writer:
+        for block in blocks:
+            writer.write(block)
+    segment_paths = writer.segment_paths
+    """
+
+    def __init__(
+        self,
+        output_folder,
+        output_stem,
+        sample_rate,
+        segment_seconds=10,
+        boundaries="fixed",
+        tolerance_seconds=1,
+        frame_ms=FRAME_MS,
+        hop_ms=None,
+        processed_path=None,
+    ):
+        if boundaries not in ["fixed", "silence"]:
+            raise Exception(f"Error, {boundaries} is not a boundary mode!")
+        if boundaries == "silence" and not (
+            0 <= tolerance_seconds < segment_seconds / 2
+        ):
+            raise Exception(
+                f"Error, tolerance_seconds: {tolerance_seconds} must be at "
+                + "least 0 and less than half of segment_seconds: "
+                + f"{segment_seconds}."
+            )
+        self.__output_folder = output_folder
+        self.__output_stem = output_stem
+        self.__sample_rate = sample_rate
+        self.__segment_length = int(segment_seconds * sample_rate)
+        self.__boundaries = boundaries
+        self.__frame_ms = frame_ms
+        self.__hop_ms = hop_ms
+        self.__frame_size, self.__hop_size = envelope_frame_sizes(
+            sample_rate, frame_ms, hop_ms
+        )
+        self.__tolerance = int(
+            round(tolerance_seconds * sample_rate / self.__hop_size)
+        )
+        self.__processed_path = processed_path
+
+        # Set from the first block of audio data
+        self.__params = None
+        self.__processed_file = None
+        self.__segment_file = None
+        self.segment_paths = []
+        # Samples received so far, the next 10 second mark, and the samples
+        # held back around it
+        self.__position = 0
+        self.__mark = self.__segment_length
+        self.__pending = []
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __window(self):
+        # Samples around the next mark in which the cut can be made. In
+        # "silence" mode these are the frames that `silence_cut_points`
+        # searches, in "fixed" mode the cut is at the mark itself
+        if self.__boundaries == "fixed":
+            return self.__mark, self.__mark
+        target = self.__mark // self.__hop_size
+        return (
+            (target - self.__tolerance) * self.__hop_size,
+            (target + self.__tolerance) * self.__hop_size + self.__frame_size,
+        )
+
+    def __open(self, samples):
+        # Use the format of the first samples for every output file
+        channels = 1 if samples.ndim == 1 else samples.shape[1]
+        sample_width = {dtype: width for width, dtype in PCM_DTYPES.items()}.get(
+            samples.dtype
+        )
+        if sample_width is None:
+            raise Exception(f"Error, {samples.dtype} audio can't be segmented!")
+        self.__params = (channels, sample_width, self.__sample_rate)
+        if self.__processed_path is not None:
+            self.__processed_file = self.__new_file(self.__processed_path)
+        self.__next_segment()
+
+    def __new_file(self, file_path):
+        wav_file = wave.open(str(file_path), "wb")
+        channels, sample_width, sample_rate = self.__params
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(sample_width)
+        wav_file.setframerate(sample_rate)
+        return wav_file
+
+    def __next_segment(self):
+        # Close the segment that is finished and start the next one
+        if self.__segment_file is not None:
+            self.__segment_file.close()
+        self.segment_paths.append(
+            Path(
+                self.__output_folder,
+                f"{self.__output_stem}_{len(self.segment_paths)}.wav",
+            )
+        )
+        self.__segment_file = self.__new_file(self.segment_paths[-1])
+
+    def __cut(self, window_start):
+        # Cut the held back samples at the quietest frame and start the next
+        # segment
+        held_back = (
+            np.concatenate(self.__pending) if self.__pending else np.zeros(0)
+        )
+        self.__pending = []
+        envelope = (
+            energy_envelope(
+                [held_back],
+                self.__sample_rate,
+                frame_ms=self.__frame_ms,
+                hop_ms=self.__hop_ms,
+            )
+            if len(held_back)
+            else []
+        )
+        if self.__boundaries == "fixed" or not len(envelope):
+            cut = min(self.__mark, self.__position) - window_start
+        else:
+            cut = (
+                int(np.argmin(envelope)) * self.__hop_size + self.__frame_size // 2
+            )
+        self.__segment_file.writeframesraw(held_back[:cut].tobytes())
+        self.__next_segment()
+        self.__segment_file.writeframesraw(held_back[cut:].tobytes())
+        self.__mark += self.__segment_length
+
+    def write(self, samples):
+        """
+        Add audio data to the segments.
+
+        Arguments:
+        samples | numpy.ndarray
+        The next samples of the stream, e.g. from
+        `VoiceActivityDetection.pop_voice_samples`.
+        """
+        if self.__params is None:
+            self.__open(samples)
+        if self.__processed_file is not None:
+            self.__processed_file.writeframesraw(samples.tobytes())
+        while len(samples):
+            window_start, window_end = self.__window()
+            if self.__position < window_start:
+                # Samples that are certainly in the current segment
+                taken = samples[: window_start - self.__position]
+                self.__segment_file.writeframesraw(taken.tobytes())
+            else:
+                taken = samples[: window_end - self.__position]
+                self.__pending.append(taken)
+            samples = samples[len(taken) :]
+            self.__position += len(taken)
+            if self.__position == window_end:
+                self.__cut(window_start)
+
+    def close(self):
+        """
+        Write out the held back samples and close the files.
+
+        Returns:
+        list
+        The paths of the segments.
+        """
+        if self.__closed:
+            return self.segment_paths
+        self.__closed = True
+        if self.__params is None:
+            # No audio at all: write a single empty segment, like
+            # `write_wav_segments` does for an empty file
+            self.__open(np.zeros(0, dtype=np.int16))
+        window_start, _ = self.__window()
+        if self.__position >= self.__mark:
+            # The stream ended inside the window of a cut that still exists
+            self.__cut(window_start)
+        else:
+            for held_back in self.__pending:
+                self.__segment_file.writeframesraw(held_back.tobytes())
+            self.__pending = []
+        self.__segment_file.close()
+        if self.__processed_file is not None:
+            self.__processed_file.close()
+            self.__processed_file = None
+        return self.segment_paths
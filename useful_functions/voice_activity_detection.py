@@ -0,0 +1,666 @@
+# voice_activity_detection.py
+# Adaptive voice activity detection shared by the silence removal scripts
+
+# Packages
+import logging
+import numpy as np
+import scipy.io.wavfile as wf
+import wave
+
+from useful_functions.analysis_front_end import AnalysisFrontEnd
+from useful_functions.wav_io import PCM_DTYPES, read_wav_blocks, read_wav_mmap
+
+
+class VoiceActivityDetection:
+    """
+    Adaptive voice activity detection that keeps the speech frames of a
+    recording and drops the frames after a stretch of silence. The frame
+    length, the hop between frames and the hangover are set in milliseconds
+    and converted to samples with the sample rate of the recording, so that
+    they mean the same thing at every sample rate.
+
+    Arguments:
+    sample_rate | int
+    Number of samples per second of the recording. With the default of 16000
+    the frames are the 160 samples of the original script.
+
+    frame_ms | float
+    Length of each frame in milliseconds. Longer frames mean fewer frames to
+    process, but a coarser cut around the speech.
+
+    hop_ms | float
+    Milliseconds between the starts of two frames. The default is
+    `frame_ms`, so the frames don't overlap. With a shorter hop the frames
+    overlap, and each frame decides whether the `hop_ms` of audio at its
+    start are kept.
+
+    hangover_ms | float
+    How long the audio is kept after the last loud frame before the silence
+    is cut.
+
+    analysis_rate | int
+    If given, `process_batch` finds the speech frames in a mono copy of the
+    audio resampled to this rate (see `AnalysisFrontEnd`) and keeps the same
+    stretches of time of the original audio. The frame sizes are then in
+    samples of the copy. This is much less work for 44.1 or 48 kHz stereo
+    audio, and the kept audio is still the original.
+
+    Example:
+    vad = VoiceActivityDetection(sample_rate=48000, frame_ms=20, hop_ms=10)
+    vad.process_batch(audio_data)
+    voice_samples = vad.get_voice_samples()
+    """
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        frame_ms=10,
+        hop_ms=None,
+        hangover_ms=600,
+        analysis_rate=None,
+    ):
+        if hop_ms is None:
+            hop_ms = frame_ms
+        # The front end that makes the mono copy, and the number of its
+        # samples that came before `__buffer`, `__analysis_buffer` and the
+        # number of frames decided so far
+        self.__front_end = None
+        if analysis_rate is not None:
+            self.__front_end = AnalysisFrontEnd(sample_rate, analysis_rate)
+            sample_rate = analysis_rate
+        self.__analysis_buffer = np.zeros(0)
+        self.__buffer_start = 0
+        self.__frames_done = 0
+        # Frame length, hop and hangover in samples and frames
+        self.frame_size = int(round(frame_ms * sample_rate / 1000))
+        self.hop_size = int(round(hop_ms * sample_rate / 1000))
+        if not 1 <= self.hop_size <= self.frame_size:
+            raise Exception(
+                f"Error, hop_ms: {hop_ms} must be at least one sample and at "
+                + f"most frame_ms: {frame_ms}."
+            )
+        if hangover_ms < 0:
+            raise Exception(f"Error, hangover_ms: {hangover_ms} is lower than 0.")
+        self.hangover_frames = int(
+            round(hangover_ms * sample_rate / 1000 / self.hop_size)
+        )
+        self.__step = self.hop_size
+        self.__buffer_size = self.frame_size
+        self.__buffer = np.zeros(shape=(0, 2), dtype=np.int16)
+        # The kept samples are the first `__out_length` rows of
+        # `__out_buffer`, which grows by doubling so that every kept sample is
+        # only copied a few times
+        self.__out_buffer = np.zeros(shape=(0, 2), dtype=np.int16)
+        self.__out_length = 0
+        self.__n = 0
+        self.__VADthd = 0.0  # Period used to convert to floating point number
+        self.__VADn = 0.0
+        self.__silence_counter = 0
+        self.__channels = 0  # Number of audio channels
+
+    # Voice Activity Detection
+    # Adaptive threshold
+    def vad(self, _frame, threshold=0.1):
+        # Each _frame consists of `frame_size` amplitude measurements, which
+        # overlap with the next frame if the hop is shorter
+
+        # Check that the threshold is between 0 and 1
+        if threshold < 0:
+            raise Exception(f"Error, threshold: {threshold} is lower than 0.")
+        elif threshold > 1:
+            raise Exception(f"Error, threshold: {threshold} is larger than 1.")
+
+        frame = np.array(_frame) ** 2.0
+        max_frame = np.zeros(len(frame))
+        for index, array in enumerate(frame):
+            max_frame[index] = np.max(array)
+        result = True
+        threshold = 0.02
+        thd = np.min(frame) + np.ptp(frame) * threshold
+        # This is the previous frame's thd
+        self.__VADthd = (self.__VADn * self.__VADthd + thd) / float(
+            self.__VADn + 1.0
+        )
+        self.__VADn += 1.0
+
+        # Take the mean of the maximum amplitudes across any channel
+        if np.mean(max_frame) <= self.__VADthd:
+            self.__silence_counter += 1
+        else:
+            self.__silence_counter = 0
+
+        if self.__silence_counter > self.hangover_frames:
+            result = False
+        return result
+
+    # Push new audio samples into the buffer.
+    def add_samples(self, data):
+        self.__buffer = np.append(self.__buffer, data, axis=0)
+        result = len(self.__buffer) >= self.__buffer_size
+        return result
+
+    # Pull a portion of the buffer to process (the samples of one hop are
+    # deleted after being processed)
+    def get_frame(self):
+        window = self.__buffer[: self.__buffer_size]
+        self.__buffer = self.__buffer[self.__step :]
+        return window
+
+    # Empty the output buffer, with room for `capacity` samples
+    def __reset_output(self, channels, dtype, capacity=0):
+        self.__out_buffer = np.empty(shape=(capacity, channels), dtype=dtype)
+        self.__out_length = 0
+
+    # Make room for `count` more samples at the end of the output and return
+    # the rows to write them to
+    def __reserve_output(self, count, dtype):
+        # The output takes the type that np.append would give it
+        dtype = np.result_type(self.__out_buffer.dtype, dtype)
+        length = self.__out_length + count
+        if length > len(self.__out_buffer) or dtype != self.__out_buffer.dtype:
+            out_buffer = np.empty(
+                shape=(max(length, 2 * len(self.__out_buffer)),)
+                + self.__out_buffer.shape[1:],
+                dtype=dtype,
+            )
+            out_buffer[: self.__out_length] = self.__out_buffer[
+                : self.__out_length
+            ]
+            self.__out_buffer = out_buffer
+        rows = self.__out_buffer[self.__out_length : length]
+        self.__out_length = length
+        return rows
+
+    # Adds new audio samples to the internal buffer and processes them
+    def process(self, data):
+        if self.__front_end is not None:
+            raise Exception("Error, only process_batch uses the analysis_rate!")
+        logging.debug(
+            f"First frame of audio data:\n{data[ :self.__buffer_size]}"
+        )
+        # Detects mono or stereo audio
+        self.__channels = self.get_audio_channels(data=data)
+        if self.__channels == 1:
+            logging.info("This is mono audio")
+            # Reshape data so that it works with np.append(axis = 0)
+            # and other functions that only work with 2d arrays
+            data = data.reshape(len(data), 1)
+            self.__buffer = np.zeros(shape=(0, 1), dtype=np.int16)
+            self.__reset_output(channels=1, dtype=np.int16)
+
+        elif self.__channels == 2:
+            logging.info("This is stereo audio")
+
+        if self.add_samples(data):
+            while len(self.__buffer) >= self.__buffer_size:
+                # Framing
+                window = self.get_frame()
+                # Add the hop at the start of the window if threshold is met
+                if self.vad(_frame=window, threshold=0.01):  # speech frame
+                    self.__reserve_output(self.__step, window.dtype)[:] = window[
+                        : self.__step
+                    ]
+
+    # Adds new audio samples to the internal buffer and processes every
+    # complete frame at once instead of one frame per loop iteration
+    def process_batch(self, data, threshold=0.01, frames_per_block=4096):
+        """
+        Vectorized version of `process` that gives the same output sample for
+        sample. The signal is reshaped into a matrix of frames once, the frame
+        energies and silence decisions are computed on whole blocks of frames
+        and the kept frames are gathered with a single boolean mask.
+
+        It can be called repeatedly with consecutive blocks of one recording;
+        the result is the same as passing the whole recording at once.
+
+        Arguments:
+        data | numpy.ndarray
+        Audio data from
+        `scipy.io.wavfile.read(filename = 'your_file_name')[1]`.
+
+        threshold | float
+        Passed on to the same checks as `vad`.
+
+        frames_per_block | int
+        How many frames are squared at a time; this bounds the size of the
+        temporary floating point arrays for long recordings.
+        """
+        # The buffers and the threshold state are kept between calls so that
+        # a long recording can be passed in one block at a time
+        first_block = not self.__channels
+        # Detects mono or stereo audio
+        self.__channels = self.get_audio_channels(data=data)
+        if self.__channels == 1:
+            data = data.reshape(len(data), 1)
+        if first_block:
+            logging.debug(
+                f"First frame of audio data:\n{data[ :self.__buffer_size]}"
+            )
+            if self.__channels == 1:
+                logging.info("This is mono audio")
+            elif self.__channels == 2:
+                logging.info("This is stereo audio")
+            self.__buffer = np.zeros(shape=(0, data.shape[1]), dtype=data.dtype)
+            self.__reset_output(channels=data.shape[1], dtype=data.dtype)
+
+        if self.__front_end is not None:
+            self.__process_analysis(data, threshold, frames_per_block)
+            return
+
+        # Avoid copying the whole signal when nothing is left over from an
+        # earlier call
+        if len(self.__buffer):
+            signal = np.append(self.__buffer, data, axis=0)
+        else:
+            signal = data
+        number_of_frames = max(
+            (len(signal) - self.__buffer_size) // self.__step + 1, 0
+        )
+        hop_length = number_of_frames * self.__step
+        # Samples that don't fill a whole frame stay in the buffer, like in
+        # the frame loop, from the start of the next frame
+        self.__buffer = signal[hop_length:]
+        if not number_of_frames:
+            return
+
+        # Zero copy view with shape (frames, samples per frame, channels)
+        frames = frame_view(
+            signal, number_of_frames, self.__buffer_size, self.__step
+        )
+        keep = self.vad_frames(
+            frames=frames, threshold=threshold, frames_per_block=frames_per_block
+        )
+        # Each kept frame keeps the hop at its start, copied straight to the
+        # end of the output
+        hops = signal[:hop_length].reshape(
+            number_of_frames, self.__step, signal.shape[1]
+        )
+        kept_frames = int(np.count_nonzero(keep))
+        rows = self.__reserve_output(kept_frames * self.__step, signal.dtype)
+        np.compress(
+            keep,
+            hops,
+            axis=0,
+            out=rows.reshape(kept_frames, self.__step, signal.shape[1]),
+        )
+
+    # Finds the speech frames in the mono analysis copy and keeps the same
+    # stretches of time of the original audio
+    def __process_analysis(self, data, threshold, frames_per_block):
+        analysis = self.__front_end.push(data)
+        if len(self.__analysis_buffer):
+            analysis = np.concatenate([self.__analysis_buffer, analysis])
+        if len(self.__buffer):
+            signal = np.append(self.__buffer, data, axis=0)
+        else:
+            signal = data
+        number_of_frames = max(
+            (len(analysis) - self.__buffer_size) // self.__step + 1, 0
+        )
+        # The sample of the original audio at which each hop starts, counted
+        # from the start of `signal`
+        frame_index = np.arange(
+            self.__frames_done, self.__frames_done + number_of_frames + 1
+        )
+        hop_starts = (
+            frame_index * self.__step * self.__front_end.down
+        ) // self.__front_end.up - self.__buffer_start
+        # Keep what the next frames need
+        self.__analysis_buffer = analysis[number_of_frames * self.__step :]
+        self.__buffer = signal[hop_starts[-1] :]
+        self.__buffer_start += int(hop_starts[-1])
+        self.__frames_done += number_of_frames
+        if not number_of_frames:
+            return
+
+        frames = frame_view(
+            analysis.reshape(-1, 1),
+            number_of_frames,
+            self.__buffer_size,
+            self.__step,
+        )
+        keep = self.vad_frames(
+            frames=frames, threshold=threshold, frames_per_block=frames_per_block
+        )
+        # Each kept frame keeps the original samples of the hop at its start.
+        # The hops can differ in length by a sample, so the runs of kept
+        # frames are copied as slices
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], keep, [0]]).astype(int)))
+        for first, last in zip(edges[::2], edges[1::2]):
+            run = signal[hop_starts[first] : hop_starts[last]]
+            self.__reserve_output(len(run), run.dtype)[:] = run
+
+    # Voice Activity Detection on a matrix of frames
+    def vad_frames(self, frames, threshold=0.1, frames_per_block=4096):
+        """
+        Function that applies `vad` to every frame of a frame matrix and
+        returns a boolean array that is True for the speech frames.
+
+        Arguments:
+        frames | numpy.ndarray
+        Array with the shape (frames, samples per frame, channels).
+
+        threshold | float
+        Checked the same way as in `vad`.
+
+        frames_per_block | int
+        How many frames are squared at a time.
+
+        Returns:
+        numpy.ndarray
+        Boolean array with one element per frame.
+        """
+        # Check that the threshold is between 0 and 1
+        if threshold < 0:
+            raise Exception(f"Error, threshold: {threshold} is lower than 0.")
+        elif threshold > 1:
+            raise Exception(f"Error, threshold: {threshold} is larger than 1.")
+
+        frame_thd, frame_level = self.frame_energies(
+            frames=frames, frames_per_block=frames_per_block
+        )
+        return self.keep_frames(frame_thd=frame_thd, frame_level=frame_level)
+
+    def keep_frames(self, frame_thd, frame_level):
+        """
+        Function that makes the speech decisions from the values that
+        `frame_energies` computed, carrying the running threshold and the
+        silence counter over from earlier calls. The frame energies can
+        therefore be computed in parallel and passed in order afterwards.
+
+        Arguments:
+        frame_thd | numpy.ndarray
+        The threshold of each frame.
+
+        frame_level | numpy.ndarray
+        The level of each frame.
+
+        Returns:
+        numpy.ndarray
+        Boolean array with one element per frame.
+        """
+        if not len(frame_thd):
+            return np.zeros(0, dtype=bool)
+        # Running mean of the frame thresholds. This stays a scalar recurrence
+        # so that the rounding matches `vad` exactly (a cumulative sum divided
+        # by the frame count can differ in the last bit)
+        running_thd = np.empty(len(frame_thd))
+        vad_thd = self.__VADthd
+        vad_n = self.__VADn
+        for index, thd in enumerate(frame_thd.tolist()):
+            vad_thd = (vad_n * vad_thd + thd) / float(vad_n + 1.0)
+            vad_n += 1.0
+            running_thd[index] = vad_thd
+        self.__VADthd = vad_thd
+        self.__VADn = vad_n
+
+        # Silence hangover: count the silent frames since the last loud frame
+        silent = frame_level <= running_thd
+        frame_index = np.arange(len(silent))
+        last_loud = np.maximum.accumulate(np.where(silent, -1, frame_index))
+        silence_counter = frame_index - last_loud
+        # Frames before the first loud frame continue the previous counter
+        silence_counter[last_loud < 0] += self.__silence_counter
+        self.__silence_counter = int(silence_counter[-1])
+
+        return silence_counter <= self.hangover_frames
+
+    def frame_energies(self, frames, frames_per_block=4096):
+        """
+        Function that computes the per frame values used by `vad`.
+
+        Arguments:
+        frames | numpy.ndarray
+        Array with the shape (frames, samples per frame, channels).
+
+        frames_per_block | int
+        How many frames are squared at a time.
+
+        Returns:
+        tuple
+        The threshold of each frame and the mean of the maximum squared
+        amplitude across the channels of each frame.
+        """
+        frame_thd = np.empty(len(frames))
+        frame_level = np.empty(len(frames))
+        for start in range(0, len(frames), frames_per_block):
+            stop = start + frames_per_block
+            block = frames[start:stop] ** 2.0
+            flat_block = block.reshape(len(block), -1)
+            block_min = flat_block.min(axis=1)
+            # `vad` always uses 0.02 here, whatever threshold it is given
+            frame_thd[start:stop] = (
+                block_min + (flat_block.max(axis=1) - block_min) * 0.02
+            )
+            frame_level[start:stop] = block.max(axis=2).mean(axis=1)
+        return frame_thd, frame_level
+
+    def get_voice_samples(self):
+        """
+        Function that returns the voice samples found so far, without copying
+        them. The array is a view of the output buffer, so it stays valid
+        while more samples are processed.
+
+        Returns:
+        numpy.ndarray
+        The kept samples, in the format of the input audio data.
+        """
+        voice_samples = self.__out_buffer[: self.__out_length]
+        # If mono audio, undo the earlier reshaping
+        if self.__channels == 1:
+            voice_samples = voice_samples.reshape(self.__out_length)
+            # Check that the resulting shape is 1d instead of 2d
+            logging.debug(voice_samples.shape)
+        return voice_samples
+
+    def pop_voice_samples(self):
+        """
+        Function that returns the voice samples found so far and empties the
+        output buffer, so that a long recording can be written out block by
+        block.
+
+        Returns:
+        numpy.ndarray
+        The kept samples, with the same shape as `get_voice_samples`.
+        """
+        voice_samples = self.get_voice_samples()
+        # The caller keeps the returned samples, so the next samples go to a
+        # new buffer with the same room
+        self.__reset_output(
+            channels=self.__out_buffer.shape[1],
+            dtype=self.__out_buffer.dtype,
+            capacity=len(self.__out_buffer),
+        )
+        return voice_samples
+
+    def get_audio_channels(self, data):
+        """
+        Function that takes audio data and returns the number of audio   channels as an integer.
+        
+        Arguments:
+        data | numpy.ndarray
+        Audio data from
+        `scipy.io.wavfile.read(filename = 'your_file_name')[1]`.
+        
+        Returns:
+        int
+        1 for mono audio, 2 for stereo audio
+        """
+        # Mono audio is just an array
+        if len(data.shape) == 1:
+            return 1
+        # However stereo audio is an array of arrays where each inner array
+        # is the audio of both sides at that particular time point
+        elif data.shape[1] == 2:
+            return 2
+        else:
+            raise Exception("Error, data is neither mono or stereo!")
+
+
+def frame_view(signal, number_of_frames, frame_size, hop_size):
+    """
+    Function that returns the frames of a signal without copying it.
+
+    Arguments:
+    signal | numpy.ndarray
+    Array with one row per sample and one column per channel.
+
+    number_of_frames | int
+    The number of frames, which must fit in the signal.
+
+    frame_size | int
+    The number of samples per frame.
+
+    hop_size | int
+    The number of samples between the starts of two frames. Frames overlap
+    if it is smaller than `frame_size`.
+
+    Returns:
+    numpy.ndarray
+    View with the shape (frames, samples per frame, channels).
+    """
+    if hop_size == frame_size:
+        return signal[: number_of_frames * frame_size].reshape(
+            number_of_frames, frame_size, signal.shape[1]
+        )
+    # The windows come out with the shape (positions, channels, samples)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        signal[: (number_of_frames - 1) * hop_size + frame_size],
+        frame_size,
+        axis=0,
+    )
+    return windows[::hop_size].transpose(0, 2, 1)
+
+
+def stream_silence_removal(
+    input_path,
+    output_path,
+    block_size=1048576,
+    frame_ms=10,
+    hop_ms=None,
+    hangover_ms=600,
+    analysis_rate=None,
+):
+    """
+    Function that removes silences from a `.wav` file without loading the
+    whole file into memory. The input is read in blocks, the threshold and
+    silence counter of the `VoiceActivityDetection` carry over from one block
+    to the next, and the kept frames are appended to the output `.wav` file
+    after every block. The output is the same as reading the whole file with
+    `scipy.io.wavfile.read` and calling `VoiceActivityDetection.process_batch`.
+
+    Only 8, 16 and 32 bit integer PCM files are read in blocks. Other files
+    that `scipy.io.wavfile.read` can read, like 32 bit float files (and files
+    in the WAVE_FORMAT_EXTENSIBLE format before Python 3.12), are memory mapped
+    and processed at once instead, so the kept audio is held in memory.
+
+    Arguments:
+    input_path | str or pathlib.PosixPath
+    Path to the `.wav` file you want to remove silences from.
+
+    output_path | str or pathlib.PosixPath
+    Path of the `.wav` file that the kept audio is written to.
+
+    block_size | int
+    Number of samples (per channel) read at a time; this sets the peak memory
+    use.
+
+    frame_ms, hop_ms, hangover_ms, analysis_rate | float
+    The settings of the `VoiceActivityDetection`.
+
+    Returns:
+    int
+    The number of samples (per channel) written to `output_path`.
+    """
+    vad_parameters = {
+        "frame_ms": frame_ms,
+        "hop_ms": hop_ms,
+        "hangover_ms": hangover_ms,
+        "analysis_rate": analysis_rate,
+    }
+    try:
+        input_file = wave.open(str(input_path), "rb")
+    except wave.Error:
+        input_file = None
+    if input_file is None or input_file.getsampwidth() not in PCM_DTYPES:
+        # `wave` can't read the samples, use the memory mapped path
+        if input_file is not None:
+            input_file.close()
+        logging.info(f"Unable to read {input_path} in blocks, memory mapping it")
+        sample_rate, audio_data = read_wav_mmap(input_path)
+        vad = VoiceActivityDetection(sample_rate=sample_rate, **vad_parameters)
+        vad.process_batch(audio_data)
+        voice_samples = vad.get_voice_samples()
+        wf.write(str(output_path), sample_rate, voice_samples)
+        logging.info(f"Samples written to {output_path}: {len(voice_samples)}")
+        return len(voice_samples)
+
+    with input_file:
+        return remove_silences_from_blocks(
+            blocks=read_wav_blocks(wav_file=input_file, block_size=block_size),
+            output_path=output_path,
+            sample_rate=input_file.getframerate(),
+            **vad_parameters,
+        )
+
+
+def remove_silences_from_blocks(
+    blocks,
+    output_path,
+    sample_rate,
+    frame_ms=10,
+    hop_ms=None,
+    hangover_ms=600,
+    analysis_rate=None,
+):
+    """
+    Function that removes silences from consecutive blocks of one recording
+    and appends the kept frames to a `.wav` file after every block, so only
+    one block is held in memory at a time.
+
+    Arguments:
+    blocks | iterable
+    Blocks of audio data in the format of `scipy.io.wavfile.read`, for
+    example from `read_wav_blocks` or
+    `useful_functions.decode_audio.decode_audio_blocks`.
+
+    output_path | str or pathlib.PosixPath
+    Path of the `.wav` file that the kept audio is written to.
+
+    sample_rate | int
+    The sample rate of the recording.
+
+    frame_ms, hop_ms, hangover_ms, analysis_rate | float
+    The settings of the `VoiceActivityDetection`.
+
+    Returns:
+    int
+    The number of samples (per channel) written to `output_path`.
+    """
+    vad = VoiceActivityDetection(
+        sample_rate=sample_rate,
+        frame_ms=frame_ms,
+        hop_ms=hop_ms,
+        hangover_ms=hangover_ms,
+        analysis_rate=analysis_rate,
+    )
+    samples_written = 0
+    header_set = False
+    with wave.open(str(output_path), "wb") as output_file:
+        output_file.setframerate(sample_rate)
+        for block in blocks:
+            # The format of the output comes from the first block
+            if not header_set:
+                output_file.setnchannels(vad.get_audio_channels(data=block))
+                output_file.setsampwidth(block.dtype.itemsize)
+                header_set = True
+            vad.process_batch(block)
+            voice_samples = vad.pop_voice_samples()
+            output_file.writeframes(voice_samples.tobytes())
+            samples_written += len(voice_samples)
+        # An empty recording still needs a valid header
+        if not header_set:
+            output_file.setnchannels(1)
+            output_file.setsampwidth(2)
+    logging.info(f"Samples written to {output_path}: {samples_written}")
+    return samples_written
@@ -0,0 +1,416 @@
+# wav_io.py
+# Functions for reading `.wav` files without decoding them all at once
+
+# Packages
+from pathlib import Path
+import logging
+import itertools
+import mmap
+import numpy as np
+import os
+import re
+import scipy.io.wavfile as wf
+import struct
+import wave
+
+# NumPy data types for the PCM sample widths (in bytes) of `.wav` files
+PCM_DTYPES = {1: np.dtype("u1"), 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+
+
+def read_wav_blocks(wav_file, block_size=1048576):
+    """
+    Generator that reads a PCM `.wav` file in blocks of samples.
+
+    Arguments:
+    wav_file | wave.Wave_read
+    A `.wav` file opened with `wave.open(filename, "rb")`.
+
+    block_size | int
+    The number of samples (per channel) in each block.
+
+    Yields:
+    numpy.ndarray
+    Audio data in the same format as `scipy.io.wavfile.read`: an array of
+    amplitudes for mono audio, an array with one row per sample for stereo
+    audio.
+    """
+    sample_width = wav_file.getsampwidth()
+    if sample_width not in PCM_DTYPES:
+        raise Exception(
+            f"Error, {8 * sample_width} bit .wav files are not supported!"
+        )
+    channels = wav_file.getnchannels()
+    while True:
+        raw_block = wav_file.readframes(block_size)
+        if not raw_block:
+            break
+        block = np.frombuffer(raw_block, dtype=PCM_DTYPES[sample_width])
+        if channels > 1:
+            block = block.reshape(-1, channels)
+        yield block
+
+
+def read_wav_mmap(wav_path):
+    """
+    Function that memory maps the samples of a PCM `.wav` file instead of
+    copying them into memory. The returned array is a read only view of the
+    file, so the operating system's page cache is reused when several stages
+    read the same file.
+
+    Arguments:
+    wav_path | str or pathlib.PosixPath
+    Path to the `.wav` file.
+
+    Returns:
+    tuple
+    The sample rate and the audio data, like `scipy.io.wavfile.read`.
+    """
+    try:
+        return wf.read(str(wav_path), mmap=True)
+    except ValueError:
+        # Formats like 24 bit audio can't be memory mapped by scipy
+        logging.info(f"Unable to memory map {wav_path}, reading it instead")
+        return wf.read(str(wav_path))
+
+
+def split_samples(data, sample_rate, segment_seconds=10):
+    """
+    Function that splits audio data into segments of `segment_seconds`, cut at
+    sample offsets. The segments are views of `data`, nothing is copied. Like
+    the pydub based segmentation, the last segment holds the remainder (and is
+    empty if the length is a multiple of the segment length).
+
+    Arguments:
+    data | numpy.ndarray
+    Audio data, for example from `read_wav_mmap`.
+
+    sample_rate | int
+    Number of samples per second.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    Returns:
+    list
+    The segments as arrays.
+    """
+    segment_length = int(segment_seconds * sample_rate)
+    number_of_segments = len(data) // segment_length
+    return [
+        data[i * segment_length : (i + 1) * segment_length]
+        for i in range(number_of_segments + 1)
+    ]
+
+
+# `.wav` format tags that `wav_header` can write
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+
+
+def read_wav_layout(wav_path):
+    """
+    Function that reads the header chunks of a `.wav` file to find where its
+    samples are, without reading the samples.
+
+    Arguments:
+    wav_path | str or pathlib.PosixPath
+    Path to the `.wav` file.
+
+    Returns:
+    dict
+    The "format_tag", "sample_rate", "channels", "sample_width" (bytes per
+    sample and channel), "data_offset" and "data_size" (in bytes) of the file.
+    """
+    with open(wav_path, "rb") as wav_file:
+        riff, _, wave_id = struct.unpack("<4sI4s", wav_file.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise Exception(f"Error, {wav_path} is not a .wav file!")
+        layout = {}
+        while True:
+            chunk_header = wav_file.read(8)
+            if len(chunk_header) < 8:
+                raise Exception(f"Error, {wav_path} has no data chunk!")
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            if chunk_id == b"fmt ":
+                fmt = wav_file.read(chunk_size)
+                format_tag, channels, sample_rate = struct.unpack("<HHI", fmt[:8])
+                bits_per_sample = struct.unpack("<H", fmt[14:16])[0]
+                layout.update(
+                    format_tag=format_tag,
+                    sample_rate=sample_rate,
+                    channels=channels,
+                    sample_width=bits_per_sample // 8,
+                )
+                # Chunks are padded to an even number of bytes
+                wav_file.seek(chunk_size % 2, 1)
+            elif chunk_id == b"data":
+                if "format_tag" not in layout:
+                    raise Exception(f"Error, {wav_path} has no fmt chunk!")
+                layout.update(data_offset=wav_file.tell(), data_size=chunk_size)
+                # Writers that were interrupted can leave a wrong data size
+                file_size = os.fstat(wav_file.fileno()).st_size
+                layout["data_size"] = min(chunk_size, file_size - wav_file.tell())
+                return layout
+            else:
+                wav_file.seek(chunk_size + chunk_size % 2, 1)
+
+
+def wav_header(format_tag, sample_rate, channels, sample_width, data_size):
+    """
+    Function that builds the 44 byte header of a `.wav` file with `data_size`
+    bytes of samples, the same header that `scipy.io.wavfile.write` writes.
+
+    Returns:
+    bytes
+    """
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        36 + data_size + data_size % 2,
+        b"WAVE",
+        b"fmt ",
+        16,
+        format_tag,
+        channels,
+        sample_rate,
+        sample_rate * block_align,
+        block_align,
+        8 * sample_width,
+        b"data",
+        data_size,
+    )
+
+
+def check_cut_points(cut_points, number_of_samples):
+    """
+    Function that checks that cut points don't make empty segments: each one
+    must come after the one before it (and after the start), and none may be
+    past the end of the audio. A cut at the very end leaves an empty last
+    segment, like fixed length segments of audio whose length is a multiple of
+    the segment length.
+
+    Arguments:
+    cut_points | list
+    Sample offsets to cut at.
+
+    number_of_samples | int
+    The length of the audio in samples.
+    """
+    previous = 0
+    for cut_point in cut_points:
+        if not previous < cut_point <= number_of_samples:
+            raise Exception(
+                f"Error, cut point {cut_point} must be after {previous} and "
+                + f"at most the length of the audio, {number_of_samples}!"
+            )
+        previous = cut_point
+
+
+def write_wav_segments(
+    wav_path, output_folder, output_stem, segment_seconds=10, cut_points=None
+):
+    """
+    Function that splits a `.wav` file into `{output_stem}_{i}.wav` files of
+    `segment_seconds`, cut at sample offsets. The samples are not decoded:
+    each segment is a header followed by a copy of its bytes from the memory
+    mapped file. Like `split_samples`, the last segment holds the remainder
+    (and is empty if the length is a multiple of the segment length).
+
+    Arguments:
+    wav_path | str or pathlib.PosixPath
+    Path to the `.wav` file.
+
+    output_folder | str or pathlib.PosixPath
+    Folder to write the segments into.
+
+    output_stem | str
+    Start of the segment file names.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    cut_points | list
+    Strictly increasing sample offsets to cut at instead of every
+    `segment_seconds`, e.g. from `segment_boundaries.silence_cut_points`. See
+    `check_cut_points`.
+
+    Returns:
+    list
+    The paths of the segments.
+    """
+    layout = read_wav_layout(wav_path)
+    if layout["format_tag"] not in [WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT]:
+        # Other formats (e.g. WAVE_FORMAT_EXTENSIBLE) are decoded and written
+        # again by scipy
+        sample_rate, audio_data = read_wav_mmap(wav_path)
+        if cut_points is None:
+            segments = split_samples(audio_data, sample_rate, segment_seconds)
+        else:
+            check_cut_points(cut_points, len(audio_data))
+            segments = np.split(audio_data, cut_points)
+        segment_paths = []
+        for i, current_segment in enumerate(segments):
+            segment_paths.append(Path(output_folder, f"{output_stem}_{i}.wav"))
+            wf.write(segment_paths[-1], sample_rate, current_segment)
+        return segment_paths
+
+    block_align = layout["channels"] * layout["sample_width"]
+    # Whole samples only, in case the file ends with a partial sample
+    number_of_samples = layout["data_size"] // block_align
+    if cut_points is None:
+        segment_length = int(segment_seconds * layout["sample_rate"])
+        cut_points = range(
+            segment_length, number_of_samples + 1, segment_length
+        )
+    else:
+        check_cut_points(cut_points, number_of_samples)
+    bounds = [0, *cut_points, number_of_samples]
+
+    segment_paths = []
+    with open(wav_path, "rb") as wav_file, mmap.mmap(
+        wav_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as wav_map:
+        for i in range(len(bounds) - 1):
+            start = layout["data_offset"] + bounds[i] * block_align
+            end = layout["data_offset"] + bounds[i + 1] * block_align
+            segment_path = Path(output_folder, f"{output_stem}_{i}.wav")
+            with open(segment_path, "wb") as segment_file:
+                segment_file.write(
+                    wav_header(
+                        layout["format_tag"],
+                        layout["sample_rate"],
+                        layout["channels"],
+                        layout["sample_width"],
+                        end - start,
+                    )
+                )
+                segment_file.write(wav_map[start:end])
+                # Pad the data chunk to an even number of bytes
+                if (end - start) % 2:
+                    segment_file.write(b"\x00")
+            segment_paths.append(segment_path)
+    return segment_paths
+
+
+def chunk_order(wav_path):
+    """
+    Sort key that orders numbered files like `name_processed_temp_2.wav`
+    numerically, so that `_10` comes after `_9`.
+    """
+    match = re.search(r"^(.*?)(\d+)\.wav$", Path(wav_path).name)
+    if match is None:
+        return Path(wav_path).name, -1
+    return match.group(1), int(match.group(2))
+
+
+def stream_wav_segments(
+    wav_paths, output_folder, output_stem, segment_seconds=10, cut_points=None
+):
+    """
+    Function that joins PCM `.wav` files, in the given order, and splits the
+    joined audio into `{output_stem}_{i}.wav` files of `segment_seconds`. The
+    samples are copied as they are read, so at most one segment is held in
+    memory. Like `split_samples`, the last segment holds the remainder (and is
+    empty if the length is a multiple of the segment length).
+
+    The segments are written under temporary names and renamed once every
+    input has been read, so the inputs can have the same names as the
+    outputs.
+
+    Arguments:
+    wav_paths | list
+    Paths to the `.wav` files, which must have the same sample rate, number
+    of channels and sample width.
+
+    output_folder | str or pathlib.PosixPath
+    Folder to write the segments into.
+
+    output_stem | str
+    Start of the segment file names.
+
+    segment_seconds | int
+    The length of each segment in seconds.
+
+    cut_points | list
+    Strictly increasing sample offsets (in the joined audio) to cut at
+    instead of every `segment_seconds`. See `check_cut_points`.
+
+    Returns:
+    list
+    The paths of the segments.
+    """
+    if not wav_paths:
+        raise Exception("Error, there are no .wav files to join!")
+    with wave.open(str(wav_paths[0]), "rb") as first_file:
+        params = first_file.getparams()
+    segment_length = int(segment_seconds * params.framerate)
+    if cut_points is None:
+        # Every `segment_seconds`, for as long as the audio lasts
+        cut_points = itertools.count(segment_length, segment_length)
+    else:
+        # A cut at the current position would stop the reading early, so
+        # check them against the length of the joined audio from the headers
+        number_of_samples = 0
+        for wav_path in wav_paths:
+            with wave.open(str(wav_path), "rb") as wav_file:
+                number_of_samples += wav_file.getnframes()
+        cut_points = list(cut_points)
+        check_cut_points(cut_points, number_of_samples)
+    cut_points = iter(cut_points)
+    # Samples written so far, and where the current segment ends (None for
+    # the last segment)
+    position = 0
+    segment_end = next(cut_points, None)
+
+    temporary_paths = []
+    segment_file = None
+
+    def next_segment():
+        # Close the segment that is full and start the next one
+        if segment_file is not None:
+            segment_file.close()
+        temporary_paths.append(
+            Path(output_folder, f".{output_stem}_{len(temporary_paths)}.wav.part")
+        )
+        new_segment = wave.open(str(temporary_paths[-1]), "wb")
+        new_segment.setparams(params)
+        return new_segment
+
+    try:
+        segment_file = next_segment()
+        for wav_path in wav_paths:
+            with wave.open(str(wav_path), "rb") as wav_file:
+                if wav_file.getparams()[:3] != params[:3]:
+                    raise Exception(
+                        f"Error, {wav_path} has a different format than "
+                        + f"{wav_paths[0]}!"
+                    )
+                while True:
+                    # Read no more than what fits in the current segment
+                    if segment_end is None:
+                        frames = wav_file.readframes(segment_length)
+                    else:
+                        frames = wav_file.readframes(segment_end - position)
+                    if not frames:
+                        break
+                    segment_file.writeframesraw(frames)
+                    position += len(frames) // (
+                        params.nchannels * params.sampwidth
+                    )
+                    if position == segment_end:
+                        segment_file = next_segment()
+                        segment_end = next(cut_points, None)
+        segment_file.close()
+    except BaseException:
+        if segment_file is not None:
+            segment_file.close()
+        for temporary_path in temporary_paths:
+            temporary_path.unlink(missing_ok=True)
+        raise
+
+    segment_paths = []
+    for i, temporary_path in enumerate(temporary_paths):
+        segment_paths.append(Path(output_folder, f"{output_stem}_{i}.wav"))
+        os.replace(temporary_path, segment_paths[-1])
+    return segment_paths